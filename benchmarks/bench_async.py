@@ -0,0 +1,75 @@
+"""
+Event loop lag while a 100k key file is loaded.
+
+A ticker task sleeps for 1ms in a loop and records how late it wakes up. The file is
+loaded by calling set_configuration_file on the loop and with aload.
+
+Full garbage collections hold the GIL while they scan every object, including the 100k
+expectations, so they block the loop whichever thread triggers them. The frozen rows move
+the objects existing before the load out of the collector with gc.freeze (Python 3.7+).
+
+Usage: python benchmarks/bench_async.py
+"""
+
+import asyncio
+import gc
+import os
+import tempfile
+import time
+
+from common import make_checker, write_ini, report
+
+KEYS = 100000
+TICK = 0.001
+
+
+async def measure(load):
+    lags = []
+    running = True
+
+    async def ticker():
+        while running:
+            start = time.perf_counter()
+            await asyncio.sleep(TICK)
+            lags.append(time.perf_counter() - start - TICK)
+
+    task = asyncio.ensure_future(ticker())
+    await asyncio.sleep(TICK)
+    start = time.perf_counter()
+    loaded = await load()
+    seconds = time.perf_counter() - start
+    running = False
+    await task
+    assert loaded
+    return seconds, max(lags)
+
+
+def run():
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        filename = write_ini(os.path.join(directory, 'bench.ini'), KEYS)
+        loop = asyncio.new_event_loop()
+        for reader in ('configparser', 'stream'):
+            checker = make_checker(KEYS)
+
+            async def blocking():
+                return checker.set_configuration_file(filename, reader=reader)
+
+            seconds, lag = loop.run_until_complete(measure(blocking))
+            rows.append(('blocking ' + reader, seconds * 1e3, lag * 1e3))
+            for budget in (0.005, 0.001):
+                for frozen in (False, True):
+                    checker = make_checker(KEYS)
+                    if frozen:
+                        gc.collect()
+                        gc.freeze()
+                    seconds, lag = loop.run_until_complete(measure(lambda: checker.aload(filename, reader=reader, budget=budget)))
+                    gc.unfreeze()
+                    rows.append(('aload {} {:g}ms{}'.format(reader, budget * 1e3, ' frozen' if frozen else ''),
+                                 seconds * 1e3, lag * 1e3))
+        loop.close()
+    report('Loading {} keys'.format(KEYS), rows, ('load', 'milliseconds', 'max lag ms'))
+
+
+if __name__ == '__main__':
+    run()
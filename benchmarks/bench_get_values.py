@@ -0,0 +1,37 @@
+"""
+Reading a group of 25 values, as a request handler does, one at a time and batched.
+
+Usage: python benchmarks/bench_get_values.py
+"""
+
+import timeit
+
+from common import make_checker, layout, report
+
+COUNT = 1000
+GROUP = 25
+NUMBER = 20000
+
+
+def run():
+    rows = []
+    pairs = [(section, key) for section, key, _ in layout(COUNT)][:GROUP]
+    sections = sorted(set(section for section, _ in pairs))
+    for thread_safe in (False, True):
+        checker = make_checker(COUNT, thread_safe=thread_safe)
+        checker.set_configuration_file('missing_bench.ini')
+        config = checker.get_accessor()
+        cases = (
+            ('get_value', lambda: [checker.get_value(s, k) for s, k in pairs]),
+            ('get_values', lambda: checker.get_values(pairs)),
+            ('get_section', lambda: [checker.get_section(s) for s in sections]),
+            ('accessor', lambda: [getattr(getattr(config, s), k) for s, k in pairs]),
+        )
+        for name, function in cases:
+            seconds = min(timeit.repeat(function, number=NUMBER, repeat=3)) / NUMBER
+            rows.append(('{}{}'.format(name, ' (safe)' if thread_safe else ''), seconds * 1e6))
+    report('Microseconds to read {} values'.format(GROUP), rows, ('method', 'microseconds'))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,42 @@
+"""
+Loading a conf.d directory of fragment files.
+
+Compares reading the fragments one after another with load_layers using a thread pool and
+a process pool.
+
+Usage: python benchmarks/bench_layers.py
+"""
+
+import concurrent.futures
+import os
+import tempfile
+
+from common import make_checker, write_ini, timed, report
+
+FRAGMENTS = 32
+KEYS = 5000
+
+
+def sequential(checker, filenames, reader):
+    for filename in filenames:
+        checker.set_configuration_file(filename, reader=reader)
+    return True
+
+
+def run():
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        filenames = [write_ini(os.path.join(directory, '{:02}.ini'.format(i)), KEYS) for i in range(FRAGMENTS)]
+        with concurrent.futures.ProcessPoolExecutor() as processes:
+            for reader in ('configparser', 'stream'):
+                seconds, _ = timed(sequential, make_checker(KEYS), filenames, reader)
+                rows.append(('sequential ' + reader, seconds * 1e3))
+                seconds, _ = timed(make_checker(KEYS).load_layers, filenames, reader=reader)
+                rows.append(('threads ' + reader, seconds * 1e3))
+                seconds, _ = timed(make_checker(KEYS).load_layers, filenames, reader=reader, executor=processes)
+                rows.append(('processes ' + reader, seconds * 1e3))
+    report('{} fragments of {} keys, {} CPUs'.format(FRAGMENTS, KEYS, os.cpu_count()), rows, ('load', 'milliseconds'))
+
+
+if __name__ == '__main__':
+    run()
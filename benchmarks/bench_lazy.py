@@ -0,0 +1,46 @@
+"""
+Loading a file and reading a share of its values, with and without lazy conversion.
+
+With lazy=True values are converted when first read, so the time to load and read should
+shrink with the share of keys which are never read.
+
+Usage: python benchmarks/bench_lazy.py
+"""
+
+import gc
+import os
+import tempfile
+
+from common import layout, make_checker, write_ini, timed, report
+
+KEYS = 20000
+SHARES = (0.01, 0.1, 0.5, 1.0)
+READERS = ('configparser', 'stream')
+REPEAT = 10
+
+
+def load_and_read(filename, reader, pairs, lazy):
+    checker = make_checker(KEYS, lazy=lazy)
+    gc.collect()
+    seconds, _ = timed(lambda: (checker.set_configuration_file(filename, reader=reader),
+                                [checker.get_value(s, k) for s, k in pairs]))
+    return seconds
+
+
+def run():
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        filename = write_ini(os.path.join(directory, 'bench.ini'), KEYS)
+        allPairs = [(section, key) for section, key, _ in layout(KEYS)]
+        for reader in READERS:
+            for share in SHARES:
+                pairs = allPairs[::int(round(1 / share))]
+                eager = min(load_and_read(filename, reader, pairs, False) for _ in range(REPEAT))
+                lazy = min(load_and_read(filename, reader, pairs, True) for _ in range(REPEAT))
+                rows.append(('{} {:g}%'.format(reader, share * 100), eager * 1e3, lazy * 1e3, eager / lazy))
+    report('Load {} keys and read a share of them (milliseconds)'.format(KEYS), rows,
+           ('reader, read', 'converted', 'lazy', 'speedup'))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,52 @@
+"""
+Cost of logging while loading a configuration file with 10k keys.
+
+Loads the same file with the configchecker logger at WARNING (the production
+setting, where debug messages are never formatted) and at DEBUG with every
+record formatted into an in-memory stream.
+
+Usage: python benchmarks/bench_logging.py
+"""
+
+import io
+import logging
+import os
+import tempfile
+
+from common import make_checker, write_ini, timed, report
+
+COUNT = 10000
+REPEAT = 5
+
+
+def load(filename, level):
+    logger = logging.getLogger('configchecker')
+    stream = io.StringIO()
+    handler = logging.StreamHandler(stream)
+    logger.addHandler(handler)
+    logger.setLevel(level)
+    best = None
+    try:
+        for _ in range(REPEAT):
+            checker = make_checker(COUNT)
+            seconds, _ = timed(checker.set_configuration_file, filename)
+            best = seconds if best is None else min(best, seconds)
+    finally:
+        logger.removeHandler(handler)
+        logger.setLevel(logging.NOTSET)
+    return best, len(stream.getvalue())
+
+
+def run():
+    logging.disable(logging.NOTSET)
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        filename = write_ini(os.path.join(directory, 'bench.ini'), COUNT)
+        for name, level in (('off (WARNING)', logging.WARNING), ('on (DEBUG)', logging.DEBUG)):
+            seconds, logged = load(filename, level)
+            rows.append((name, seconds * 1e3, logged))
+    report('set_configuration_file with {} keys'.format(COUNT), rows, ('logging', 'milliseconds', 'bytes logged'))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,64 @@
+"""
+Memory used per expectation record, measured with tracemalloc.
+
+Compares the Expectation records stored by ConfigChecker against the plain six
+key dictionaries which were used previously.
+
+Usage: python benchmarks/bench_memory.py
+"""
+
+import tracemalloc
+
+from common import layout, make_checker, SAMPLE_VALUES, report
+from configchecker import Expectation
+
+SIZES = (1000, 10000, 100000)
+
+
+def dictionary_records(count):
+    records = []
+    for section, key, data_type in layout(count):
+        records.append({
+            'section': section,
+            'key': key,
+            'value': None,
+            'data_type': data_type,
+            'default': SAMPLE_VALUES[data_type],
+            'message': None,
+            })
+    return records
+
+
+def slot_records(count):
+    return [Expectation(section, key, data_type, SAMPLE_VALUES[data_type])
+            for section, key, data_type in layout(count)]
+
+
+def measure(function, count):
+    # Section and key strings are created in both cases, build them once outside the measurement
+    list(layout(count))
+    tracemalloc.start()
+    result = function(count)
+    current, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return current, peak
+
+
+def run():
+    rows = []
+    for count in SIZES:
+        dictCurrent, _ = measure(dictionary_records, count)
+        slotCurrent, _ = measure(slot_records, count)
+        checkerCurrent, checkerPeak = measure(make_checker, count)
+        rows.append((str(count),
+                     dictCurrent / count,
+                     slotCurrent / count,
+                     checkerCurrent / count,
+                     checkerPeak / count))
+    report('Bytes per expectation (record lists include section and key strings)', rows,
+           ('expectations', 'dict records', 'Expectation', 'ConfigChecker', 'checker peak'))
+
+
+if __name__ == '__main__':
+    run()
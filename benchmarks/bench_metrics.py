@@ -0,0 +1,32 @@
+"""
+Cost of enable_metrics on set_value and on loading a file.
+
+Usage: python benchmarks/bench_metrics.py
+"""
+
+import os
+import tempfile
+import timeit
+
+from common import make_checker, write_ini, timed, report
+
+COUNT = 10000
+NUMBER = 100000
+
+
+def run():
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        filename = write_ini(os.path.join(directory, 'bench.ini'), COUNT)
+        for enabled in (False, True):
+            checker = make_checker(COUNT)
+            if enabled:
+                checker.enable_metrics(lambda metrics: None)
+            loadTime, _ = timed(checker.set_configuration_file, filename)
+            setTime = min(timeit.repeat(lambda: checker.set_value('Section_0', 'key_0', 11), number=NUMBER, repeat=3))
+            rows.append(('enabled' if enabled else 'disabled', loadTime * 1e3, setTime / NUMBER * 1e9))
+    report('Metrics overhead, {} keys'.format(COUNT), rows, ('metrics', 'load ms', 'set_value ns'))
+
+
+if __name__ == '__main__':
+    run()
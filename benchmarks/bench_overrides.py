@@ -0,0 +1,55 @@
+"""
+Applying environment variable overrides with apply_overrides.
+
+Compares apply_overrides with the manual approach it replaces: scanning the
+environment and calling set_value with a converted value for every variable
+which names an expectation. The environment also holds unrelated variables.
+
+Usage: python benchmarks/bench_overrides.py
+"""
+
+import timeit
+
+from common import layout, make_checker, report, FILE_VALUES
+
+SIZES = (100, 1000, 10000)
+OVERRIDES = 200
+UNRELATED = 100
+CONVERTERS = {int: int, float: float, bool: lambda raw: raw.lower() in ('1', 'yes', 'true', 'on'), str: str}
+
+
+def environment(count):
+    environ = {'UNRELATED_{}'.format(i): 'value' for i in range(UNRELATED)}
+    for section, key, data_type in list(layout(count))[:OVERRIDES]:
+        environ['{}__{}'.format(section.upper(), key.upper())] = FILE_VALUES[data_type]
+    return environ
+
+
+def manual(checker, expectations, environ):
+    # The names are derived while scanning, as application code typically did
+    for name, raw in environ.items():
+        for e in expectations:
+            if '{}__{}'.format(e.section.upper(), e.key.upper()) == name:
+                checker.set_value(e.section, e.key, CONVERTERS[e.data_type](raw))
+                break
+
+
+def run():
+    rows = []
+    for count in SIZES:
+        checker = make_checker(count)
+        checker.set_configuration_file('does-not-exist.ini')
+        environ = environment(count)
+        expectations = checker.get_expectations()
+        manualTime = min(timeit.repeat(lambda: manual(checker, expectations, environ), number=1, repeat=3))
+        checker = make_checker(count)
+        checker.set_configuration_file('does-not-exist.ini')
+        firstTime = min(timeit.repeat(lambda: checker.apply_overrides(environ, argv=()), number=1, repeat=1))
+        againTime = min(timeit.repeat(lambda: checker.apply_overrides(environ, argv=()), number=1, repeat=5))
+        rows.append((str(count), manualTime * 1e3, firstTime * 1e3, againTime * 1e3))
+    report('{} overrides, {} unrelated variables (milliseconds)'.format(OVERRIDES, UNRELATED), rows,
+           ('expectations', 'set_value scan', 'apply_overrides', 'names built'))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,42 @@
+"""
+Scaling of expectation registration, lookup and file synchronisation.
+
+Every operation should grow linearly with the number of expectations, that is
+the per-key cost should stay flat from 10 to 100k expectations.
+
+Usage: python benchmarks/bench_registry.py
+"""
+
+import os
+import tempfile
+
+from common import layout, make_checker, write_ini, timed, report, SAMPLE_VALUES
+from configchecker import ConfigChecker, Schema
+
+SIZES = (10, 100, 1000, 10000, 100000)
+
+
+def run():
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for count in SIZES:
+            filename = write_ini(os.path.join(directory, 'bench.ini'), count)
+            registerTime, checker = timed(make_checker, count)
+            entries = [(section, key, data_type, SAMPLE_VALUES[data_type]) for section, key, data_type in layout(count)]
+            bulkTime, _ = timed(ConfigChecker().set_expectations_bulk, entries)
+            schemaTime, _ = timed(ConfigChecker.from_schema, Schema(entries))
+            loadTime, _ = timed(checker.set_configuration_file, filename)
+            pairs = [(section, key) for section, key, _ in layout(count)]
+            lookupTime, _ = timed(lambda: [checker.get_value(s, k) for s, k in pairs])
+            rows.append((str(count),
+                         registerTime / count * 1e6,
+                         bulkTime / count * 1e6,
+                         schemaTime / count * 1e6,
+                         loadTime / count * 1e6,
+                         lookupTime / count * 1e6))
+    report('Per-expectation cost (microseconds)', rows,
+           ('expectations', 'set_expectation', 'bulk', 'from Schema', 'load file', 'get_value'))
+
+
+if __name__ == '__main__':
+    run()
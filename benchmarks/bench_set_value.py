@@ -0,0 +1,100 @@
+"""
+Throughput of set_value compared with the previous if/elif type dispatch.
+
+The legacy function reproduces the old set_value body: an index lookup, a chain
+of data_type checks with exception based int() / float() validation and the
+same debug logging call.
+
+Usage: python benchmarks/bench_set_value.py
+"""
+
+import logging
+import timeit
+
+from common import make_checker, report
+
+log = logging.getLogger('configchecker')
+COUNT = 1000
+VALUES = {int: 11, float: 1.5, bool: False, str: 'updated'}
+
+
+def _is_integer(value):
+    try:
+        int(value)
+        return True
+    except ValueError:
+        return False
+
+
+def _is_float(value):
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+def _log_update(expectation, value):
+    log.debug("Updated the value of Section [{}], Key [{}], from [{}] to [{}]".format(
+        expectation.section, expectation.key, expectation.value, value))
+
+
+def _log_failure(expectation, value):
+    log.warning("Cannot update the value of Section [{}], Key [{}], from [{}] to [{}], wrong type (type = [{}])".format(
+        expectation.section, expectation.key, expectation.value, value, expectation.data_type))
+
+
+def legacy_set_value(index, section, key, value):
+    expectation = index.get((section, key))
+    if expectation is None:
+        return False
+    if expectation.data_type is int:
+        if _is_integer(value):
+            _log_update(expectation, value)
+            expectation.value = value
+            return True
+        _log_failure(expectation, value)
+        return False
+    elif expectation.data_type is float:
+        if _is_float(value):
+            _log_update(expectation, value)
+            expectation.value = value
+            return True
+        _log_failure(expectation, value)
+        return False
+    elif expectation.data_type is bool:
+        if type(value) == bool:
+            _log_update(expectation, value)
+            expectation.value = value
+            return True
+        _log_failure(expectation, value)
+        return False
+    _log_update(expectation, value)
+    expectation.value = value
+    return True
+
+
+def run():
+    checker = make_checker(COUNT)
+    checker.set_configuration_file('does-not-exist.ini')
+    expectations = checker.get_expectations()
+    index = {(e.section, e.key): e for e in expectations}
+    rows = []
+    for data_type in (int, float, bool, str):
+        subset = [e for e in expectations if e.data_type is data_type]
+        good = VALUES[data_type]
+        legacy = min(timeit.repeat(lambda: [legacy_set_value(index, e.section, e.key, good) for e in subset], number=20, repeat=5))
+        current = min(timeit.repeat(lambda: [checker.set_value(e.section, e.key, good) for e in subset],
+                                    number=20, repeat=5))
+        calls = len(subset) * 20
+        rows.append((data_type.__name__, calls / legacy, calls / current))
+    bad = [e for e in expectations if e.data_type is int]
+    legacy = min(timeit.repeat(lambda: [legacy_set_value(index, e.section, e.key, 'x') for e in bad], number=20, repeat=5))
+    current = min(timeit.repeat(lambda: [checker.set_value(e.section, e.key, 'x') for e in bad], number=20, repeat=5))
+    rows.append(('int (invalid)', len(bad) * 20 / legacy, len(bad) * 20 / current))
+    report('set_value calls per second', rows,
+           ('type', 'legacy', 'current'))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,58 @@
+"""
+A bulk edit of many keys followed by a write, one call per key or with set_values.
+
+Compares set_value for every key followed by write_configuration_file or
+write_changes with a single set_values(write=True) call, which checks all
+values first and writes the changed lines once.
+
+Usage: python benchmarks/bench_set_values.py
+"""
+
+import os
+import tempfile
+import timeit
+
+from common import layout, make_checker, write_ini, report
+
+KEYS = 10000
+CHANGES = (50, 200)
+REPEAT = 6
+ALTERNATE_VALUES = {int: (1, 2), float: (0.5, 1.5), bool: (True, False), str: ('first', 'second')}
+
+
+def run():
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        filename = write_ini(os.path.join(directory, 'bench.ini'), KEYS)
+        checker = make_checker(KEYS)
+        checker.set_configuration_file(filename)
+        for count in CHANGES:
+            pairs = [(section, key, data_type) for section, key, data_type in list(layout(KEYS))[:count]]
+            # Alternate between two sets of values so every write changes the file
+            rounds = [{(section, key): ALTERNATE_VALUES[data_type][i % 2] for section, key, data_type in pairs}
+                      for i in range(2)]
+
+            def one_by_one(write):
+                changes = rounds[len(times) % 2]
+                for (section, key), value in changes.items():
+                    checker.set_value(section, key, value)
+                write()
+
+            def batched():
+                checker.set_values(rounds[len(times) % 2], write=True)
+
+            row = [str(count)]
+            for function in (lambda: one_by_one(checker.write_configuration_file),
+                             lambda: one_by_one(checker.write_changes),
+                             batched):
+                times = []
+                for _ in range(REPEAT):
+                    times.append(timeit.timeit(function, number=1))
+                row.append(min(times) * 1e3)
+            rows.append(tuple(row))
+    report('Changing keys of a {} key file (milliseconds)'.format(KEYS), rows,
+           ('changed keys', 'set_value+write', 'set_value+changes', 'set_values'))
+
+
+if __name__ == '__main__':
+    run()
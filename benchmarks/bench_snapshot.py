@@ -0,0 +1,34 @@
+"""
+Startup time with a binary snapshot compared to parsing the configuration file.
+
+Usage: python benchmarks/bench_snapshot.py
+"""
+
+import os
+import tempfile
+
+from common import make_checker, write_ini, timed, report
+
+SIZES = (1000, 10000, 50000)
+
+
+def run():
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        for count in SIZES:
+            filename = write_ini(os.path.join(directory, 'bench.ini'), count)
+            snapshot = os.path.join(directory, 'bench.snapshot')
+            parseTime, _ = timed(make_checker(count).set_configuration_file, filename)
+            streamTime, _ = timed(make_checker(count).set_configuration_file, filename, reader='stream')
+            checker = make_checker(count)
+            checker.set_configuration_file(filename)
+            saveTime, _ = timed(checker.save_snapshot, snapshot)
+            loadTime, loaded = timed(make_checker(count).load_snapshot, snapshot, filename)
+            assert loaded
+            rows.append((str(count), parseTime * 1e3, streamTime * 1e3, saveTime * 1e3, loadTime * 1e3,
+                         os.path.getsize(snapshot) / 1e3))
+    report('Milliseconds to load', rows, ('expectations', 'configparser', 'stream', 'save snapshot', 'load snapshot', 'snapshot KB'))
+
+
+if __name__ == '__main__':
+    run()
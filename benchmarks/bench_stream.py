@@ -0,0 +1,46 @@
+"""
+Loading a large shared file where only a few keys are declared.
+
+Compares the default ConfigParser reader with the single pass stream and mmap readers.
+
+Usage: python benchmarks/bench_stream.py
+"""
+
+import os
+import tempfile
+import tracemalloc
+
+from common import make_checker, write_ini, timed, report
+
+FILE_KEYS = 50000
+DECLARED = 40
+KEYS_PER_SECTION = 20
+EXTRA_KEYS = 30
+
+
+def load(filename, reader):
+    checker = make_checker(DECLARED, KEYS_PER_SECTION)
+    seconds, loaded = timed(checker.set_configuration_file, filename, reader=reader)
+    assert loaded
+    checker = make_checker(DECLARED, KEYS_PER_SECTION)
+    tracemalloc.start()
+    checker.set_configuration_file(filename, reader=reader)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak
+
+
+def run():
+    rows = []
+    with tempfile.TemporaryDirectory() as directory:
+        filename = write_ini(os.path.join(directory, 'bench.ini'), FILE_KEYS, KEYS_PER_SECTION, EXTRA_KEYS)
+        size = os.path.getsize(filename)
+        for reader in ('configparser', 'stream', 'mmap'):
+            seconds, peak = load(filename, reader)
+            rows.append((reader, seconds * 1e3, peak / 1e6))
+    report('{:.1f} MB file, {} declared keys'.format(size / 1e6, DECLARED), rows,
+           ('reader', 'milliseconds', 'peak MB'))
+
+
+if __name__ == '__main__':
+    run()
@@ -0,0 +1,42 @@
+"""
+Cost of change notifications on set_value.
+
+set_value should cost the same whether no key, the changed key or every other
+key has subscribers, since only the subscribers of the changed key are looked
+up.
+
+Usage: python benchmarks/bench_subscribe.py
+"""
+
+import timeit
+
+from common import layout, make_checker, report
+
+KEYS = 10000
+CALLS = 2000
+
+
+def ignore(section, key, value):
+    pass
+
+
+def run():
+    pairs = [(section, key) for section, key, data_type in layout(KEYS) if data_type is int]
+    target = pairs[0]
+    rows = []
+    for name, subscribed in (('no subscribers', []),
+                             ('changed key', [target]),
+                             ('all other keys', pairs[1:])):
+        checker = make_checker(KEYS)
+        checker.set_configuration_file('does-not-exist.ini')
+        for section, key in subscribed:
+            checker.subscribe(section, key, ignore)
+        values = iter(range(10 ** 9))
+        seconds = min(timeit.repeat(lambda: checker.set_value(target[0], target[1], next(values)), number=CALLS, repeat=5))
+        rows.append((name, len(subscribed), seconds / CALLS * 1e6))
+    report('set_value of a changing int key, {} expectations'.format(KEYS), rows,
+           ('subscribed', 'subscriptions', 'microseconds'))
+
+
+if __name__ == '__main__':
+    run()
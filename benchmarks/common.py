@@ -0,0 +1,72 @@
+"""
+Shared helpers for the ConfigChecker benchmarks.
+
+The benchmark scripts are run directly (python benchmarks/bench_registry.py) so
+the repository root is added to the import path here.
+"""
+
+import os
+import sys
+import time
+import logging
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+logging.disable(logging.CRITICAL)
+
+from configchecker import ConfigChecker  # noqa: E402
+
+TYPE_CYCLE = (int, float, bool, str)
+SAMPLE_VALUES = {int: 42, float: 3.25, bool: True, str: 'some value'}
+FILE_VALUES = {int: '7', float: '2.5', bool: 'no', str: 'from file'}
+
+
+def layout(count, keys_per_section=20, types=TYPE_CYCLE):
+    """Yield (section, key, data_type) tuples for count expectations, cycling through types."""
+    for i in range(count):
+        yield ('Section_{}'.format(i // keys_per_section),
+               'key_{}'.format(i),
+               types[i % len(types)])
+
+
+def make_checker(count, keys_per_section=20, thread_safe=False, types=TYPE_CYCLE, lazy=False):
+    """Build a ConfigChecker with count registered expectations."""
+    checker = ConfigChecker(thread_safe=thread_safe, lazy=lazy)
+    for section, key, data_type in layout(count, keys_per_section, types):
+        checker.set_expectation(section, key, data_type, SAMPLE_VALUES[data_type])
+    return checker
+
+
+def write_ini(filename, count, keys_per_section=20, extra_keys=0, types=TYPE_CYCLE):
+    """Write an .ini file holding a value for every generated expectation.
+
+    extra_keys undeclared keys are added to every section to model shared files.
+    """
+    lastSection = None
+    with open(filename, 'w') as f:
+        for section, key, data_type in layout(count, keys_per_section, types):
+            if section != lastSection:
+                if lastSection is not None:
+                    for i in range(extra_keys):
+                        f.write('unknown_{} = filler value\n'.format(i))
+                f.write('\n[{}]\n'.format(section))
+                lastSection = section
+            f.write('{} = {}\n'.format(key, FILE_VALUES[data_type]))
+    return filename
+
+
+def timed(function, *args, **kwargs):
+    """Run function once and return (seconds, result)."""
+    start = time.perf_counter()
+    result = function(*args, **kwargs)
+    return time.perf_counter() - start, result
+
+
+def report(title, rows, headings):
+    """Print a simple aligned results table."""
+    cells = [[c if isinstance(c, str) else '{:.6g}'.format(c) for c in row] for row in rows]
+    widths = [max([14, len(h)] + [len(row[i]) for row in cells if i < len(row)]) for i, h in enumerate(headings)]
+    print(title)
+    print('  '.join('{:>{}}'.format(h, w) for h, w in zip(headings, widths)))
+    for row in cells:
+        print('  '.join('{:>{}}'.format(c, w) for c, w in zip(row, widths)))
+    print()
@@ -0,0 +1,208 @@
+"""
+Benchmark suite for the main ConfigChecker operations at scale.
+
+Every combination of the given sizes, section sizes and type mixes is generated: an .ini
+file with a value for every expectation is written and each operation is timed (best of
+--repeat runs, more for small sizes) and run once more under tracemalloc for its peak memory.
+
+Operations:
+  set_expectation             register all expectations
+  set_configuration_file      load the file (ConfigParser reader)
+  stream                      load the file with the stream reader
+  expectation_exists_at_index look up every expectation
+  get_value                   read every value
+  set_value                   set every value
+  write_configuration_file    write all values to a new file
+  write_changes               write 1% changed values into the existing file
+
+Results can be saved as a JSON baseline and later runs compared against it, the exit code is 1
+when an operation is slower than the baseline by more than --threshold.
+
+Usage:
+  python benchmarks/suite.py
+  python benchmarks/suite.py --sizes 10,1000,100000,1000000 --keys-per-section 20,1000 --types mixed,str
+  python benchmarks/suite.py --save baseline.json
+  python benchmarks/suite.py --compare baseline.json --threshold 0.25
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+from common import layout, make_checker, write_ini, report, SAMPLE_VALUES
+
+TYPE_MIXES = {
+    'mixed': (int, float, bool, str),
+    'str': (str,),
+    'numeric': (int, float),
+}
+CHANGED_VALUES = {int: 12, float: 4.5, bool: False, str: 'changed'}
+
+
+def operations(count, keys_per_section, types, directory):
+    """Yield (name, setup) pairs, setup() prepares a fresh state and returns the function to measure."""
+    filename = write_ini(os.path.join(directory, 'suite.ini'), count, keys_per_section, types=types)
+    entries = list(layout(count, keys_per_section, types))
+    pairs = [(section, key) for section, key, _ in entries]
+    updates = [(section, key, CHANGED_VALUES[data_type]) for section, key, data_type in entries]
+
+    def loaded():
+        checker = make_checker(count, keys_per_section, types=types)
+        checker.set_configuration_file(filename)
+        return checker
+
+    def register():
+        def run():
+            checker = make_checker(0)
+            for section, key, data_type in entries:
+                checker.set_expectation(section, key, data_type, SAMPLE_VALUES[data_type])
+        return run
+
+    def load(reader):
+        def setup():
+            checker = make_checker(count, keys_per_section, types=types)
+            return lambda: checker.set_configuration_file(filename, reader=reader)
+        return setup
+
+    def lookup():
+        checker = loaded()
+        return lambda: [checker.expectation_exists_at_index(section, key) for section, key in pairs]
+
+    def get():
+        checker = loaded()
+        return lambda: [checker.get_value(section, key) for section, key in pairs]
+
+    def set_all():
+        checker = loaded()
+        return lambda: [checker.set_value(section, key, value) for section, key, value in updates]
+
+    def write():
+        checker = loaded()
+        target = os.path.join(directory, 'written.ini')
+        if os.path.exists(target):
+            os.remove(target)
+        return lambda: checker.write_configuration_file(target)
+
+    def write_changes():
+        checker = loaded()
+        for section, key, value in updates[::100]:
+            checker.set_value(section, key, value)
+        return lambda: checker.write_changes()
+
+    yield 'set_expectation', register
+    yield 'set_configuration_file', load('configparser')
+    yield 'stream', load('stream')
+    yield 'expectation_exists_at_index', lookup
+    yield 'get_value', get
+    yield 'set_value', set_all
+    yield 'write_configuration_file', write
+    yield 'write_changes', write_changes
+
+
+def measure(setup, count, repeat, memory):
+    """Return (best seconds, peak bytes or None) of the function returned by setup.
+
+    Small sizes are run more often, so at least about 10000 keys are processed in total.
+    """
+    best = None
+    for _ in range(max(repeat, min(1000, 10000 // max(count, 1)))):
+        function = setup()
+        start = time.perf_counter()
+        function()
+        seconds = time.perf_counter() - start
+        best = seconds if best is None else min(best, seconds)
+    peak = None
+    if memory:
+        function = setup()
+        tracemalloc.start()
+        function()
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+    return best, peak
+
+
+def run_suite(sizes, sections, mixes, repeat, memory):
+    results = {}
+    with tempfile.TemporaryDirectory() as directory:
+        for count in sizes:
+            for keys_per_section in sections:
+                for mix in mixes:
+                    case = '{}/k{}/{}'.format(count, keys_per_section, mix)
+                    for name, setup in operations(count, keys_per_section, TYPE_MIXES[mix], directory):
+                        seconds, peak = measure(setup, count, repeat, memory)
+                        results['{}/{}'.format(case, name)] = {'keys': count, 'seconds': seconds, 'peak': peak}
+                        print('.', end='', file=sys.stderr, flush=True)
+    print(file=sys.stderr)
+    return results
+
+
+def compare(results, baseline, threshold):
+    """Return the report rows and the names of the regressed results."""
+    rows = []
+    regressions = []
+    for name, result in results.items():
+        previous = baseline.get(name)
+        ratio = result['seconds'] / previous['seconds'] if previous and previous['seconds'] > 0 else None
+        flag = ''
+        if ratio is not None and ratio > 1 + threshold:
+            flag = 'REGRESSION'
+            regressions.append(name)
+        rows.append(row(name, result) + ('-' if ratio is None else ratio, flag))
+    return rows, regressions
+
+
+def row(name, result):
+    peak = '-' if result['peak'] is None else result['peak'] / 1e6
+    return (name, result['seconds'] * 1e3, result['seconds'] / max(result['keys'], 1) * 1e6, peak)
+
+
+def parse_list(text, convert=str):
+    return [convert(item) for item in text.split(',') if item]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='ConfigChecker benchmark suite')
+    parser.add_argument('--sizes', default='10,100,1000,10000,100000', help='comma separated numbers of keys')
+    parser.add_argument('--keys-per-section', default='20', help='comma separated numbers of keys per section')
+    parser.add_argument('--types', default='mixed', help='comma separated type mixes: ' + ', '.join(TYPE_MIXES))
+    parser.add_argument('--repeat', type=int, default=3, help='runs per operation, the best time is kept')
+    parser.add_argument('--no-memory', action='store_true', help="don't measure peak memory")
+    parser.add_argument('--save', help='write the results to this JSON file')
+    parser.add_argument('--compare', help='compare against the results saved in this JSON file')
+    parser.add_argument('--threshold', type=float, default=0.2, help='allowed slowdown against the baseline (0.2 = 20%%)')
+    args = parser.parse_args(argv)
+
+    mixes = parse_list(args.types)
+    for mix in mixes:
+        if mix not in TYPE_MIXES:
+            parser.error('unknown type mix {}'.format(mix))
+    results = run_suite(parse_list(args.sizes, int), parse_list(args.keys_per_section, int), mixes,
+                        args.repeat, not args.no_memory)
+
+    headings = ('case/operation', 'milliseconds', 'us per key', 'peak MB')
+    regressions = []
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)['results']
+        rows, regressions = compare(results, baseline, args.threshold)
+        report('Results compared with {}'.format(args.compare), rows, headings + ('ratio', ''))
+        for name in regressions:
+            print('Regression: {} is {:.0%} slower than the baseline'.format(
+                name, results[name]['seconds'] / baseline[name]['seconds'] - 1))
+    else:
+        report('Results', [row(name, result) for name, result in results.items()], headings)
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump({'python': platform.python_version(), 'platform': platform.platform(), 'results': results},
+                      f, indent=1, sort_keys=True)
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
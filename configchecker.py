@@ -4,11 +4,1131 @@ Author: Stuart Ianna
 License: MIT
 """
 
-from configparser import ConfigParser
+from collections import OrderedDict, namedtuple
+from collections.abc import Mapping, MutableMapping
+from configparser import ConfigParser, Error as ConfigParserError, MissingSectionHeaderError, ParsingError
+import argparse
+import asyncio
+import concurrent.futures
+import functools
+import glob
+import hashlib
+import importlib
+import itertools
+import json
+import locale
 import logging
+import mmap
+import multiprocessing
+import os
+import pickle
+import queue
+import re
+import struct
+import sys
+import threading
+import time
+from types import MappingProxyType
+
+try:
+    from multiprocessing import shared_memory
+except ImportError:
+    # Python < 3.8
+    shared_memory = None
 
 log = logging.getLogger(__name__)
 
+_MISSING = object()
+_NO_VALUES = MappingProxyType({})
+
+
+class _ConversionFailed():
+    """Stored in ParseCache entries for keys whose value couldn't be converted.
+
+    A class, so it is still the same object after an entry was pickled and loaded.
+    """
+
+
+def _validate_int(value):
+    if type(value) is int:
+        return True
+    try:
+        int(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def _validate_float(value):
+    if type(value) is float or type(value) is int:
+        return True
+    try:
+        float(value)
+        return True
+    except (TypeError, ValueError):
+        return False
+
+
+def _validate_bool(value):
+    return type(value) is bool
+
+
+def _validate_str(value):
+    return True
+
+
+def _convert_bool(raw):
+    state = ConfigParser.BOOLEAN_STATES.get(raw.lower())
+    if state is None:
+        raise ValueError("Not a boolean: {}".format(raw))
+    return state
+
+
+def _convert_str(raw):
+    return raw
+
+
+# Ways set_configuration_file can read a file
+_READERS = ('configparser', 'stream', 'mmap')
+
+# asyncio.get_running_loop is new in Python 3.7
+_get_running_loop = getattr(asyncio, 'get_running_loop', asyncio.get_event_loop)
+
+# Number of keys converted between checks of the time budget by aload
+_LOAD_CHUNK = 256
+
+
+def _run_steps(steps):
+    # Run a generator to the end and return its return value
+    while True:
+        try:
+            next(steps)
+        except StopIteration as done:
+            return done.value
+
+# data_type -> (validator, converter)
+# The validator checks a value passed to set_expectation (default) or set_value.
+# The converter turns the raw string read from a configuration file into the data type, raising ValueError on failure.
+_TYPES = {
+    int: (_validate_int, int),
+    float: (_validate_float, float),
+    bool: (_validate_bool, _convert_bool),
+    str: (_validate_str, _convert_str),
+}
+
+
+_NUMBER_START = frozenset('+-.0123456789iInN')
+
+
+def _is_name(value):
+    # Section and key names must be strings which can't be read as a number
+    if type(value) is not str:
+        return False
+    stripped = value.strip()
+    if not stripped or stripped[0] not in _NUMBER_START:
+        return True
+    return not _validate_float(stripped)
+
+
+def _expectation_error(section, key, data_type, default):
+    # Get the reason an expectation can't be added, None if it's valid
+    handlers = _TYPES.get(data_type)
+    if handlers is None:
+        return "Data type [{}] is not allowed. Allowed types = [{}]".format(data_type, ", ".join(t.__name__ for t in _TYPES))
+    if not handlers[0](default):
+        return "Default [{}] doesn't match data type [{}]".format(default, data_type)
+    if not _is_name(section):
+        return "Section names must be strings, passed name = [{}]".format(section)
+    if not _is_name(key):
+        return "Key names must be strings, passed name = [{}]".format(key)
+    return None
+
+
+def _schema_entries(schema):
+    # Get the (section, key, data_type, default, message) entries described by a schema
+    if not isinstance(schema, Mapping):
+        with open(schema) as f:
+            schema = json.load(f)
+    typeNames = {data_type.__name__: data_type for data_type in _TYPES}
+    for section, keys in schema.items():
+        if not isinstance(keys, Mapping):
+            # Rejected as a malformed entry
+            yield (section, keys)
+            continue
+        for key, spec in keys.items():
+            if isinstance(spec, Mapping):
+                data_type = spec.get('type', spec.get('data_type'))
+                default = spec.get('default')
+                message = spec.get('message')
+            elif isinstance(spec, (list, tuple)) and len(spec) in (2, 3):
+                data_type, default = spec[0], spec[1]
+                message = spec[2] if len(spec) == 3 else None
+            else:
+                yield (section, key, spec)
+                continue
+            if isinstance(data_type, str):
+                data_type = typeNames.get(data_type, data_type)
+            yield (section, key, data_type, default, message)
+
+
+def _schema_fingerprint(expectations):
+    # Digest of the sections, keys and data types of a list of expectations, in order
+    typeNames = {}
+    parts = []
+    for expectation in expectations:
+        data_type = expectation.data_type
+        typeName = typeNames.get(data_type)
+        if typeName is None:
+            typeName = typeNames[data_type] = "\0{}.{}\n".format(data_type.__module__, data_type.__qualname__)
+        parts.append(expectation.section + "\0" + expectation.key + typeName)
+    return hashlib.sha1("".join(parts).encode('utf-8', 'surrogateescape')).hexdigest()
+
+
+# Result of ConfigChecker.set_expectations_bulk
+# added (int) - The number of expectations added.
+# rejected (list) - (entry, reason) tuples of the entries which weren't added.
+BulkReport = namedtuple('BulkReport', ['added', 'rejected'])
+
+# Result of ConfigChecker.apply_overrides
+# applied (list) - (section, key) tuples of the values which were overridden.
+# rejected (list) - (name, reason) tuples of the overrides which couldn't be applied.
+OverrideReport = namedtuple('OverrideReport', ['applied', 'rejected'])
+
+_NOT_NAME_CHARACTER = re.compile(r"[^A-Z0-9]")
+
+
+def _override_name(section, key):
+    # Environment variable name of an expectation, for example GENERAL__RETRIES for General / retries
+    return _NOT_NAME_CHARACTER.sub('_', section.upper()) + '__' + _NOT_NAME_CHARACTER.sub('_', key.upper())
+
+# Measurements of one operation, passed to the callback of ConfigChecker.enable_metrics
+# operation (str) - The name of the method, for example set_configuration_file.
+# seconds (float) - The wall time of the call.
+# keys (int) - The number of keys read, converted or written.
+# failures (int) - The number of values which couldn't be converted or set.
+# cache_hits (int) - 1 if the values came from the parse cache or a snapshot.
+# bytes_read, bytes_written (int) - The size of the files read and written.
+# success (bool) - False if the method returned False or None.
+OperationMetrics = namedtuple('OperationMetrics', ['operation', 'seconds', 'keys', 'failures', 'cache_hits',
+                                                   'bytes_read', 'bytes_written', 'success'])
+
+# Methods measured when metrics are enabled
+_INSTRUMENTED = ('set_configuration_file', 'load_layers', 'load_snapshot', 'save_snapshot', 'reload',
+                 'write_configuration_file', 'write_changes', 'set_value', 'set_values')
+
+
+class _OperationCounters():
+    # Counts filled in while an instrumented method runs
+    __slots__ = ('keys', 'failures', 'cache_hits', 'bytes_read', 'bytes_written')
+
+    def __init__(self):
+        self.keys = self.failures = self.cache_hits = self.bytes_read = self.bytes_written = 0
+
+
+def register_type(data_type, validator, converter):
+    """Allow an additional data type to be used with ConfigChecker.set_expectation.
+
+    Parameters:
+    data_type - The type used as the data_type of an expectation.
+    validator - Callable taking a value, returning True if it can be stored for this type.
+    converter - Callable taking the raw string from a configuration file and returning the
+        converted value. ValueError should be raised if the string cannot be converted.
+
+    Values are written to configuration files using str(value), so str(value) passed through the
+    converter should result in the same value.
+    """
+    _TYPES[data_type] = (validator, converter)
+
+
+def _write_file_atomically(filename, data):
+    """Replace the content of filename with data (bytes) so readers see either the old or new file.
+
+    The data is written to a temporary file in the same directory, flushed to disk and renamed over
+    filename. A symbolic link is followed, the file it points to is replaced. The permissions of an
+    existing file are kept, a new file gets the permissions open() would give it. OSError is raised
+    on failure.
+    """
+    filename = os.path.realpath(filename)
+    directory, name = os.path.split(filename)
+    try:
+        mode = os.stat(filename).st_mode & 0o7777
+    except FileNotFoundError:
+        mode = None
+    flags = os.O_WRONLY | os.O_CREAT | os.O_EXCL | getattr(os, 'O_BINARY', 0)
+    for attempt in range(100):
+        temporary = os.path.join(directory, '.{}.{}.tmp'.format(name, os.urandom(6).hex()))
+        try:
+            # 0o666 is reduced by the umask, as for open()
+            descriptor = os.open(temporary, flags, 0o666)
+            break
+        except FileExistsError:
+            continue
+    else:
+        raise FileExistsError("No unused temporary file name for '{}'".format(filename))
+    try:
+        with os.fdopen(descriptor, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        if mode is not None:
+            os.chmod(temporary, mode)
+        os.replace(temporary, filename)
+    except BaseException:
+        try:
+            os.remove(temporary)
+        except OSError:
+            pass
+        raise
+
+
+_SECTION_HEADER = re.compile(r"\[(?P<header>.+)\]")
+_OPTION_LINE = re.compile(r"(?P<prefix>(?P<key>[^=:\s][^=:]*?)\s*[=:]\s*)(?P<value>.*)$")
+_SECTION_HEADER_BYTES = re.compile(_SECTION_HEADER.pattern.encode('ascii'))
+_OPTION_LINE_BYTES = re.compile(_OPTION_LINE.pattern.encode('ascii'))
+
+
+def _format_value(value, newline):
+    return str(value).replace('\n', newline + '\t')
+
+
+def _patch_ini(content, pending):
+    """Replace the values of keys in the text of a configuration file, keeping all other lines.
+
+    Parameters:
+    content (str) - The text of the configuration file.
+    pending (dict) - section -> {key: Expectation} of the values to write. Keys which aren't found
+        are added to the end of their section, sections which aren't found are added to the end.
+
+    Returns:
+    The patched text.
+    """
+    lines = content.splitlines(True)
+    newline = '\r\n' if lines and lines[0].endswith('\r\n') else '\n'
+    pending = {section: dict(expectations) for section, expectations in pending.items()}
+    output = []
+    sectionEnds = {}
+    section = None
+    inValue = False
+    replacing = False
+    skipping = False
+
+    for line in lines:
+        if skipping and line[:1] != '[':
+            # Copying a section without changes, only looking for the next section header
+            output.append(line)
+            continue
+        body = line.rstrip('\r\n')
+        stripped = body.strip()
+        if not stripped or stripped[0] in '#;':
+            output.append(line)
+            continue
+        if inValue and body[0] in ' \t':
+            # Continuation of a multi line value
+            if not replacing:
+                output.append(line)
+                sectionEnds[section] = len(output)
+            continue
+        inValue = False
+        replacing = False
+        header = _SECTION_HEADER.match(stripped)
+        if header:
+            section = header.group('header')
+            output.append(line)
+            sectionEnds[section] = len(output)
+            skipping = not pending.get(section)
+            continue
+        option = _OPTION_LINE.match(body)
+        if option:
+            inValue = True
+            expectations = pending.get(section)
+            expectation = None if expectations is None else expectations.pop(option.group('key').strip().lower(), None)
+            if expectation is not None:
+                line = option.group('prefix') + _format_value(expectation.value, newline) + line[len(body):]
+                replacing = True
+        output.append(line)
+        sectionEnds[section] = len(output)
+
+    # Insert from the end of the file so earlier positions stay valid
+    additions = []
+    for section, expectations in pending.items():
+        if expectations:
+            additions.append((sectionEnds.get(section), section, expectations))
+    if (output and not output[-1].endswith('\n')
+            and any(position is None or position == len(output) for position, section, expectations in additions)):
+        # Lines are added after the last line, which has no line break
+        output[-1] += newline
+    for position, section, expectations in sorted((a for a in additions if a[0] is not None), key=lambda a: a[0], reverse=True):
+        output[position:position] = ["{} = {}{}".format(key, _format_value(e.value, newline), newline)
+                                     for key, e in expectations.items()]
+    for position, section, expectations in additions:
+        if position is None:
+            if output and output[-1].strip():
+                output.append(newline)
+            output.append("[{}]{}".format(section, newline))
+            output.extend("{} = {}{}".format(key, _format_value(e.value, newline), newline) for key, e in expectations.items())
+    return "".join(output)
+
+
+def _read_ini_stream(lines, sections, source='<stream>'):
+    """Read the values of a configuration file in a single pass over its lines.
+
+    The syntax accepted is that of ConfigParser's defaults: section headers, key = value or
+    key: value options, multi line values on indented lines, full line comments starting with
+    # or ; and a DEFAULT section whose keys apply to every other section in the file.
+    Keys are converted to lower case. Values are not interpolated and the last of any duplicate
+    section or key is used.
+
+    Sections which aren't wanted are skipped until the next section header without parsing their
+    options, so errors in them aren't reported.
+
+    Parameters:
+    lines - Iterable of the lines of the file (such as a file object).
+    sections - Mapping of wanted section name to a container of wanted (lower case) keys.
+        None reads all sections and keys.
+    source - The file name used in error messages.
+
+    Returns:
+    A dictionary of (section, key) to the value string.
+
+    Raises:
+    MissingSectionHeaderError - An option was found before the first section header.
+    ParsingError - A line in a wanted section couldn't be parsed.
+    """
+    found = {}
+    defaults = {}
+    target = None
+    keys = None
+    started = False
+    option = None
+    optionIndent = 0
+    # Indent of the last option in a skipped section, indented lines are continuations of its value
+    skipIndent = None
+    for lineno, line in enumerate(lines, 1):
+        if started and target is None and line[:1] != '[':
+            # Skipping a section which isn't wanted, only looking for the next section header
+            if skipIndent == 0:
+                continue
+            stripped = line.strip()
+            if not stripped or stripped[0] in '#;':
+                continue
+            indent = len(line) - len(line.lstrip())
+            if skipIndent is not None and indent > skipIndent:
+                continue
+            if not _SECTION_HEADER.match(stripped):
+                skipIndent = indent
+                continue
+        stripped = line.strip()
+        if not stripped or stripped[0] in '#;':
+            if option is not None and not stripped:
+                option.append('')
+            continue
+        indent = len(line) - len(line.lstrip())
+        if option is not None and indent > optionIndent:
+            option.append(stripped)
+            continue
+        option = None
+        header = _SECTION_HEADER.match(stripped)
+        if header:
+            started = True
+            skipIndent = None
+            name = header.group('header')
+            if name == 'DEFAULT':
+                target, keys = defaults, None
+            elif sections is None:
+                target, keys = found.setdefault(name, {}), None
+            elif name in sections:
+                target, keys = found.setdefault(name, {}), sections[name]
+            else:
+                target = None
+            continue
+        if not started:
+            raise MissingSectionHeaderError(source, lineno, line)
+        if target is None:
+            continue
+        match = _OPTION_LINE.match(stripped)
+        if match is None:
+            error = ParsingError(source)
+            error.append(lineno, repr(line))
+            raise error
+        key = match.group('key').strip().lower()
+        option = [match.group('value').strip()]
+        optionIndent = indent
+        if keys is None or key in keys:
+            target[key] = option
+
+    values = {}
+    for section, options in found.items():
+        for key, parts in options.items():
+            values[(section, key)] = '\n'.join(parts).rstrip()
+        if defaults:
+            keys = None if sections is None else sections[section]
+            for key, parts in defaults.items():
+                if key not in options and (keys is None or key in keys):
+                    values[(section, key)] = '\n'.join(parts).rstrip()
+    return values
+
+
+def _read_ini_mmap(filename, sections):
+    """Read the values of a configuration file by scanning its memory mapped bytes.
+
+    Accepts the same syntax as _read_ini_stream and returns the same values. Once a section which
+    isn't wanted has an option at the start of a line, the rest of it is skipped by searching for
+    the next line starting with [ without looking at its lines, and only the section names, keys and values which are wanted are decoded (with
+    the preferred encoding of the locale, like open()). The file isn't copied into memory so the
+    memory used depends on the values read, not the size of the file.
+
+    Parameters:
+    filename - The name of the file.
+    sections - Mapping of wanted section name to a container of wanted (lower case) keys.
+        None reads all sections and keys.
+
+    Returns:
+    A dictionary of (section, key) to the value string.
+
+    Raises:
+    OSError - The file couldn't be opened.
+    MissingSectionHeaderError, ParsingError - As _read_ini_stream.
+    UnicodeDecodeError - A wanted name or value couldn't be decoded.
+    """
+    with open(filename, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return {}
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            return _scan_ini_bytes(data, sections, filename, locale.getpreferredencoding(False))
+
+
+def _scan_ini_bytes(data, sections, source, encoding):
+    # The parsing of _read_ini_stream on bytes, values are kept as lists of byte strings until the end
+    if sections is not None:
+        wanted = {}
+        for name in sections:
+            try:
+                wanted[name.encode(encoding)] = name
+            except UnicodeEncodeError:
+                pass
+    found = {}
+    defaults = {}
+    target = None
+    keys = None
+    started = False
+    option = None
+    inOption = False
+    optionIndent = 0
+    # Indent of the last option in a skipped section, indented lines are continuations of its value
+    skipIndent = None
+    size = len(data)
+    position = 0
+    while position < size:
+        if started and target is None and data[position:position + 1] != b'[':
+            # Skipping a section which isn't wanted
+            if skipIndent == 0:
+                # Only a line starting with [ can be the next section header
+                position = data.find(b'\n[', position)
+                if position < 0:
+                    break
+                position += 1
+            else:
+                end = data.find(b'\n', position)
+                if end < 0:
+                    end = size
+                line = data[position:end]
+                stripped = line.strip()
+                if not stripped or stripped[:1] in (b'#', b';'):
+                    position = end + 1
+                    continue
+                indent = len(line) - len(line.lstrip())
+                if skipIndent is not None and indent > skipIndent:
+                    position = end + 1
+                    continue
+                if not _SECTION_HEADER_BYTES.match(stripped):
+                    skipIndent = indent
+                    position = end + 1
+                    continue
+        end = data.find(b'\n', position)
+        if end < 0:
+            end = size
+        lineStart = position
+        line = data[position:end]
+        position = end + 1
+        stripped = line.strip()
+        if not stripped or stripped[:1] in (b'#', b';'):
+            if inOption and not stripped and option is not None:
+                option.append(b'')
+            continue
+        indent = len(line) - len(line.lstrip())
+        if inOption and indent > optionIndent:
+            if option is not None:
+                option.append(stripped)
+            continue
+        inOption = False
+        header = _SECTION_HEADER_BYTES.match(stripped)
+        if header:
+            started = True
+            skipIndent = None
+            name = header.group('header')
+            if name == b'DEFAULT':
+                target, keys = defaults, None
+            elif sections is None:
+                target, keys = found.setdefault(name.decode(encoding), {}), None
+            elif name in wanted:
+                name = wanted[name]
+                target, keys = found.setdefault(name, {}), sections[name]
+            else:
+                target = None
+            continue
+        if not started:
+            raise MissingSectionHeaderError(source, _line_number(data, lineStart), line.decode(encoding, 'replace'))
+        if target is None:
+            continue
+        match = _OPTION_LINE_BYTES.match(stripped)
+        if match is None:
+            error = ParsingError(source)
+            error.append(_line_number(data, lineStart), repr(line.decode(encoding, 'replace')))
+            raise error
+        key = match.group('key').strip().decode(encoding).lower()
+        inOption = True
+        optionIndent = indent
+        if keys is None or key in keys:
+            option = target[key] = [match.group('value').strip()]
+        else:
+            option = None
+
+    values = {}
+    for section, options in found.items():
+        for key, parts in options.items():
+            values[(section, key)] = b'\n'.join(parts).rstrip().decode(encoding)
+        if defaults:
+            keys = None if sections is None else sections[section]
+            for key, parts in defaults.items():
+                if key not in options and (keys is None or key in keys):
+                    values[(section, key)] = b'\n'.join(parts).rstrip().decode(encoding)
+    return values
+
+
+def _line_number(data, position):
+    # Line number of a position in a bytes like object, only used for error messages
+    return data[:position].count(b'\n') + 1
+
+
+def _config_parser_values(configObject, sections):
+    # Get the (interpolated) strings of the wanted keys in a ConfigParser object
+    rawValues = {}
+    for section in configObject.sections():
+        keys = sections.get(section)
+        if keys is None:
+            continue
+        for key in configObject[section]:
+            if key in keys:
+                try:
+                    rawValues[(section, key)] = configObject.get(section, key)
+                except ConfigParserError:
+                    rawValues[(section, key)] = None
+    return rawValues
+
+
+def _read_layer(filename, reader, sections):
+    """Read the raw values of the wanted keys of one file, None if it can't be read.
+
+    Module level so it can run in a process pool. sections maps section names to a container
+    of wanted keys.
+    """
+    try:
+        if reader == 'stream':
+            with open(filename) as f:
+                return _read_ini_stream(f, sections, filename)
+        if reader == 'mmap':
+            return _read_ini_mmap(filename, sections)
+        configObject = ConfigParser()
+        if len(configObject.read(filename)) == 0:
+            return None
+        return _config_parser_values(configObject, sections)
+    except (OSError, ConfigParserError, UnicodeDecodeError):
+        return None
+
+
+# Snapshot files written by save_snapshot: a header (magic, format version, size, modification
+# time, device and inode of the configuration file, sha1 of the expectations and reader, length of
+# the path, payload length) followed by the absolute path of the configuration file and the pickled
+# (values, sources) lists in the order of the expectations.
+_SNAPSHOT_HEADER = struct.Struct('<4sHxxQqQQ20sIxxxxQ')
+_SNAPSHOT_MAGIC = b'CCSN'
+_SNAPSHOT_FORMAT = 2
+
+
+class Expectation(MutableMapping):
+    """A single section / key expectation.
+
+    Records are stored with __slots__ to keep per-expectation memory small. They also behave as a
+    mapping with the keys section, key, value, data_type, default and message, so code written
+    against the previous dictionary records keeps working. Keys can be read and assigned, but not
+    added or removed.
+
+    source holds the name of the file which supplied the value, None for defaults and values
+    set with set_value.
+    """
+
+    FIELDS = ('section', 'key', 'value', 'data_type', 'default', 'message')
+
+    __slots__ = FIELDS + ('validator', 'converter', 'dirty', 'source')
+
+    def __init__(self, section, key, data_type, default, message=None):
+        self.section = section
+        self.key = key
+        self.value = None
+        self.data_type = data_type
+        self.default = default
+        self.message = message
+        self.validator, self.converter = _TYPES[data_type]
+        self.dirty = False
+        self.source = None
+
+    def __getitem__(self, field):
+        if field not in Expectation.FIELDS:
+            raise KeyError(field)
+        return getattr(self, field)
+
+    def __setitem__(self, field, value):
+        if field not in Expectation.FIELDS:
+            raise KeyError(field)
+        setattr(self, field, value)
+
+    def __delitem__(self, field):
+        raise TypeError("Expectation fields cannot be removed")
+
+    def __iter__(self):
+        return iter(Expectation.FIELDS)
+
+    def __len__(self):
+        return len(Expectation.FIELDS)
+
+    def __repr__(self):
+        return "Expectation({})".format(", ".join("{}={!r}".format(f, getattr(self, f)) for f in Expectation.FIELDS))
+
+    def _copy_definition(self):
+        # A new record with the same definition and no value, without validating it again
+        record = Expectation.__new__(Expectation)
+        record.section = self.section
+        record.key = self.key
+        record.value = None
+        record.data_type = self.data_type
+        record.default = self.default
+        record.message = self.message
+        record.validator = self.validator
+        record.converter = self.converter
+        record.dirty = False
+        record.source = None
+        return record
+
+
+class ParseCache():
+    """Cache of typed configuration values, shared between ConfigChecker objects.
+
+    An entry is keyed on the configuration file and the expectations it was parsed with. A file is
+    identified by its path, size and modification time, or by a hash of its content when
+    use_hash=True. A ConfigChecker given the cache skips parsing and type conversion when the file
+    and expectations are unchanged.
+
+    Entries are held in memory and, if directory is given, also pickled to that directory so that
+    other processes can use them. The directory must only be writable by trusted users, since
+    entries are loaded with pickle.
+
+    Parameters:
+    max_entries (int) - The number of entries kept. The least recently used entry is evicted
+        first, both in memory and in the directory.
+    directory (str) - Optional directory used as an on-disk store.
+    use_hash (bool) - Identify files by a hash of their content instead of size and modification time.
+
+    Attributes:
+    hits (int) - The number of lookups which found an entry.
+    misses (int) - The number of lookups which didn't find an entry.
+    """
+
+    def __init__(self, max_entries=64, directory=None, use_hash=False):
+        self.max_entries = max_entries
+        self.directory = directory
+        self.use_hash = use_hash
+        self.hits = 0
+        self.misses = 0
+        self.__entries = OrderedDict()
+
+    def make_key(self, filename, fingerprint):
+        """Get the cache key of a file parsed with a set of expectations.
+
+        Parameters:
+        filename - The name (and path) of the configuration file.
+        fingerprint (str) - Identifies the expectations used when parsing.
+
+        Returns:
+        The key (str), or None if the file cannot be accessed.
+        """
+        try:
+            path = os.path.abspath(filename)
+            if self.use_hash:
+                digest = hashlib.sha256()
+                with open(path, 'rb') as f:
+                    for block in iter(lambda: f.read(1 << 20), b''):
+                        digest.update(block)
+                state = digest.hexdigest()
+            else:
+                stat = os.stat(path)
+                state = "{}:{}".format(stat.st_size, stat.st_mtime_ns)
+        except (OSError, ValueError):
+            return None
+        return hashlib.sha1("{}\0{}\0{}".format(path, state, fingerprint).encode('utf-8', 'surrogateescape')).hexdigest()
+
+    def get(self, key):
+        """Get the values stored for a key.
+
+        Returns:
+        A dictionary of (section, key) to value, or None if the key has no entry.
+        """
+        values = self.__entries.get(key)
+        if values is not None:
+            self.__entries.move_to_end(key)
+        elif self.directory is not None:
+            values = self.__read_entry(key)
+            if values is not None:
+                self.__store(key, values)
+        if values is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return values
+
+    def put(self, key, values):
+        """Store the values read for a key, evicting the least recently used entries if needed.
+        """
+        self.__store(key, values)
+        if self.directory is not None:
+            self.__write_entry(key, values)
+
+    def clear(self):
+        """Remove all entries held in memory. Entries in the directory are kept.
+        """
+        self.__entries.clear()
+
+    def stats(self):
+        """Get the cache counters.
+
+        Returns:
+        A dictionary with the keys hits, misses and entries.
+        """
+        return {'hits': self.hits, 'misses': self.misses, 'entries': len(self.__entries)}
+
+    def __store(self, key, values):
+        self.__entries[key] = values
+        self.__entries.move_to_end(key)
+        while len(self.__entries) > self.max_entries:
+            self.__entries.popitem(last=False)
+
+    def __entry_path(self, key):
+        return os.path.join(self.directory, key + '.pickle')
+
+    def __read_entry(self, key):
+        try:
+            with open(self.__entry_path(key), 'rb') as f:
+                values = pickle.load(f)
+            # Mark as recently used for eviction
+            os.utime(self.__entry_path(key))
+            return values
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+            return None
+
+    def __write_entry(self, key, values):
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            _write_file_atomically(self.__entry_path(key), pickle.dumps(values, pickle.HIGHEST_PROTOCOL))
+        except (OSError, pickle.PicklingError):
+            log.warning("Failed writing parse cache entry to directory '%s'", self.directory)
+            return
+        self.__evict_entries()
+
+    def __evict_entries(self):
+        try:
+            entries = [entry for entry in os.scandir(self.directory) if entry.name.endswith('.pickle')]
+            if len(entries) <= self.max_entries:
+                return
+            entries.sort(key=lambda entry: entry.stat().st_mtime_ns)
+            for entry in entries[:len(entries) - self.max_entries]:
+                os.remove(entry.path)
+        except OSError:
+            pass
+
+
+class ConfigAccessor():
+    """Attribute access to the values of a ConfigChecker, returned by ConfigChecker.get_accessor.
+
+    accessor.General is the section object of section General and accessor.General.retries the
+    value of key retries in it. Names which aren't valid identifiers can be read with item access:
+    accessor['My Section']['my-key'].
+
+    Section objects are created on first use and kept as attributes. Each key read through an
+    attribute becomes a property of its section object, so later reads don't search for the
+    attribute. Values are always read with the same rules as get_value.
+
+    Reading a key with no expectation raises AttributeError (KeyError for item access).
+    """
+
+    def __init__(self, lookup):
+        # lookup(section, key) returns the current value or _MISSING
+        self.__lookup = lookup
+        self.__sections = {}
+
+    def __getattr__(self, section):
+        if section.startswith('__'):
+            raise AttributeError(section)
+        accessor = self[section]
+        setattr(self, section, accessor)
+        return accessor
+
+    def __getitem__(self, section):
+        accessor = self.__sections.get(section)
+        if accessor is None:
+            # A class per section holds the properties of its keys
+            sectionClass = type('_SectionAccessor', (_SectionAccessor,), {'__slots__': ()})
+            accessor = self.__sections[section] = sectionClass(self.__lookup, section)
+        return accessor
+
+
+def _key_property(lookup, section, key):
+    def get(self):
+        value = lookup(section, key)
+        if value is _MISSING:
+            raise AttributeError("No expectation for Section [{}], Key [{}]".format(section, key))
+        return value
+    return property(get)
+
+
+class _SectionAccessor():
+    # Values of one section for ConfigAccessor
+
+    __slots__ = ('_SectionAccessor__lookup', '_SectionAccessor__section')
+
+    def __init__(self, lookup, section):
+        self.__lookup = lookup
+        self.__section = section
+
+    def __getattr__(self, key):
+        value = self.__lookup(self.__section, key)
+        if value is _MISSING:
+            raise AttributeError("No expectation for Section [{}], Key [{}]".format(self.__section, key))
+        if not key.startswith('__'):
+            setattr(type(self), key, _key_property(self.__lookup, self.__section, key))
+        return value
+
+    def __getitem__(self, key):
+        value = self.__lookup(self.__section, key)
+        if value is _MISSING:
+            raise KeyError((self.__section, key))
+        return value
+
+    def __repr__(self):
+        return "<section accessor [{}]>".format(self.__section)
+
+
+class _SharedSegment():
+    """Values of a ConfigChecker held in a shared memory segment.
+
+    Layout: a header (magic, format version, sequence number, payload length, device and inode of
+    the publisher's resource tracker pipe) followed by the pickled {section: {key: value}}
+    dictionary. The sequence number is odd while the payload is being written, readers retry until
+    they see the same even number before and after copying the payload.
+
+    Only the process which created the segment writes to and removes it, in a process forked from
+    it the segment is read like an attached one.
+    """
+
+    HEADER = struct.Struct('<4sHxxQQQQ')
+    SEQUENCE = struct.Struct('<Q')
+    MAGIC = b'CCSM'
+    FORMAT = 2
+
+    def __init__(self, memory, pid):
+        self.memory = memory
+        self.pid = pid
+        self.__sequence = 0
+        self.__readSequence = None
+        self.__values = MappingProxyType({})
+
+    @property
+    def owner(self):
+        return self.pid == os.getpid()
+
+    @staticmethod
+    def _tracker():
+        # Device and inode of the pipe to the resource tracker, which forked and spawned children share
+        if not getattr(shared_memory, '_USE_POSIX', False):
+            return 0, 0
+        from multiprocessing import resource_tracker
+        stat = os.fstat(resource_tracker.getfd())
+        return stat.st_dev, stat.st_ino
+
+    @classmethod
+    def create(cls, name, size):
+        memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        cls.HEADER.pack_into(memory.buf, 0, cls.MAGIC, cls.FORMAT, 0, 0, *cls._tracker())
+        return cls(memory, os.getpid())
+
+    @classmethod
+    def attach(cls, name):
+        try:
+            memory = shared_memory.SharedMemory(name=name, track=False)
+            tracked = False
+        except TypeError:
+            # Python < 3.13 always registers the segment with the resource tracker, which removes it
+            # when the process exits
+            memory = shared_memory.SharedMemory(name=name)
+            tracked = getattr(shared_memory, '_USE_POSIX', False)
+        magic, version, _, _, device, inode = cls.HEADER.unpack_from(memory.buf, 0)
+        if tracked and (device, inode) != cls._tracker():
+            # The segment belongs to the publisher. A child sharing the publisher's tracker didn't
+            # add a registration, unregistering there would remove the publisher's.
+            from multiprocessing import resource_tracker
+            resource_tracker.unregister(memory._name, 'shared_memory')
+        if magic != cls.MAGIC or version != cls.FORMAT:
+            memory.close()
+            raise ValueError("Not a ConfigChecker shared memory segment")
+        return cls(memory, None)
+
+    def write(self, values):
+        payload = pickle.dumps(values, pickle.HIGHEST_PROTOCOL)
+        end = self.HEADER.size + len(payload)
+        if end > self.memory.size:
+            return False
+        buffer = self.memory.buf
+        self.__sequence += 1
+        self.SEQUENCE.pack_into(buffer, 8, self.__sequence)
+        buffer[self.HEADER.size:end] = payload
+        self.SEQUENCE.pack_into(buffer, 16, len(payload))
+        self.__sequence += 1
+        self.SEQUENCE.pack_into(buffer, 8, self.__sequence)
+        return True
+
+    def read(self):
+        # Get the current values, only unpickling them when the sequence number changed. A segment
+        # closed by another thread returns the last values read.
+        buffer = self.memory.buf
+        if buffer is None:
+            return self.__values
+        try:
+            return self.__read(buffer)
+        except ValueError:
+            # The buffer was released while reading
+            return self.__values
+
+    def __read(self, buffer):
+        # Bounded so a writer which died mid update can't block readers, who keep the last values
+        for _ in range(10000):
+            sequence = self.SEQUENCE.unpack_from(buffer, 8)[0]
+            if sequence == self.__readSequence:
+                return self.__values
+            if sequence & 1:
+                continue
+            length = self.SEQUENCE.unpack_from(buffer, 16)[0]
+            payload = bytes(buffer[self.HEADER.size:self.HEADER.size + length])
+            if self.SEQUENCE.unpack_from(buffer, 8)[0] != sequence:
+                continue
+            values = pickle.loads(payload)
+            self.__values = MappingProxyType({section: MappingProxyType(keys) for section, keys in values.items()})
+            self.__readSequence = sequence
+            return self.__values
+        return self.__values
+
+    def close(self):
+        self.memory.close()
+        if self.owner:
+            try:
+                self.memory.unlink()
+            except FileNotFoundError:
+                pass
+
+
+class Transaction():
+    """Changes collected by ConfigChecker.transaction, applied together when the with block ends.
+
+    The changes are applied with ConfigChecker.set_values: if any value is invalid, the block
+    raises an exception or the write fails, none of them are applied.
+
+    Attributes:
+    committed (bool) - True once the changes were applied (and written).
+    """
+
+    def __init__(self, checker, write):
+        self._checker = checker
+        self._write = write
+        self._values = OrderedDict()
+        self.committed = False
+
+    def set_value(self, section, key, value):
+        """Queue a new value for a section / key pair, it is checked when the transaction ends."""
+        self._values[(section, key)] = value
+
+    def get_value(self, section, key):
+        """Get the value queued in this transaction, or the current value of the ConfigChecker."""
+        if (section, key) in self._values:
+            return self._values[(section, key)]
+        return self._checker.get_value(section, key)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.committed = self._checker.set_values(self._values, self._write)
+        return False
+
+
+class Schema():
+    """An immutable set of expectations, compiled once and used to create many ConfigChecker objects.
+
+    The entries are validated once when the schema is created. ConfigChecker.from_schema(schema)
+    then only copies the expectation records, which get their own values, and shares the index
+    layout and fingerprint of the schema instead of validating and indexing every expectation
+    again. Changing the expectations of a checker afterwards doesn't affect the schema.
+
+    Parameters:
+    entries - Iterable of expectations in the formats accepted by ConfigChecker.set_expectations_bulk.
+
+    Attributes:
+    rejected (list) - (entry, reason) tuples of the entries which weren't added.
+    """
+
+    def __init__(self, entries):
+        checker = ConfigChecker()
+        self.rejected = checker.set_expectations_bulk(entries).rejected
+        self._compile(checker.get_expectations())
+
+    @classmethod
+    def from_checker(cls, checker):
+        """Compile the current expectations of a ConfigChecker into a Schema."""
+        schema = cls.__new__(cls)
+        schema.rejected = []
+        schema._compile(checker.get_expectations())
+        return schema
+
+    def _compile(self, expectations):
+        # Read by ConfigChecker.from_schema, never changed after this
+        self._records = tuple(expectation._copy_definition() for expectation in expectations)
+        self._positions = {(e.section, e.key): position for position, e in enumerate(self._records)}
+        layout = {}
+        for position, expectation in enumerate(self._records):
+            layout.setdefault(expectation.section, ([], []))
+            layout[expectation.section][0].append(expectation.key)
+            layout[expectation.section][1].append(position)
+        self._sections = tuple((section, tuple(keys), tuple(positions)) for section, (keys, positions) in layout.items())
+        self._fingerprint = _schema_fingerprint(self._records)
+
+    def __len__(self):
+        return len(self._records)
+
+    def __iter__(self):
+        """Yield the (section, key, data_type, default, message) entries of the schema."""
+        for e in self._records:
+            yield (e.section, e.key, e.data_type, e.default, e.message)
+
+    def __repr__(self):
+        return "<Schema with {} expectations>".format(len(self._records))
+
 
 class ConfigChecker():
     """Wraper around the ConfigParser module to ensure strict operation when working with configuration files
@@ -35,35 +1155,95 @@ class ConfigChecker():
     # Write the configuration values to a file.
     # All previously set expectations and their updated values are written.
     config.write_configuation_file('config.ini')
+
+    A ParseCache can be passed as parse_cache to skip parsing files which were already read with the
+    same expectations, by this or another ConfigChecker.
+
+    With thread_safe=True the object can be shared between threads. Methods which change
+    expectations or values hold a lock and publish an immutable snapshot of the values when they
+    finish. get_value and get_snapshot read the latest snapshot without taking the lock. Records
+    returned by get_expectations should not be changed directly in this mode, changes made to
+    them aren't seen by get_value.
+
+    With lazy=True loading a file only records the raw strings of the expectations. Each value is
+    converted (or falls back to its default) the first time it is read, and then kept. Methods
+    which use all values, such as get_expectations, write_configuration_file or save_snapshot,
+    convert the remaining values first. lazy is ignored in thread safe mode, where the values are
+    converted to publish them.
     """
 
-    def __init__(self):
+    def __synchronized(method):
+        # Decorator holding the writer lock while the method runs, when thread safe operation is enabled
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if self.__lock is None:
+                return method(self, *args, **kwargs)
+            with self.__lock:
+                return method(self, *args, **kwargs)
+        return wrapper
+
+    def __init__(self, parse_cache=None, thread_safe=False, lazy=False):
         self.__expectations = []
+        self.__index = {}
+        self.__sections = {}
+        self.__positions = {}
+        self.__positionsShared = False
+        self.__fingerprint = None
+        self.__overrideNames = None
+        self.__parseCache = parse_cache
         self.__configObject = ConfigParser()
         self.__configReady = False
         self.__configurationFile = None
+        self.__fileState = None
+        self.__rawValues = None
+        self.__reader = 'configparser'
+        self.__writtenFiles = {}
+        self.__reloadCallbacks = []
+        # (section, key) -> tuple of (callback, executor) added with subscribe
+        self.__subscribers = {}
+        self.__watchThread = None
+        self.__watchStop = None
+        self.__lock = threading.RLock() if thread_safe else None
+        self.__snapshot = MappingProxyType({}) if thread_safe else None
+        self.__shared = None
+        self.__publishing = thread_safe
+        self.__accessor = None
+        self.__metrics = None
+        self.__metricsCallback = None
+        self.__counters = None
+        self.__queuedWrites = {}
+        self.__runningWrites = {}
+        if lazy and thread_safe:
+            log.warning("Lazy conversion is not used in thread safe mode, values are converted when loaded")
+        # (section, key) -> (raw string, file name) of the values loaded but not converted yet
+        self.__pending = {} if lazy and not thread_safe else None
 
     def get_expectations(self):
         """ Get all the expectations which have been applied.
 
         Returns:
-        A list of dictionaries detailing the expectations. The following keys exist:
+        A list of Expectation records detailing the expectations. Each record can be used as a
+        dictionary (or through attributes) with the following keys:
            - section (str) - The configuration section the expectation belongs to.
            - key (str) - The key of the configuration expectation.
            - data_type - The data type of the expectation. Valid types (bool, float, str, int)
            - default - The default value of the expectation to be used .
            - message - not implemented
        """
+        self.__resolve_all()
         return self.__expectations
 
     def get_config_parser_object(self):
         """ Get the underlying ConfigParser object being used
 
+        It holds the file last loaded with the configparser reader.
+
         Returns:
         The config parser object
         """
         return self.__configObject
 
+    @__synchronized
     def set_expectation(self, section, key, data_type, default, message=None):
         """ Set an expectation for a section / key pair to be contained in a configuration file.
 
@@ -82,56 +1262,162 @@ class ConfigChecker():
         - The section name or key are not of type str
         """
 
-        if data_type not in [bool, float, str, int]:
-            log.warning("Trying to add expection with not allowed data type [{}]. Allowed types = [bool, int, str, float]".format(
-                data_type))
+        error = _expectation_error(section, key, data_type, default)
+        if error is not None:
+            log.warning("Cannot add expectation with Section: [%s], Key [%s]. %s", section, key, error)
             return False
 
-        if data_type is int and not self.__is_integer(default):
-            self.__log_wrong_expectation_data_type(section, key, data_type, default);
+        keyName = key.lower()
+        if (section, keyName) in self.__index:
+            log.warning("Attempting to and entry which already exists. Section: [%s], Key [%s]", section, key)
             return False
 
-        if data_type is float and not self.___is_float(default):
-            self.__log_wrong_expectation_data_type(section, key, data_type, default);
-            return False
+        if keyName != key:
+            log.warning("Converting key [%s] to all lower case", key)
 
-        if data_type is bool and not self.__is_boolean(default):
-            self.__log_wrong_expectation_data_type(section, key, data_type, default);
-            return False
+        newExpection = Expectation(section, keyName, data_type, default, message)
+        self.__add_to_index(newExpection)
+        self.__publish((section,))
+        log.debug("Added new expectation with Section: [%s], Key [%s], DataType [%s], Default [%s]",
+            section, key, data_type, default)
+        return True
 
-        if self.__is_integer(section) or self.___is_float(section) or self.__is_boolean(section):
-            log.warning("Section names must be strings, passed name = [{}]".format(section))
-            return False
+    @__synchronized
+    def set_expectations_bulk(self, entries):
+        """Set many expectations at once.
 
-        if self.__is_integer(key) or self.___is_float(key) or self.__is_boolean(key):
-            log.warning("Section names must be strings, passed name = [{}]".format(section))
-            return False
+        Each entry is validated as with set_expectation, but rejected entries are returned instead
+        of each being logged.
 
-        entryExists,position = self.expectation_exists_at_index(section, key)
-        if entryExists:
-            log.warning("Attempting to and entry which already exists. Section: [{}], Key [{}]".format(section, key))
-            return False
+        Parameters:
+        entries - Iterable of expectations, each either a (section, key, data_type, default) or
+            (section, key, data_type, default, message) tuple, or a dictionary with the keys
+            section, key, data_type, default and optionally message.
 
-        if not str(key).islower():
-            log.warning("Converting key [{}] to all lower case".format(key))
+        Returns:
+        A BulkReport with the number of expectations added and a list of (entry, reason) tuples
+        for the entries which were rejected.
+        """
 
-        newExpection = {
-            'section': section,
-            'key':  str(key).lower(),
-            'value': None,
-            'data_type': data_type,
-            'default': default,
-            'message': message,
-            }
-        self.__expectations.append(newExpection)
-        log.debug("Added new expectation with Section: [{}], Key [{}], DataType [{}], Default [{}]".format(
-            section, key, data_type, default))
-        return True
+        added = 0
+        rejected = []
+        sections = set()
+        for entry in entries:
+            try:
+                if isinstance(entry, Mapping):
+                    section, key, data_type, default = entry['section'], entry['key'], entry['data_type'], entry['default']
+                    message = entry.get('message')
+                else:
+                    section, key, data_type, default, *message = entry
+                    if len(message) > 1:
+                        raise ValueError("Too many fields")
+                    message = message[0] if message else None
+            except (KeyError, TypeError, ValueError):
+                rejected.append((entry, "Malformed entry"))
+                continue
+
+            error = _expectation_error(section, key, data_type, default)
+            if error is None:
+                keyName = key.lower()
+                if (section, keyName) in self.__index:
+                    error = "Expectation already exists"
+            if error is not None:
+                rejected.append((entry, error))
+                continue
+            self.__add_to_index(Expectation(section, keyName, data_type, default, message))
+            sections.add(section)
+            added += 1
+        self.__publish(sections)
+
+        if rejected:
+            log.warning("Rejected %s of %s expectations, first rejected entry %s: %s",
+                        len(rejected), added + len(rejected), rejected[0][0], rejected[0][1])
+        log.debug("Added %s expectations", added)
+        return BulkReport(added, rejected)
+
+    @classmethod
+    def from_schema(cls, schema, **kwargs):
+        """Create a ConfigChecker with the expectations described by a schema.
 
-    def __log_wrong_expectation_data_type(self, section, key, data_type, default):
-        log.warning("Trying to set expectation Section: [{}], Key [{}], Default [{}] with wrong data type. (Type = [{}])".format(
-            section,key,default,data_type))
+        Parameters:
+        schema - A compiled Schema, or either a dictionary, or the name of a JSON file holding one, of the form
+            {section: {key: spec}}. Each spec is a (data_type, default) or (data_type, default,
+            message) sequence, or a dictionary with the keys type, default and optionally message.
+            Data types can be given by name ("int", "float", "bool", "str" or a registered type).
+        Other keyword arguments are passed to ConfigChecker().
 
+        Returns:
+        The new ConfigChecker. Expectations which couldn't be added, or a schema file which
+        couldn't be read, are logged.
+        """
+
+        checker = cls(**kwargs)
+        if isinstance(schema, Schema):
+            checker.__use_schema(schema)
+            return checker
+        try:
+            entries = list(_schema_entries(schema))
+        except (OSError, ValueError, AttributeError) as error:
+            log.warning("Failed to read schema [%s]: %s", schema, error)
+            return checker
+        checker.set_expectations_bulk(entries)
+        return checker
+
+    @__synchronized
+    def __use_schema(self, schema):
+        # Copy the records of a compiled schema, the positions are shared until expectations change
+        records = [record._copy_definition() for record in schema._records]
+        self.__expectations = records
+        self.__index = dict(zip(schema._positions, records))
+        self.__sections = {section: dict(zip(keys, [records[p] for p in positions]))
+                           for section, keys, positions in schema._sections}
+        self.__positions = schema._positions
+        self.__positionsShared = True
+        self.__fingerprint = schema._fingerprint
+        self.__publish()
+
+    def __add_to_index(self, expectation):
+        section = expectation.section
+        key = expectation.key
+        indexKey = (section, key)
+        self.__fingerprint = None
+        self.__overrideNames = None
+        self.__own_positions()
+        self.__positions[indexKey] = len(self.__expectations)
+        self.__expectations.append(expectation)
+        self.__index[indexKey] = expectation
+        self.__sections.setdefault(section, {})[key] = expectation
+
+    def __remove_from_index(self, section, key):
+        self.__fingerprint = None
+        self.__overrideNames = None
+        self.__own_positions()
+        position = self.__positions.pop((section, key))
+        del self.__index[(section, key)]
+        if self.__pending:
+            self.__pending.pop((section, key), None)
+        self.__subscribers.pop((section, key), None)
+        sectionEntries = self.__sections[section]
+        del sectionEntries[key]
+        if len(sectionEntries) == 0:
+            del self.__sections[section]
+        self.__expectations.pop(position)
+        # Entries after the removed one shift down by one
+        for expectation in self.__expectations[position:]:
+            self.__positions[(expectation.section, expectation.key)] -= 1
+
+    def __own_positions(self):
+        # Copy the positions shared with a Schema before changing them
+        if self.__positionsShared:
+            self.__positions = dict(self.__positions)
+            self.__positionsShared = False
+
+    def __schema_fingerprint(self):
+        if self.__fingerprint is None:
+            self.__fingerprint = _schema_fingerprint(self.__expectations)
+        return self.__fingerprint
+
+    @__synchronized
     def remove_expectation(self, section, key):
         """Remove a previouly set expectation
 
@@ -144,13 +1430,13 @@ class ConfigChecker():
         False: The entry didn't exist or couldn't be removed.
         """
 
-        entryExist, position = self.expectation_exists_at_index(section, key)
-        if entryExist:
-            log.debug("Removing expectation with Section: [{}], Key [{}]".format(section, key))
-            self.__expectations.pop(position)
+        if (section, key) in self.__index:
+            log.debug("Removing expectation with Section: [%s], Key [%s]", section, key)
+            self.__remove_from_index(section, key)
+            self.__publish((section,))
             return True
         else:
-            log.warning("Trying to remove expectation which doesn't exist. Section: [{}], Key [{}]".format(section, key))
+            log.warning("Trying to remove expectation which doesn't exist. Section: [%s], Key [%s]", section, key)
             return False
 
     def expectation_exists_at_index(self, section, key):
@@ -164,10 +1450,10 @@ class ConfigChecker():
         True, index - The index of the section and key.
         False, None - The section and key didn't exist.
         """
-        for i, expectation in enumerate(self.__expectations):
-            if expectation['section'] == section and expectation['key'] == key:
-                return True, i
-        return False, None
+        position = self.__positions.get((section, key))
+        if position is None:
+            return False, None
+        return True, position
 
     def get_value(self, section, key):
         """Get the value of a key in a section
@@ -176,18 +1462,270 @@ class ConfigChecker():
         section (str) - The configuration section the expectation belongs to.
         key (str) - The key of the configuration expectation.
 
+        In thread safe mode the value is read from the latest snapshot without taking a lock.
+
         Returns:
         The value of the expection if the key and section are valid.
         None: If the key or section are not valid (expectation doesn't exist)
         """
 
-        entryExists, position = self.expectation_exists_at_index(section, key)
-        if entryExists:
-            return self.__expectations[position]['value']
-        log.warning("Trying to retreive a value for an expectation which doean't exist. Section: [{}], Key [{}]".format(
-            section, key))
+        snapshot = self.__snapshot
+        shared = self.__shared
+        if shared is not None and not shared.owner:
+            snapshot = shared.read()
+        if snapshot is not None:
+            value = snapshot.get(section, _NO_VALUES).get(key, _MISSING)
+            if value is not _MISSING:
+                return value
+        else:
+            expectation = self.__index.get((section, key))
+            if expectation is not None:
+                if self.__pending and (section, key) in self.__pending:
+                    return self.__resolve((section, key), expectation)
+                return expectation.value
+        log.warning("Trying to retreive a value for an expectation which doean't exist. Section: [%s], Key [%s]",
+            section, key)
         return None
 
+    def get_values(self, pairs):
+        """Get the values of several section / key pairs with one call.
+
+        In thread safe mode all values are read from the same snapshot, so they are consistent
+        with each other.
+
+        Parameters:
+        pairs - Iterable of (section, key) tuples.
+
+        Returns:
+        A tuple of the values in the order of pairs, None for pairs with no expectation.
+        """
+
+        snapshot = self.__current_snapshot()
+        values = []
+        missing = []
+        if snapshot is None:
+            index = self.__index
+            pending = self.__pending
+            for section, key in pairs:
+                expectation = index.get((section, key))
+                if expectation is None:
+                    missing.append((section, key))
+                    values.append(None)
+                elif pending and (section, key) in pending:
+                    values.append(self.__resolve((section, key), expectation))
+                else:
+                    values.append(expectation.value)
+        else:
+            for section, key in pairs:
+                value = snapshot.get(section, _NO_VALUES).get(key, _MISSING)
+                if value is _MISSING:
+                    missing.append((section, key))
+                    value = None
+                values.append(value)
+        if missing:
+            log.warning("Trying to retreive values for expectations which don't exist: %s", missing)
+        return tuple(values)
+
+    def get_section(self, section):
+        """Get the values of all keys in a section.
+
+        Parameters:
+        section (str) - The configuration section.
+
+        Returns:
+        A read only mapping of key to value, or None if the section has no expectations.
+        In thread safe mode the mapping is part of the latest snapshot and never changes.
+        """
+
+        snapshot = self.__current_snapshot()
+        if snapshot is None:
+            expectations = self.__sections.get(section)
+            if expectations is not None and self.__pending:
+                for key, expectation in expectations.items():
+                    if (section, key) in self.__pending:
+                        self.__resolve((section, key), expectation)
+            values = None if expectations is None else MappingProxyType({key: e.value for key, e in expectations.items()})
+        else:
+            values = snapshot.get(section)
+        if values is None:
+            log.warning("Trying to retreive the values of a section which doesn't exist. Section: [%s]", section)
+        return values
+
+    def get_accessor(self):
+        """Get an object reading values with attribute access, for example config.get_accessor().General.retries
+
+        The accessor and its section objects are created once, values are read with the same
+        rules as get_value so they always are the current values. See ConfigAccessor.
+
+        Returns:
+        The ConfigAccessor of this object.
+        """
+
+        if self.__accessor is None:
+            self.__accessor = ConfigAccessor(self.__lookup)
+        return self.__accessor
+
+    def __current_snapshot(self):
+        # The mapping values are read from, None when they are read from the expectations
+        shared = self.__shared
+        if shared is not None and not shared.owner:
+            return shared.read()
+        return self.__snapshot
+
+    def __lookup(self, section, key):
+        # The current value of a key, _MISSING if there is no expectation. get_value has the same lookup inline
+        snapshot = self.__snapshot
+        shared = self.__shared
+        if shared is not None and not shared.owner:
+            snapshot = shared.read()
+        if snapshot is not None:
+            return snapshot.get(section, _NO_VALUES).get(key, _MISSING)
+        expectation = self.__index.get((section, key))
+        if expectation is None:
+            return _MISSING
+        if self.__pending and (section, key) in self.__pending:
+            return self.__resolve((section, key), expectation)
+        return expectation.value
+
+    def get_snapshot(self):
+        """Get a read only copy of all the values.
+
+        In thread safe mode this is the latest published snapshot, which is never changed, so many
+        values can be read from it consistently without holding a lock.
+
+        Returns:
+        A read only mapping of section to a read only mapping of key to value.
+        """
+        snapshot = self.__current_snapshot()
+        if snapshot is not None:
+            return snapshot
+        self.__resolve_all()
+        return self.__build_snapshot(self.__sections, {})
+
+    def __build_snapshot(self, sections, snapshot):
+        for section in sections:
+            expectations = self.__sections.get(section)
+            if expectations is None:
+                snapshot.pop(section, None)
+            else:
+                snapshot[section] = MappingProxyType({key: e.value for key, e in expectations.items()})
+        return MappingProxyType(snapshot)
+
+    def __publish(self, sections=None):
+        # Replace the snapshot read by get_value, only rebuilding the given sections, and update the shared memory segment
+        if self.__lock is not None:
+            if sections is None:
+                self.__snapshot = self.__build_snapshot(self.__sections, {})
+            else:
+                self.__snapshot = self.__build_snapshot(sections, dict(self.__snapshot))
+        if self.__shared is not None and self.__shared.owner:
+            self.__write_shared()
+
+    def __write_shared(self):
+        self.__resolve_all()
+        values = {section: {key: e.value for key, e in expectations.items()} for section, expectations in self.__sections.items()}
+        if not self.__shared.write(values):
+            log.warning("Values don't fit in shared memory segment '%s' (%s bytes), workers keep the previous values",
+                        self.__shared.memory.name, self.__shared.memory.size)
+            return False
+        return True
+
+    @__synchronized
+    def publish_shared(self, name=None, size=None):
+        """Publish the values to a shared memory segment which other processes can attach to with attach_shared.
+
+        The segment is updated whenever values change in this object, for example by set_value or
+        set_configuration_file. It is intended for pre-fork servers: the parent loads the
+        configuration and publishes it, each worker process attaches to the segment and reads the
+        values with get_value without parsing any files. Workers forked after publish_shared can
+        use the inherited object, which reads from the segment and never writes to it.
+
+        Requires Python 3.8 or newer (multiprocessing.shared_memory).
+
+        Parameters:
+        name (str) - The name of the segment, a unique name is generated if None.
+        size (int) - The size of the segment in bytes. Defaults to four times the current size of
+            the values (at least 64 KiB). Updates which no longer fit are not published.
+
+        Returns:
+        The name of the segment, or None if it couldn't be created.
+        """
+
+        if shared_memory is None:
+            log.warning("Shared memory requires Python 3.8 or newer")
+            return None
+        if self.__shared is not None:
+            log.warning("Values are already shared through segment '%s'", self.__shared.memory.name)
+            return None
+        self.__resolve_all()
+        values = {section: {key: e.value for key, e in expectations.items()} for section, expectations in self.__sections.items()}
+        if size is None:
+            size = max(65536, 4 * len(pickle.dumps(values, pickle.HIGHEST_PROTOCOL)))
+        try:
+            self.__shared = _SharedSegment.create(name, _SharedSegment.HEADER.size + size)
+        except (OSError, ValueError) as error:
+            log.warning("Failed creating shared memory segment '%s': %s", name, error)
+            return None
+        self.__publishing = True
+        if not self.__write_shared():
+            self.close_shared()
+            return None
+        log.debug("Published values to shared memory segment '%s'", self.__shared.memory.name)
+        return self.__shared.memory.name
+
+    def attach_shared(self, name):
+        """Read values from a shared memory segment created with publish_shared in another process.
+
+        After attaching, get_value and get_snapshot return the values published to the segment,
+        including later updates, instead of the values held by this object. A ConfigChecker
+        inherited by a process forked after publish_shared already reads from the segment.
+
+        Parameters:
+        name (str) - The name of the segment returned by publish_shared.
+
+        Returns:
+        True: The segment was attached.
+        False: The segment doesn't exist or isn't a ConfigChecker segment, or values are already shared.
+        """
+
+        if shared_memory is None:
+            log.warning("Shared memory requires Python 3.8 or newer")
+            return False
+        shared = self.__shared
+        if shared is not None:
+            if shared.pid is not None and not shared.owner and shared.memory.name == name.lstrip('/'):
+                # Published by the process this one was forked from, the values are already read from it
+                return True
+            log.warning("Values are already shared through segment '%s'", shared.memory.name)
+            return False
+        try:
+            self.__shared = _SharedSegment.attach(name)
+        except (OSError, ValueError) as error:
+            log.warning("Failed attaching to shared memory segment '%s': %s", name, error)
+            return False
+        return True
+
+    @__synchronized
+    def close_shared(self):
+        """Stop using the shared memory segment of publish_shared or attach_shared.
+
+        The segment is removed when it was created by this object with publish_shared, in the
+        process which called it.
+
+        Returns:
+        True: The segment was closed.
+        False: No segment was in use.
+        """
+
+        if self.__shared is None:
+            return False
+        shared = self.__shared
+        self.__shared = None
+        self.__publishing = self.__lock is not None
+        shared.close()
+        return True
+
+    @__synchronized
     def set_value(self, section, key, value):
         """Set the value of a section's key.
 
@@ -208,90 +1746,162 @@ class ConfigChecker():
         """
 
         if not self.__configReady:
-            log.warning("Change the value of an expection with Section: [{}], Key: [{}], \
-                        Value: [{}] when target file not set. Call set_configuration_file first".format(
-                section, key, value))
-            return False
-        entryExists, position = self.expectation_exists_at_index(section, key)
-        if entryExists:
-            if self.__expectations[position]['data_type'] is int:
-                if self.__is_integer(value):
-                    self.__log_value_update(section, key, value, position, True)
-                    self.__expectations[position]['value'] = value
-                    return True
-                else:
-                    self.__log_value_update(section, key, value, position, False)
-                    return False
-            elif self.__expectations[position]['data_type'] is float:
-                if self.___is_float(value):
-                    self.__log_value_update(section, key, value, position, True)
-                    self.__expectations[position]['value'] = value
-                    return True
-                else:
-                    self.__log_value_update(section, key, value, position, False)
-                    return False
-            elif self.__expectations[position]['data_type'] is bool:
-                if self.__is_boolean(value):
-                    self.__log_value_update(section, key, value, position, True)
-                    self.__expectations[position]['value'] = value
-                    return True
-                else:
-                    self.__log_value_update(section, key, value, position, False)
-                    return False
-            else:
-                self.__expectations[position]['value'] = value
-                self.__log_value_update(section, key, value, position, True)
-                return True
-        else:
-            log.warning("Cannot update the value of Section [{}], Key [{}] to [{}], entry doesn't exists in expectation list".format(
-                section, key, value))
+            log.warning("Change the value of an expection with Section: [%s], Key: [%s], "
+                        "Value: [%s] when target file not set. Call set_configuration_file first",
+                section, key, value)
+            return False
+        expectation = self.__index.get((section, key))
+        if expectation is None:
+            log.warning("Cannot update the value of Section [%s], Key [%s] to [%s], entry doesn't exists in expectation list",
+                section, key, value)
             return False
+        if expectation.validator(value):
+            self.__log_value_update(section, key, value, expectation, True)
+            if self.__pending:
+                self.__pending.pop((section, key), None)
+            oldValue = expectation.value
+            expectation.value = value
+            expectation.dirty = True
+            expectation.source = None
+            if self.__publishing:
+                self.__publish((section,))
+            if self.__subscribers and (section, key) in self.__subscribers and self.__value_changed(oldValue, value):
+                self.__notify((section, key), value)
+            return True
+        self.__log_value_update(section, key, value, expectation, False)
+        return False
 
-    def __log_value_update(self, section, key, value, position, success):
-        if success:
-            log.debug("Updated the value of Section [{}], Key [{}], from [{}] to [{}]".format(
-                section, key, self.__expectations[position]['value'], value))
-        else:
-            log.warning("Cannot update the value of Section [{}], Key [{}], from [{}] to [{}], wrong type (type = [{}])".format(
-                section, key, self.__expectations[position]['value'], value, self.__expectations[position]['data_type']))
+    @__synchronized
+    def set_values(self, values, write=False):
+        """Set the values of several section / key pairs at once, all or nothing.
 
-    def __is_integer(self, value):
-        try:
-            int(value)
-            return True
-        except ValueError:
-            return False
+        All values are checked before any is changed. The values are published together, in thread
+        safe mode get_value sees either none or all of them.
 
-    def ___is_float(self, value):
-        try:
-            float(value)
-            return True
-        except ValueError:
+        ATTENTION: set_configuration_file() must be called before this function will work.
+
+        Parameters:
+        values - Mapping of (section, key) tuples to values, or an iterable of ((section, key), value) tuples.
+        write (bool) - Write the changed values to the configuration file with a single call of
+            write_changes. If the write fails the previous values are restored.
+
+        Returns:
+        True: All values were set (and written).
+        False: No value was changed, possible causes:
+        - A section / key pair doesn't exist or a value doesn't match the type set by set_expectation.
+        - No configuration file target has been loaded.
+        - The values couldn't be written.
+        """
+
+        if not self.__configReady:
+            log.warning("Trying to change values when target file not set. Call set_configuration_file first")
+            return False
+        if isinstance(values, Mapping):
+            values = values.items()
+        index = self.__index
+        changes = []
+        rejected = []
+        for entry in values:
+            try:
+                (section, key), value = entry
+            except (TypeError, ValueError):
+                rejected.append((entry, "Malformed entry"))
+                continue
+            expectation = index.get((section, key))
+            if expectation is None:
+                rejected.append(((section, key), "Expectation doesn't exist"))
+            elif not expectation.validator(value):
+                rejected.append(((section, key), "Wrong type, expected {}".format(expectation.data_type.__name__)))
+            else:
+                changes.append((expectation, value))
+        if self.__counters is not None:
+            self.__counters.keys += len(changes) + len(rejected)
+            self.__counters.failures += len(rejected)
+        if rejected:
+            log.warning("Cannot set %s of %s values, no value was changed. First rejected %s: %s",
+                        len(rejected), len(changes) + len(rejected), rejected[0][0], rejected[0][1])
             return False
 
-    def __is_boolean(self, value):
-        return type(value) == bool
+        pending = self.__pending
+        if write:
+            if pending:
+                for expectation, value in changes:
+                    indexKey = (expectation.section, expectation.key)
+                    if indexKey in pending:
+                        self.__resolve(indexKey, expectation)
+            previous = [(expectation.value, expectation.dirty, expectation.source) for expectation, value in changes]
+        before = self.__watched_values((expectation.section, expectation.key) for expectation, value in changes)
+        for expectation, value in changes:
+            if pending:
+                pending.pop((expectation.section, expectation.key), None)
+            expectation.value = value
+            expectation.dirty = True
+            expectation.source = None
+        result = True
+        if write and not self.write_changes():
+            log.warning("Failed writing %s changed values, restoring the previous values", len(changes))
+            for (expectation, value), (oldValue, dirty, source) in zip(changes, previous):
+                expectation.value = oldValue
+                expectation.dirty = dirty
+                expectation.source = source
+            result = False
+        if self.__publishing:
+            self.__publish(set(expectation.section for expectation, value in changes))
+        self.__notify_changes(before)
+        log.debug("Set %s values", len(changes))
+        return result
+
+    def transaction(self, write=False):
+        """Collect changes and apply them together with set_values when the with block ends.
+
+        with config.transaction(write=True) as changes:
+            changes.set_value('General','retries',3)
+            changes.set_value('General','api_key','123-23423csdfs3-2342-234')
+        print(changes.committed)
+
+        Nothing is applied if the block raises an exception or any change is invalid.
+
+        Parameters:
+        write (bool) - Write the changed values with a single write, see set_values.
+
+        Returns:
+        A Transaction to use as a context manager.
+        """
+        return Transaction(self, write)
+
+    def __log_value_update(self, section, key, value, expectation, success):
+        if success:
+            log.debug("Updated the value of Section [%s], Key [%s], from [%s] to [%s]",
+                section, key, expectation.value, value)
+        else:
+            log.warning("Cannot update the value of Section [%s], Key [%s], from [%s] to [%s], wrong type (type = [%s])",
+                section, key, expectation.value, value, expectation.data_type)
 
     def print_expectations(self):
         """Print the currently set expectations to stdout.
         """
+        self.__resolve_all()
         print("Configuration Values")
         for expectation in self.__expectations:
             print()
-            print("Section:\t", expectation['section'])
-            print("Key\t\t", expectation['key'])
-            print("Data Type:\t", expectation['data_type'])
-            print("Value:\t\t", expectation['value'])
-            print("Default Value:\t", expectation['default'])
+            print("Section:\t", expectation.section)
+            print("Key\t\t", expectation.key)
+            print("Data Type:\t", expectation.data_type)
+            print("Value:\t\t", expectation.value)
+            print("Default Value:\t", expectation.default)
 
+    @__synchronized
     def write_configuration_file(self, filename=None):
         """Write (syncronise) a configuration file with the current expectations.
 
+        The file is replaced atomically, readers see either the previous or the new content. If the
+        file already holds the same content it isn't written again.
+
         Parameters:
         filename: The name (and path) to the configuration file to write
 
         Returns:
-        True: The file was written successfuly.
+        True: The file was written successfuly (or already had the same content).
         False: An error occured, possible causes:
         - Incorrect file permissions.
         - OsError - file exists and if of wrong type (eg. directory)
@@ -303,26 +1913,126 @@ class ConfigChecker():
 
         if filename is None:
             filename = self.__configurationFile
+        if filename is None:
+            log.warning("Trying to write a configuration file without a file name, call set_configuration_file first")
+            return False
+
+        self.__resolve_all()
+        data = self.__render().encode(locale.getpreferredencoding(False))
+        digest = hashlib.sha1(data).hexdigest()
+        path = os.path.abspath(filename)
+        try:
+            if self.__file_has_content(path, data, digest):
+                log.debug("Configuration file '%s' is unchanged, not writing", filename)
+                return True
+            _write_file_atomically(path, data)
+            log.debug("Writing a new configuration file '%s'", filename)
+            if self.__counters is not None:
+                self.__counters.keys += len(self.__expectations)
+                self.__counters.bytes_written += len(data)
+        except PermissionError:
+            log.warning("Failed writing configuration file '%s (Permission Error)'", filename)
+            return False
+        except OSError:
+            log.warning("Failed writing configuration file '%s (OS Error)'", filename)
+            return False
+        self.__remember_written_file(path, digest)
+        for expectation in self.__expectations:
+            expectation.dirty = False
+        return True
+
+    @__synchronized
+    def write_changes(self, filename=None):
+        """Write only the values changed with set_value since the last write to a configuration file.
 
-        newConfig = ConfigParser()
+        Lines of changed keys are replaced, all other content of the file (comments, ordering and
+        keys which aren't expectations) is kept as is. Changed keys which don't exist in the file
+        are added to the end of their section, or in a new section at the end of the file.
+        If the file doesn't exist, it is written with write_configuration_file.
 
+        Parameters:
+        filename: The name (and path) to the configuration file to write
+
+        Returns:
+        True: The changes were written successfuly (or there were no changes).
+        False: An error occured, see write_configuration_file.
+        """
+
+        if filename is None:
+            filename = self.__configurationFile
+        if filename is None:
+            log.warning("Trying to write changes to a configuration file without a file name, call set_configuration_file first")
+            return False
+
+        pending = {}
         for expectation in self.__expectations:
-            if not newConfig.has_section(expectation['section']):
-                newConfig.add_section(expectation['section'])
-            newConfig[expectation['section']][expectation['key']] = str(expectation['value'])
+            if expectation.dirty:
+                pending.setdefault(expectation.section, {})[expectation.key] = expectation
+        if len(pending) == 0:
+            return True
+
+        encoding = locale.getpreferredencoding(False)
+        path = os.path.abspath(filename)
+        try:
+            with open(path, 'rb') as f:
+                existing = f.read()
+            content = existing.decode(encoding)
+        except FileNotFoundError:
+            return self.write_configuration_file(filename)
+        except (OSError, UnicodeDecodeError):
+            log.warning("Failed reading configuration file '%s' to write changes", filename)
+            return False
+
+        data = _patch_ini(content, pending).encode(encoding)
         try:
-            with open(filename, 'w') as f:
-                newConfig.write(f)
-                log.debug("Writing a new configuration file '{}'".format(filename))
+            _write_file_atomically(path, data)
+            log.debug("Wrote changed values to configuration file '%s'", filename)
+            if self.__counters is not None:
+                self.__counters.keys += sum(len(expectations) for expectations in pending.values())
+                self.__counters.bytes_read += len(existing)
+                self.__counters.bytes_written += len(data)
         except PermissionError:
-            log.warning("Failed writing configuration file '{} (Permission Error)'".format(filename))
+            log.warning("Failed writing configuration file '%s (Permission Error)'", filename)
             return False
         except OSError:
-            log.warning("Failed writing configuration file '{} (OS Error)'".format(filename))
+            log.warning("Failed writing configuration file '%s (OS Error)'", filename)
             return False
+        self.__remember_written_file(path, hashlib.sha1(data).hexdigest())
+        for expectations in pending.values():
+            for expectation in expectations.values():
+                expectation.dirty = False
         return True
 
-    def set_configuration_file(self,filename):
+    def __render(self):
+        # Same layout as ConfigParser.write
+        parts = []
+        for section, expectations in self.__sections.items():
+            parts.append("[{}]\n".format(section))
+            for key, expectation in expectations.items():
+                parts.append("{} = {}\n".format(key, str(expectation.value).replace('\n', '\n\t')))
+            parts.append("\n")
+        return "".join(parts)
+
+    def __file_has_content(self, path, data, digest):
+        # Compare against the digest remembered for the file, reading it only if its state is unknown
+        state = self.__file_state(path)
+        if state is None or state[0] != len(data):
+            return False
+        written = self.__writtenFiles.get(path)
+        if written is not None and written[1] == state:
+            return written[0] == digest
+        with open(path, 'rb') as f:
+            existingDigest = hashlib.sha1(f.read()).hexdigest()
+        self.__writtenFiles[path] = (existingDigest, state)
+        return existingDigest == digest
+
+    def __remember_written_file(self, path, digest):
+        state = self.__file_state(path)
+        if state is not None:
+            self.__writtenFiles[path] = (digest, state)
+
+    @__synchronized
+    def set_configuration_file(self, filename, reader='configparser'):
 
         """Read (syncronise) the current expectations with a configuration file.
 
@@ -331,8 +2041,19 @@ class ConfigChecker():
 
         Section / key pairs in the configuration file which are not an expectation are ignored.
 
+        If a parse cache holds the values of the unchanged file, they are loaded without parsing the
+        file and the ConfigParser object (get_config_parser_object) is not updated.
+
         Parameters:
         filename: The name (and path) to the configuration file to write
+        reader (str): How the file is read, one of:
+            - configparser - The file is read into the ConfigParser object.
+            - stream - The file is read line by line in a single pass, only the values of
+              expectations are kept and sections without expectations are skipped. Values are not
+              interpolated and the ConfigParser object is not updated.
+            - mmap - As stream, but the file is memory mapped and scanned as bytes. Sections without
+              expectations are skipped without reading their lines and only the values of
+              expectations are decoded, for very large files.
 
         Returns:
         True: The file was loaded successfuly
@@ -342,87 +2063,1142 @@ class ConfigChecker():
         - No expectations have been set
         """
 
-        if len(self.__expectations) == 0:
-            log.warning("Trying to open a configuration file '{}' with no __expectations set, nothing was loaded".format(filename))
+        if not self.__can_load(filename, reader):
+            return False
+        source = self.__read_source(filename, reader)
+        result, loaded = _run_steps(self.__apply_source(filename, reader, source))
+        self.__cache_loaded_values(filename, source, loaded)
+        return result
+
+    async def aload(self, filename, reader='configparser', budget=0.005, executor=None):
+        """Coroutine version of set_configuration_file for use on an asyncio event loop.
+
+        The file is read and parsed in an executor. The values are then converted on the event loop
+        in chunks, control is handed back to the loop whenever a chunk ran for longer than budget.
+        Until the coroutine finishes get_value may return a mix of previous and new values, except
+        with thread_safe=True where the new values are published once all of them are loaded.
+        Expectations shouldn't be changed while the file is loaded.
+
+        Parameters:
+        filename: The name (and path) to the configuration file to read
+        reader (str): How the file is read, see set_configuration_file
+        budget (float): How long in seconds values are converted on the event loop before control
+            is handed back to it (the chunk running at the deadline finishes first). It only bounds
+            the conversion: the executor parsing the file holds the GIL for part of the time and
+            garbage collection can pause the loop, so the loop can still lag for longer.
+        executor: The concurrent.futures executor which reads the file, None for the loop's default
+
+        Returns:
+        True: The file was loaded successfuly
+        False: An error occured, see set_configuration_file
+        """
+
+        if not self.__can_load(filename, reader):
             return False
+        loop = _get_running_loop()
+        source = await loop.run_in_executor(executor, self.__read_source, filename, reader)
+        steps = self.__apply_source(filename, reader, source)
+        while True:
+            finished, value = self.__advance(steps, budget)
+            if finished:
+                break
+            await asyncio.sleep(0)
+        result, loaded = value
+        if loaded is not None:
+            await loop.run_in_executor(executor, self.__cache_loaded_values, filename, source, loaded)
+        return result
+
+    async def awrite(self, filename=None, executor=None):
+        """Coroutine version of write_configuration_file for use on an asyncio event loop.
+
+        The file is written in an executor. Concurrent calls for the same file are coalesced: while
+        a write is running, all further calls wait for a single write which starts when the running
+        one is done and holds the values set before it started.
+
+        Parameters:
+        filename: The name (and path) to the configuration file to write
+        executor: The concurrent.futures executor which writes the file, None for the loop's default
+
+        Returns:
+        True: The file was written successfuly (or already had the same content).
+        False: An error occured, see write_configuration_file.
+        """
+
+        if filename is None:
+            filename = self.__configurationFile
+        if filename is None:
+            log.warning("Trying to write a configuration file without a file name, call set_configuration_file first")
+            return False
+
+        loop = _get_running_loop()
+        path = os.path.abspath(filename)
+        queued = self.__queuedWrites.get(path)
+        if queued is not None:
+            try:
+                return await asyncio.shield(queued)
+            except asyncio.CancelledError:
+                if not queued.cancelled():
+                    raise
+            # The call which queued the write was cancelled before starting it, queue it again
+            return await self.awrite(filename, executor)
+
+        future = loop.create_future()
+        self.__queuedWrites[path] = future
         try:
-            if len(self.__configObject.read(filename)) == 0:
-                log.warning("Failed to open configuration file '{}'. Using default values for __expectations".format(filename))
-                self.__load_defaults_where_needed()
-                self.__configurationFile = filename
-                self.__configReady = True
-                return False
-        except:
-            log.warning("Failed to open configuration file '{}'. Using default values for __expectations".format(filename))
-            self.__load_defaults_where_needed()
-            self.__configurationFile = filename
-            self.__configReady = True
+            running = self.__runningWrites.get(path)
+            if running is not None:
+                await asyncio.wait([running])
+        except BaseException:
+            future.cancel()
+            raise
+        finally:
+            if self.__queuedWrites.get(path) is future:
+                del self.__queuedWrites[path]
+
+        task = loop.run_in_executor(executor, self.write_configuration_file, filename)
+        self.__runningWrites[path] = task
+
+        def finished(task):
+            # Runs when the write is done, even if this call was cancelled while waiting for it
+            if self.__runningWrites.get(path) is task:
+                del self.__runningWrites[path]
+            if task.cancelled():
+                future.cancel()
+            elif task.exception() is not None:
+                future.set_exception(task.exception())
+            else:
+                future.set_result(task.result())
+
+        task.add_done_callback(finished)
+        return await asyncio.shield(task)
+
+    @__synchronized
+    def load_layers(self, filenames, reader='configparser', executor=None):
+        """Read several configuration files in parallel and merge their values, later files take precedence.
+
+        Typical layers are defaults, site, host and environment files, or the fragments of a conf.d
+        directory in sorted order. A value in a later file overrides the value of the same key in
+        earlier files, files which can't be read are skipped and keys found in no file use their
+        default value, also if an earlier load set them. get_source returns the file which supplied
+        the value of a key.
+
+        The ConfigParser object isn't updated, and the files can't be reloaded or watched. The file
+        set with set_configuration_file (if any) is still the one written by default.
+
+        Parameters:
+        filenames: The names (and paths) of the files, lowest precedence first
+        reader (str): How each file is read, see set_configuration_file
+        executor: The concurrent.futures executor reading the files. A ProcessPoolExecutor parses
+            large files without contention for the GIL. None uses a thread pool with up to one
+            thread per CPU.
+
+        Returns:
+        True: At least one of the files was loaded
+        False: No file could be loaded or no expectations are set
+        """
+
+        filenames = list(filenames)
+        if not filenames or not self.__can_load(filenames[0], reader):
             return False
 
-        log.debug("Loading configuration file {}".format(filename))
-        self.___parse_config_values()
-        self.__load_defaults_where_needed()
+        wanted = {section: frozenset(expectations) for section, expectations in self.__sections.items()}
+        readers = [reader] * len(filenames)
+        wanteds = [wanted] * len(filenames)
+        if executor is None:
+            with concurrent.futures.ThreadPoolExecutor(min(len(filenames), os.cpu_count() or 1)) as pool:
+                layers = list(pool.map(_read_layer, filenames, readers, wanteds))
+        else:
+            layers = list(executor.map(_read_layer, filenames, readers, wanteds))
+
+        merged = {}
+        loaded = 0
+        for filename, rawValues in zip(filenames, layers):
+            if rawValues is None:
+                log.warning("Failed to open configuration file layer '%s', skipping it", filename)
+                continue
+            loaded += 1
+            for indexKey, raw in rawValues.items():
+                merged[indexKey] = (raw, filename)
+            if self.__counters is not None:
+                state = self.__file_state(filename)
+                self.__counters.bytes_read += state[0] if state is not None else 0
+        if self.__counters is not None:
+            self.__counters.keys += len(merged)
+
+        before = self.__watched_values()
+        pending = self.__pending
+        for indexKey, expectation in self.__index.items():
+            if indexKey not in merged:
+                # Values of earlier loads don't take part in the layers
+                if pending:
+                    pending.pop(indexKey, None)
+                expectation.value = expectation.default
+                expectation.source = None
+        if pending is not None:
+            pending.update(merged)
+        else:
+            debug = log.isEnabledFor(logging.DEBUG)
+            for indexKey, (raw, filename) in merged.items():
+                self.__convert(self.__index[indexKey], raw, debug, filename)
+        log.debug("Loaded %s of %s configuration file layers", loaded, len(filenames))
+        self.__rawValues = None
+        self.__fileState = None
         self.__configReady = True
+        self.__publish()
+        self.__notify_changes(before)
+        return loaded > 0
+
+    def get_source(self, section, key):
+        """Get the configuration file which supplied the value of an expectation.
+
+        Parameters:
+        section (str) - The configuration section the expectation belongs to.
+        key (str) - The key of the configuration expectation.
+
+        Returns:
+        The file name given to set_configuration_file or load_layers, '<environment>' or
+        '<command line>' for values set by apply_overrides, None when the value is the default,
+        was set with set_value or the expectation doesn't exist.
+        """
+
+        expectation = self.__index.get((section, key))
+        if expectation is None:
+            return None
+        if self.__pending and (section, key) in self.__pending:
+            self.__resolve((section, key), expectation)
+        return expectation.source
+
+    @__synchronized
+    def apply_overrides(self, environ=None, argv=None, prefix=''):
+        """Override values with environment variables and command line options.
+
+        The environment variable of an expectation is its section and key in upper case joined by
+        two underscores, with any character other than a letter or digit replaced by an
+        underscore: GENERAL__RETRIES=7 overrides the key retries of the section General. prefix is
+        put before every name, for example MYAPP_GENERAL__RETRIES with prefix='MYAPP_'.
+        Command line options are of the form --section.key=value or --section.key value, for
+        example --General.retries=7. Other options and arguments are ignored. Command line options
+        take precedence over environment variables.
+
+        Values are converted as values read from a configuration file. Overridden values aren't
+        marked as changed for write_changes, and are replaced when they are loaded again from a
+        file, so apply_overrides should be called after set_configuration_file.
+
+        Parameters:
+        environ - Mapping of environment variable names to values, os.environ if None.
+        argv - List of command line arguments, sys.argv[1:] if None. Pass () to ignore the command line.
+        prefix (str) - Prefix of the environment variable names.
+
+        Returns:
+        An OverrideReport with the (section, key) tuples of the overridden values and a list of
+        (name, reason) tuples of the overrides which couldn't be converted. Environment variables
+        starting with prefix which match no expectation are also rejected when a prefix is given.
+        """
+
+        if self.__overrideNames is None:
+            names = {}
+            for indexKey in self.__index:
+                name = _override_name(*indexKey)
+                if name in names:
+                    log.warning("Expectations %s and %s have the same override name %s, only the first can be overridden",
+                                names[name], indexKey, name)
+                    continue
+                names[name] = indexKey
+            self.__overrideNames = names
+        names = self.__overrideNames
+
+        overrides = OrderedDict()
+        rejected = []
+        if environ is None:
+            environ = os.environ
+        for variable, raw in environ.items():
+            if not variable.startswith(prefix):
+                continue
+            indexKey = names.get(variable[len(prefix):])
+            if indexKey is not None:
+                overrides[indexKey] = (variable, raw, '<environment>')
+            elif prefix:
+                rejected.append((variable, "No matching expectation"))
+        if argv is None:
+            argv = sys.argv[1:]
+        arguments = iter(argv)
+        for argument in arguments:
+            if not argument.startswith('--') or '.' not in argument:
+                continue
+            option, equals, raw = argument[2:].partition('=')
+            section, _, key = option.rpartition('.')
+            indexKey = names.get(_override_name(section, key))
+            if indexKey is None:
+                continue
+            if not equals:
+                raw = next(arguments, None)
+                if raw is None:
+                    rejected.append((argument, "Missing value"))
+                    continue
+            overrides.pop(indexKey, None)
+            overrides[indexKey] = (argument, raw, '<command line>')
+
+        applied = []
+        pending = self.__pending
+        before = self.__watched_values(overrides)
+        for indexKey, (name, raw, source) in overrides.items():
+            expectation = self.__index[indexKey]
+            try:
+                value = expectation.converter(raw)
+            except ValueError:
+                log.warning("Override %s of Section [%s], Key [%s] cannot be parsed as [%s], keeping value %s",
+                            name, indexKey[0], indexKey[1], expectation.data_type, expectation.value)
+                rejected.append((name, "Cannot be converted to {}".format(expectation.data_type.__name__)))
+                if self.__counters is not None:
+                    self.__counters.failures += 1
+                continue
+            if pending:
+                pending.pop(indexKey, None)
+            expectation.value = value
+            expectation.source = source
+            applied.append(indexKey)
+        self.__publish(set(section for section, key in applied))
+        self.__notify_changes(before)
+        log.debug("Applied %s overrides", len(applied))
+        return OverrideReport(applied, rejected)
+
+    @__synchronized
+    def save_snapshot(self, snapshot_filename):
+        """Save the values loaded from the configuration file to a binary snapshot file.
+
+        load_snapshot reads the values back without parsing the configuration file or converting
+        any values, as long as neither the file nor the expectations changed.
+
+        Values which weren't read from the file (defaults and values set with set_value) aren't
+        saved, after loading the snapshot they have their default value.
+
+        Parameters:
+        snapshot_filename: The name (and path) of the snapshot file to write
+
+        Returns:
+        True: The snapshot was written successfuly.
+        False: No file was loaded with set_configuration_file, or the snapshot couldn't be written.
+        """
+
+        state = self.__fileState
+        if not self.__configReady or self.__configurationFile is None or state is None:
+            log.warning("Trying to save a snapshot before a configuration file was loaded with set_configuration_file")
+            return False
+
+        filename = self.__configurationFile
+        self.__resolve_all()
+        values = []
+        sources = []
+        for expectation in self.__expectations:
+            if expectation.source == filename:
+                values.append(expectation.value)
+                sources.append(True)
+            else:
+                values.append(None)
+                sources.append(False)
+        try:
+            payload = pickle.dumps((values, sources), pickle.HIGHEST_PROTOCOL)
+        except (pickle.PicklingError, TypeError, AttributeError):
+            log.warning("Values of configuration file '%s' can't be saved to a snapshot", filename)
+            return False
+        path = os.path.abspath(filename).encode('utf-8', 'surrogateescape')
+        header = _SNAPSHOT_HEADER.pack(_SNAPSHOT_MAGIC, _SNAPSHOT_FORMAT, *state,
+                                       self.__snapshot_fingerprint(self.__reader), len(path), len(payload)) + path
+        try:
+            _write_file_atomically(os.path.abspath(snapshot_filename), header + payload)
+        except OSError:
+            log.warning("Failed writing snapshot file '%s'", snapshot_filename)
+            return False
+        if self.__counters is not None:
+            self.__counters.keys += sources.count(True)
+            self.__counters.bytes_written += len(header) + len(payload)
+        return True
+
+    @__synchronized
+    def load_snapshot(self, snapshot_filename, filename, reader='configparser'):
+        """Load the values of a configuration file from a snapshot written by save_snapshot.
+
+        The snapshot is read with a single read and used if it was saved from the same file (path,
+        device and inode), the file has the size and modification time it had when the snapshot
+        was saved, and the expectations and reader are the same. Otherwise the configuration file is loaded with set_configuration_file and
+        a new snapshot is saved.
+
+        Snapshots are loaded with pickle, they must only be writable by trusted users.
+
+        Parameters:
+        snapshot_filename: The name (and path) of the snapshot file
+        filename: The name (and path) of the configuration file the snapshot was saved from
+        reader (str): How the configuration file is read, see set_configuration_file
+
+        Returns:
+        True: The values were loaded from the snapshot or the configuration file.
+        False: An error occured, see set_configuration_file.
+        """
+
+        if not self.__can_load(filename, reader):
+            return False
+        state = self.__file_state(filename)
+        values = self.__read_snapshot(snapshot_filename, filename, state, reader)
+        if values is None:
+            log.debug("Snapshot '%s' is missing or stale, loading configuration file %s", snapshot_filename, filename)
+            if not self.set_configuration_file(filename, reader):
+                return False
+            self.save_snapshot(snapshot_filename)
+            return True
+
+        log.debug("Loading configuration file %s from snapshot '%s'", filename, snapshot_filename)
+        if self.__counters is not None:
+            self.__counters.keys += values[1].count(True)
+            self.__counters.cache_hits += 1
+        before = self.__watched_values()
+        if self.__pending:
+            self.__pending.clear()
+        for expectation, value, fromFile in zip(self.__expectations, *values):
+            if fromFile:
+                expectation.value = value
+                expectation.source = filename
+            else:
+                expectation.value = expectation.default
+                expectation.source = None
         self.__configurationFile = filename
+        self.__fileState = state
+        self.__reader = reader
+        self.__rawValues = None
+        self.__configReady = True
+        self.__publish()
+        self.__notify_changes(before)
         return True
 
-    def __load_defaults_where_needed(self):
+    def __read_snapshot(self, snapshot_filename, filename, state, reader):
+        # The (values, sources) lists of a snapshot, None if it can't be read, is stale or was saved from another file
+        if state is None:
+            return None
+        try:
+            with open(snapshot_filename, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return None
+        if self.__counters is not None:
+            self.__counters.bytes_read += len(data)
+        if len(data) < _SNAPSHOT_HEADER.size:
+            return None
+        magic, version, size, mtime, device, inode, fingerprint, pathLength, length = _SNAPSHOT_HEADER.unpack_from(data)
+        start = _SNAPSHOT_HEADER.size + pathLength
+        if (magic != _SNAPSHOT_MAGIC or version != _SNAPSHOT_FORMAT or (size, mtime, device, inode) != state
+                or fingerprint != self.__snapshot_fingerprint(reader)
+                or len(data) != start + length
+                or data[_SNAPSHOT_HEADER.size:start] != os.path.abspath(filename).encode('utf-8', 'surrogateescape')):
+            return None
+        try:
+            values, sources = pickle.loads(memoryview(data)[start:])
+        except (pickle.UnpicklingError, EOFError, AttributeError, ImportError, ValueError):
+            return None
+        if len(values) != len(self.__expectations) or len(sources) != len(values):
+            return None
+        return values, sources
+
+    def __snapshot_fingerprint(self, reader):
+        return hashlib.sha1((self.__schema_fingerprint() + reader).encode('ascii')).digest()
+
+    def validate_file(self, filename, reader='stream', allow_unknown=False):
+        """Check a configuration file against the expectations without loading its values.
+
+        Parameters:
+        filename: The name (and path) of the configuration file
+        reader (str): How the file is read, see set_configuration_file
+        allow_unknown (bool): Keys which aren't expectations don't make the file invalid
+
+        Returns:
+        A dictionary with the keys:
+        file - The file name.
+        valid (bool) - True when no key is missing and all values have the expected type.
+        missing - List of [section, key] of the expectations which aren't in the file.
+        type_errors - List of dictionaries (section, key, type, value) of values which can't be
+            converted to the expected type.
+        unknown - List of [section, key] of the keys in the file which aren't expectations.
+        error - None, or the reason the file couldn't be read.
+        """
+
+        report = {'file': filename, 'valid': False, 'missing': [], 'type_errors': [], 'unknown': [], 'error': None}
+        try:
+            if reader == 'configparser':
+                configObject = ConfigParser()
+                with open(filename) as f:
+                    configObject.read_file(f, filename)
+                sections = {section: configObject[section] for section in configObject.sections()}
+                values = _config_parser_values(configObject, sections)
+            elif reader == 'mmap':
+                values = _read_ini_mmap(filename, None)
+            else:
+                with open(filename) as f:
+                    values = _read_ini_stream(f, None, filename)
+        except (OSError, ConfigParserError, UnicodeDecodeError) as error:
+            report['error'] = str(error)
+            return report
+
+        for (section, key), raw in values.items():
+            expectation = self.__index.get((section, key))
+            if expectation is None:
+                report['unknown'].append([section, key])
+                continue
+            try:
+                if raw is None:
+                    raise ValueError("Value cannot be interpolated")
+                expectation.converter(raw)
+            except ValueError:
+                report['type_errors'].append({'section': section, 'key': key,
+                                              'type': expectation.data_type.__name__, 'value': raw})
+        for expectation in self.__expectations:
+            if (expectation.section, expectation.key) not in values:
+                report['missing'].append([expectation.section, expectation.key])
+        report['valid'] = not (report['missing'] or report['type_errors'] or (report['unknown'] and not allow_unknown))
+        return report
+
+    def __can_load(self, filename, reader):
+        if len(self.__expectations) == 0:
+            log.warning("Trying to open a configuration file '%s' with no __expectations set, nothing was loaded", filename)
+            return False
+        if reader not in _READERS:
+            log.warning("Trying to open a configuration file '%s' with unknown reader [%s]. Allowed readers = [%s]",
+                        filename, reader, ", ".join(_READERS))
+            return False
+        return True
+
+    def __read_source(self, filename, reader):
+        # The blocking part of loading a file, returns (cacheKey, fingerprint, cachedValues, rawValues, fileState, configObject)
+        cacheKey = fingerprint = None
+        state = self.__file_state(filename)
+        if self.__parseCache is not None:
+            fingerprint = self.__schema_fingerprint() + reader
+            cacheKey = self.__parseCache.make_key(filename, fingerprint)
+            values = self.__parseCache.get(cacheKey) if cacheKey is not None else None
+            if values is not None:
+                return cacheKey, fingerprint, values, None, state, None
+        # A new ConfigParser object, so it only holds the values of this file
+        configObject = ConfigParser()
+        try:
+            rawValues = self.__read_file(filename, reader, configObject)
+        except (ConfigParserError, UnicodeDecodeError):
+            rawValues = None
+        return cacheKey, fingerprint, None, rawValues, state, configObject
+
+    def __apply_source(self, filename, reader, source):
+        # Generator converting the values of a read file, yielding between chunks of keys.
+        # Returns (result, loaded) where loaded holds the converted values to cache, if any
+        cacheKey, fingerprint, cachedValues, rawValues, state, configObject = source
+        loaded = None
+        before = self.__watched_values()
+        counters = self.__counters
+        if counters is not None:
+            if cachedValues is not None:
+                counters.keys += len(cachedValues)
+                counters.cache_hits += 1
+            elif rawValues is not None:
+                counters.keys += len(rawValues)
+                counters.bytes_read += state[0] if state is not None else 0
+        if cachedValues is not None:
+            log.debug("Loading configuration file %s from the parse cache", filename)
+            self.__load_cached_values(cachedValues, filename)
+            self.__rawValues = None
+        elif rawValues is not None and self.__pending is not None:
+            log.debug("Loading configuration file %s, values are converted when read", filename)
+            pending = self.__pending
+            for indexKey, raw in rawValues.items():
+                if indexKey in self.__index:
+                    pending[indexKey] = (raw, filename)
+            self.__rawValues = rawValues
+        elif rawValues is not None:
+            log.debug("Loading configuration file %s", filename)
+            debug = log.isEnabledFor(logging.DEBUG)
+            if cacheKey is not None:
+                loaded = {}
+            for count, (indexKey, raw) in enumerate(rawValues.items(), 1):
+                expectation = self.__index.get(indexKey)
+                if expectation is not None:
+                    converted = self.__convert(expectation, raw, debug, filename)
+                    if loaded is not None:
+                        loaded[indexKey] = expectation.value if converted else _ConversionFailed
+                if count % _LOAD_CHUNK == 0:
+                    yield
+            self.__rawValues = rawValues
+        else:
+            log.warning("Failed to open configuration file '%s'. Using default values for __expectations", filename)
+            state = None
+        if rawValues is not None and reader == 'configparser':
+            self.__configObject = configObject
+
+        self.__configurationFile = filename
+        self.__fileState = state
+        self.__reader = reader
+        self.__configReady = True
+        self.__load_defaults_where_needed()
+        self.__publish()
+        self.__notify_changes(before)
+        return cachedValues is not None or rawValues is not None, loaded
+
+    @__synchronized
+    def __advance(self, steps, budget):
+        # Run a generator for up to budget seconds, returns (finished, return value)
+        deadline = time.perf_counter() + budget
+        try:
+            next(steps)
+            while time.perf_counter() < deadline:
+                next(steps)
+        except StopIteration as done:
+            return True, done.value
+        return False, None
+
+    def __cache_loaded_values(self, filename, source, loaded):
+        # Only cache the values if the file didn't change while it was read
+        cacheKey, fingerprint = source[:2]
+        if loaded is not None and self.__parseCache.make_key(filename, fingerprint) == cacheKey:
+            self.__parseCache.put(cacheKey, loaded)
+
+    def __read_file(self, filename, reader, configObject):
+        # Get the raw strings of the expected keys in a file, None if it can't be opened
+        if reader == 'stream':
+            try:
+                with open(filename) as f:
+                    return _read_ini_stream(f, self.__sections, filename)
+            except OSError:
+                return None
+        if reader == 'mmap':
+            try:
+                return _read_ini_mmap(filename, self.__sections)
+            except OSError:
+                return None
+        if len(configObject.read(filename)) == 0:
+            return None
+        return self.__read_raw_values(configObject)
+
+    @__synchronized
+    def reload(self):
+        """Re-read the configuration file set with set_configuration_file, only converting the values which changed.
+
+        The file is read with the same reader given to set_configuration_file. Keys which were
+        removed from the file are set back to their default value. Sections which were removed
+        from the file are also removed from the ConfigParser object.
+        Callbacks added with add_reload_callback are called with the changed keys.
+
+        Returns:
+        A set of (section, key) tuples whose value changed. Empty if nothing changed.
+        None: The file couldn't be read, or set_configuration_file hasn't been called.
+        """
+
+        filename = self.__configurationFile
+        if not self.__configReady or filename is None:
+            log.warning("Trying to reload a configuration file before set_configuration_file was called")
+            return None
+
+        configObject = ConfigParser()
+        state = self.__file_state(filename)
+        try:
+            newRawValues = self.__read_file(filename, self.__reader, configObject)
+        except (ConfigParserError, UnicodeDecodeError):
+            newRawValues = None
+        if newRawValues is None:
+            log.warning("Failed to reload configuration file '%s'. Keeping current values", filename)
+            return None
+
+        if self.__counters is not None:
+            self.__counters.keys += len(newRawValues)
+            self.__counters.bytes_read += state[0] if state is not None else 0
+        debug = log.isEnabledFor(logging.DEBUG)
+        oldRawValues = self.__rawValues
+        changed = set()
+        for indexKey, raw in newRawValues.items():
+            if oldRawValues is not None and indexKey in oldRawValues and oldRawValues[indexKey] == raw:
+                continue
+            expectation = self.__index[indexKey]
+            if self.__pending and indexKey in self.__pending:
+                self.__resolve(indexKey, expectation)
+            oldValue = expectation.value
+            self.__convert(expectation, raw, debug, filename)
+            if self.__value_changed(oldValue, expectation.value):
+                changed.add(indexKey)
         for expectation in self.__expectations:
-            if expectation['value'] is None:
-                log.debug("Section [{}] with key [{}] not found in configuration file, using default value {}".format(
-                    expectation['section'],
-                    expectation['key'],
-                    expectation['default']))
-                expectation['value'] = expectation['default']
-
-    def ___parse_config_values(self):
-        for section in self.__configObject.sections():
-            for key in self.__configObject[section]:
-                entryExists,position = self.expectation_exists_at_index(section, key)
-                if(entryExists):
-                    data_type = self.__expectations[position]['data_type']
-                    if data_type is int:
-                        self.__convert_int(section, key, position)
-                    elif data_type is bool:
-                        self.__convert_boolean(section, key, position)
-                    elif data_type is float:
-                        self.__convert_float(section, key, position)
-                    else:
-                        self.__expectations[position]['value'] = self.__configObject.get(section, key)
-
-    def __convert_boolean(self, section, key, position):
+            indexKey = (expectation.section, expectation.key)
+            if indexKey not in newRawValues and (oldRawValues is None or indexKey in oldRawValues):
+                if self.__pending and indexKey in self.__pending:
+                    self.__resolve(indexKey, expectation)
+                if self.__value_changed(expectation.value, expectation.default):
+                    changed.add(indexKey)
+                expectation.value = expectation.default
+                expectation.source = None
+
+        if self.__reader == 'configparser':
+            self.__configObject = configObject
+        self.__rawValues = newRawValues
+        self.__fileState = state
+        self.__publish(set(section for section, key in changed))
+        log.debug("Reloaded configuration file %s, %s values changed", filename, len(changed))
+        if self.__subscribers:
+            for indexKey in changed:
+                if indexKey in self.__subscribers:
+                    self.__notify(indexKey, self.__index[indexKey].value)
+        if changed:
+            for callback in list(self.__reloadCallbacks):
+                callback(changed)
+        return changed
+
+    def __value_changed(self, old, new):
+        return type(old) is not type(new) or old != new
+
+    def add_reload_callback(self, callback):
+        """Add a function to be called when reload() (or the watch thread) changes values.
+
+        Parameters:
+        callback - Function called with a set of the changed (section, key) tuples.
+        """
+        self.__reloadCallbacks.append(callback)
+
+    def remove_reload_callback(self, callback):
+        """Remove a function previously added with add_reload_callback.
+
+        Returns:
+        True: The callback was removed.
+        False: The callback wasn't added.
+        """
+        try:
+            self.__reloadCallbacks.remove(callback)
+            return True
+        except ValueError:
+            return False
+
+    @__synchronized
+    def subscribe(self, section, key, callback, executor=None):
+        """Call a function whenever the value of an expectation changes.
+
+        The callback is called with the section, key and new value after set_value, set_values,
+        set_configuration_file, reload (also by watch), load_layers, load_snapshot or
+        apply_overrides changed the value, and not when the new value equals the old one. Only the
+        subscribers of the changed keys are looked up, the number of other subscriptions doesn't
+        matter. Subscriptions are removed with the expectation.
+
+        Parameters:
+        section (str) - The configuration section the expectation belongs to.
+        key (str) - The key of the configuration expectation.
+        callback - Function called with (section, key, value).
+        executor - Optional concurrent.futures executor the callback is submitted to. Without an
+            executor the callback runs in the thread which changed the value, before that call
+            returns, and exceptions it raises are logged.
+
+        Returns:
+        True: The callback was added.
+        False: The expectation doesn't exist.
+        """
+
+        indexKey = (section, key)
+        expectation = self.__index.get(indexKey)
+        if expectation is None:
+            log.warning("Trying to subscribe to an expectation which doesn't exist. Section: [%s], Key [%s]", section, key)
+            return False
+        if self.__pending and indexKey in self.__pending:
+            # Subscribed values are always converted, so changes to them can be detected
+            self.__resolve(indexKey, expectation)
+        self.__subscribers[indexKey] = self.__subscribers.get(indexKey, ()) + ((callback, executor),)
+        return True
+
+    @__synchronized
+    def unsubscribe(self, section, key, callback):
+        """Remove a function previously added with subscribe.
+
+        Returns:
+        True: The callback was removed.
+        False: The callback wasn't subscribed to the expectation.
+        """
+
+        indexKey = (section, key)
+        subscribers = self.__subscribers.get(indexKey, ())
+        remaining = tuple(entry for entry in subscribers if entry[0] != callback)
+        if len(remaining) == len(subscribers):
+            return False
+        if remaining:
+            self.__subscribers[indexKey] = remaining
+        else:
+            del self.__subscribers[indexKey]
+        return True
+
+    def __watched_values(self, indexKeys=None):
+        # Values of the subscribed keys (of indexKeys if given), compared by __notify_changes after a change
+        subscribers = self.__subscribers
+        if not subscribers:
+            return None
+        if indexKeys is None:
+            indexKeys = subscribers
+        return {indexKey: self.__index[indexKey].value for indexKey in indexKeys if indexKey in subscribers}
+
+    def __notify_changes(self, before):
+        if before is None:
+            return
+        pending = self.__pending
+        for indexKey, oldValue in before.items():
+            expectation = self.__index.get(indexKey)
+            if expectation is None:
+                continue
+            if pending and indexKey in pending:
+                self.__resolve(indexKey, expectation)
+            if self.__value_changed(oldValue, expectation.value):
+                self.__notify(indexKey, expectation.value)
+
+    def __notify(self, indexKey, value):
+        section, key = indexKey
+        for callback, executor in self.__subscribers.get(indexKey, ()):
+            if executor is not None:
+                executor.submit(callback, section, key, value)
+                continue
+            try:
+                callback(section, key, value)
+            except Exception:
+                log.exception("Subscriber of Section [%s], Key [%s] failed", section, key)
+
+    def enable_metrics(self, callback=None):
+        """Measure the operations of this object.
+
+        set_configuration_file, load_layers, load_snapshot, save_snapshot, reload,
+        write_configuration_file, write_changes, set_value and set_values are measured, also when they are
+        called by other methods such as awrite or watch. A call made while another measured
+        call is running is counted as part of the outer call.
+
+        Operations are only measured while enabled: the methods are replaced on this object by
+        measuring wrappers, so there is no cost when metrics are disabled. Without thread_safe=True,
+        operations should not run in several threads at once while metrics are enabled.
+
+        Parameters:
+        callback - Optional function called with an OperationMetrics after every measured call.
+            Calling enable_metrics again replaces the callback, the totals are kept.
+
+        Returns:
+        True
+        """
+
+        if self.__metrics is None:
+            self.__metrics = {}
+            for operation in _INSTRUMENTED:
+                setattr(self, operation, self.__instrument(operation, getattr(self, operation)))
+        self.__metricsCallback = callback
+        return True
+
+    def disable_metrics(self):
+        """Stop measuring operations and discard the totals returned by stats.
+
+        Returns:
+        True: Metrics were disabled.
+        False: Metrics weren't enabled.
+        """
+
+        if self.__metrics is None:
+            return False
+        for operation in _INSTRUMENTED:
+            del self.__dict__[operation]
+        self.__metrics = None
+        self.__metricsCallback = None
+        return True
+
+    def stats(self):
+        """Get the totals of the operations measured since enable_metrics.
+
+        Returns:
+        A dictionary of operation name to a dictionary with the keys calls, errors, seconds, keys,
+        failures, cache_hits, bytes_read and bytes_written. Empty if metrics aren't enabled.
+        """
+
+        if self.__metrics is None:
+            return {}
+        return {operation: dict(totals) for operation, totals in self.__metrics.items()}
+
+    def __instrument(self, operation, method):
+        # Wrap a bound method so its calls are measured
+        @functools.wraps(method)
+        def measured(*args, **kwargs):
+            if self.__counters is not None:
+                return method(*args, **kwargs)
+            if self.__lock is not None:
+                with self.__lock:
+                    return self.__measure(operation, method, args, kwargs)
+            return self.__measure(operation, method, args, kwargs)
+        return measured
+
+    def __measure(self, operation, method, args, kwargs):
+        counters = self.__counters = _OperationCounters()
+        start = time.perf_counter()
         try:
-            self.__expectations[position]['value'] = self.__configObject.getboolean(section, key)
-            self.__log_conversion_status(True, position)
-        except:
-            self.__expectations[position]['value'] = self.__expectations[position]['default']
-            self.__log_conversion_status(False, position)
+            result = method(*args, **kwargs)
+        finally:
+            seconds = time.perf_counter() - start
+            self.__counters = None
+        success = result is not False and result is not None
+        if operation == 'set_value':
+            counters.keys = 1
+            counters.failures = 0 if success else 1
+        totals = self.__metrics.get(operation)
+        if totals is None:
+            totals = self.__metrics[operation] = dict.fromkeys(
+                ('calls', 'errors', 'seconds', 'keys', 'failures', 'cache_hits', 'bytes_read', 'bytes_written'), 0)
+        totals['calls'] += 1
+        if not success:
+            totals['errors'] += 1
+        totals['seconds'] += seconds
+        totals['keys'] += counters.keys
+        totals['failures'] += counters.failures
+        totals['cache_hits'] += counters.cache_hits
+        totals['bytes_read'] += counters.bytes_read
+        totals['bytes_written'] += counters.bytes_written
+        if self.__metricsCallback is not None:
+            self.__metricsCallback(OperationMetrics(operation, seconds, counters.keys, counters.failures, counters.cache_hits,
+                                                    counters.bytes_read, counters.bytes_written, success))
+        return result
+
+    def watch(self, interval=1.0):
+        """Start a background thread which reloads the configuration file when it changes.
+
+        The file's size and modification time are polled every interval seconds and reload() is
+        called when either changes or the file is replaced.
+
+        Parameters:
+        interval (float) - The number of seconds between checks of the file.
+
+        Returns:
+        True: The watch thread was started.
+        False: set_configuration_file hasn't been called or the file is already being watched.
+        """
+
+        if self.__configurationFile is None or not self.__configReady:
+            log.warning("Trying to watch a configuration file before set_configuration_file was called")
+            return False
+        if self.__watchThread is not None:
+            log.warning("The configuration file '%s' is already being watched", self.__configurationFile)
+            return False
+        self.__watchStop = threading.Event()
+        state = self.__file_state(self.__configurationFile)
+        self.__watchThread = threading.Thread(target=self.__watch_file, args=(interval, state, self.__watchStop),
+                                              name='configchecker-watch', daemon=True)
+        self.__watchThread.start()
+        return True
+
+    def stop_watching(self):
+        """Stop the thread started with watch().
 
-    def __convert_float(self, section, key, position):
+        Returns:
+        True: The thread was stopped.
+        False: No thread was running.
+        """
+        if self.__watchThread is None:
+            return False
+        self.__watchStop.set()
+        if self.__watchThread is not threading.current_thread():
+            self.__watchThread.join()
+        self.__watchThread = None
+        self.__watchStop = None
+        return True
+
+    def __watch_file(self, interval, lastState, stop):
+        while not stop.wait(interval):
+            state = self.__file_state(self.__configurationFile)
+            if state != lastState:
+                lastState = state
+                try:
+                    self.reload()
+                except Exception:
+                    log.exception("Reloading configuration file '%s' failed", self.__configurationFile)
+
+    def __file_state(self, filename):
         try:
-            self.__expectations[position]['value'] = self.__configObject.getfloat(section, key)
-            self.__log_conversion_status(True, position)
-        except:
-            self.__expectations[position]['value'] = self.__expectations[position]['default']
-            self.__log_conversion_status(False, position)
+            stat = os.stat(filename)
+            return stat.st_size, stat.st_mtime_ns, stat.st_dev, stat.st_ino
+        except OSError:
+            return None
 
-    def __convert_int(self, section, key, position):
+    def __load_defaults_where_needed(self):
+        debug = log.isEnabledFor(logging.DEBUG)
+        for expectation in self.__expectations:
+            if expectation.value is None:
+                if debug:
+                    log.debug("Section [%s] with key [%s] not found in configuration file, using default value %s",
+                              expectation.section, expectation.key, expectation.default)
+                expectation.value = expectation.default
+
+    def __load_cached_values(self, values, filename):
+        pending = self.__pending
+        for indexKey, value in values.items():
+            expectation = self.__index.get(indexKey)
+            if expectation is not None:
+                if pending:
+                    pending.pop(indexKey, None)
+                if value is _ConversionFailed:
+                    # Fall back to the default like the conversion did when the file was parsed
+                    expectation.value = expectation.default
+                    expectation.source = None
+                    if self.__counters is not None:
+                        self.__counters.failures += 1
+                    self.__log_conversion_status(False, expectation)
+                else:
+                    expectation.value = value
+                    expectation.source = filename
+
+    def __read_raw_values(self, configObject):
+        # Get the (interpolated) strings of all expected keys in a ConfigParser object
+        return _config_parser_values(configObject, self.__sections)
+
+    def __resolve(self, indexKey, expectation):
+        # Convert a value recorded by a lazy load, returns the value
+        entry = self.__pending.pop(indexKey, None)
+        if entry is not None:
+            self.__convert(expectation, entry[0], log.isEnabledFor(logging.DEBUG), entry[1])
+        return expectation.value
+
+    def __resolve_all(self):
+        # Convert all values recorded by a lazy load which weren't read yet
+        pending = self.__pending
+        if pending:
+            debug = log.isEnabledFor(logging.DEBUG)
+            while pending:
+                indexKey, (raw, source) = pending.popitem()
+                expectation = self.__index.get(indexKey)
+                if expectation is not None:
+                    self.__convert(expectation, raw, debug, source)
+
+    def __convert(self, expectation, raw, debug, source):
+        # source - The file the raw value was read from
         try:
-            self.__expectations[position]['value'] = self.__configObject.getint(section, key)
-            self.__log_conversion_status(True, position)
-        except:
-            self.__expectations[position]['value'] = self.__expectations[position]['default']
-            self.__log_conversion_status(False, position)
+            if raw is None:
+                raise ValueError("Value cannot be interpolated")
+            expectation.value = expectation.converter(raw)
+        except ValueError:
+            expectation.value = expectation.default
+            expectation.source = None
+            if self.__counters is not None:
+                self.__counters.failures += 1
+            self.__log_conversion_status(False, expectation)
+            return False
+        expectation.source = source
+        if debug:
+            self.__log_conversion_status(True, expectation)
+        return True
 
-    def __log_conversion_status(self, sucess, position):
+    def __log_conversion_status(self, sucess, expectation):
         if sucess:
-            log.debug("Updating Section [{}] with key [{}] to value [{}] found in configuration file".format(
-                self.__expectations[position]['section'],
-                self.__expectations[position]['key'],
-                self.__expectations[position]['value']))
+            log.debug("Updating Section [%s] with key [%s] to value [%s] found in configuration file",
+                expectation.section,
+                expectation.key,
+                expectation.value)
         else:
-            log.warning("Section [{}] with key [{}] of configuration file cannot be parsed as [{}], using default value {}".format(
-                self.__expectations[position]['section'],
-                self.__expectations[position]['key'],
-                self.__expectations[position]['data_type'],
-                self.__expectations[position]['default']))
+            log.warning("Section [%s] with key [%s] of configuration file cannot be parsed as [%s], using default value %s",
+                expectation.section,
+                expectation.key,
+                expectation.data_type,
+                expectation.default)
+
+
+def _load_schema(spec):
+    # A ConfigChecker from a JSON schema file, or from module:attribute naming a ConfigChecker, a
+    # schema dictionary or a function returning either. None if it can't be loaded.
+    if os.path.isfile(spec) or ':' not in spec:
+        checker = ConfigChecker.from_schema(spec)
+    else:
+        moduleName, _, attribute = spec.partition(':')
+        try:
+            target = importlib.import_module(moduleName)
+            for name in attribute.split('.'):
+                target = getattr(target, name)
+        except (ImportError, AttributeError) as error:
+            log.warning("Failed to import schema [%s]: %s", spec, error)
+            return None
+        if callable(target) and not isinstance(target, ConfigChecker):
+            target = target()
+        checker = target if isinstance(target, ConfigChecker) else ConfigChecker.from_schema(target)
+    if len(checker.get_expectations()) == 0:
+        return None
+    return checker
+
+
+# ConfigChecker and options of a validation worker process
+_validator = None
+
+
+def _init_validator(spec, reader, allow_unknown):
+    global _validator
+    _validator = (_load_schema(spec), reader, allow_unknown)
+
+
+def _validate(filename):
+    checker, reader, allow_unknown = _validator
+    return checker.validate_file(filename, reader, allow_unknown)
+
+
+def _validate_files(spec, filenames, reader, allow_unknown, jobs):
+    # Yield the reports of the files as they are finished, only a few files per process are
+    # queued at a time so memory use doesn't depend on the number of files
+    if jobs <= 1:
+        _init_validator(spec, reader, allow_unknown)
+        for filename in filenames:
+            yield _validate(filename)
+        return
+
+    results = queue.Queue()
+    window = jobs * 4
+    pending = 0
+    pool = multiprocessing.Pool(jobs, _init_validator, (spec, reader, allow_unknown))
+    try:
+        for filename in filenames:
+            pool.apply_async(_validate, (filename,), callback=results.put,
+                             error_callback=functools.partial(_failed_report, results, filename))
+            pending += 1
+            while pending >= window:
+                yield results.get()
+                pending -= 1
+        while pending > 0:
+            yield results.get()
+            pending -= 1
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def _failed_report(results, filename, error):
+    results.put({'file': filename, 'valid': False, 'missing': [], 'type_errors': [], 'unknown': [], 'error': repr(error)})
+
+
+def main(argv=None):
+    """Command line interface.
+
+    python -m configchecker validate SCHEMA PATTERN [PATTERN ...] checks configuration files
+    against a schema in parallel, writing a JSON report line per file to stdout as soon as the
+    file is checked. Exits with 0 when all files are valid, 1 when some aren't and 2 on usage errors.
+    """
+
+    parser = argparse.ArgumentParser(prog='python -m configchecker', description=main.__doc__.splitlines()[0])
+    commands = parser.add_subparsers(dest='command')
+    validate = commands.add_parser('validate', help='check configuration files against a schema')
+    validate.add_argument('schema', help='JSON schema file (see ConfigChecker.from_schema), or module:attribute '
+                                         'naming a ConfigChecker, a schema dictionary or a function returning one')
+    validate.add_argument('patterns', nargs='+', metavar='pattern',
+                          help='glob pattern of the files to check, ** matches any number of directories')
+    validate.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help='number of worker processes')
+    validate.add_argument('--reader', choices=_READERS, default='stream', help='how files are read')
+    validate.add_argument('--allow-unknown', action='store_true', help="keys which aren't in the schema are allowed")
+    args = parser.parse_args(argv)
+    if args.command is None:
+        parser.print_help(sys.stderr)
+        return 2
+
+    if _load_schema(args.schema) is None:
+        print("No expectations could be loaded from schema '{}'".format(args.schema), file=sys.stderr)
+        return 2
+
+    filenames = itertools.chain.from_iterable(glob.iglob(pattern, recursive=True) for pattern in args.patterns)
+    checked = invalid = 0
+    for report in _validate_files(args.schema, filenames, args.reader, args.allow_unknown, args.jobs):
+        checked += 1
+        if not report['valid']:
+            invalid += 1
+        sys.stdout.write(json.dumps(report) + '\n')
+        sys.stdout.flush()
+    print("{} files checked, {} invalid".format(checked, invalid), file=sys.stderr)
+    return 1 if invalid else 0
+
+
+if __name__ == '__main__':
+    # Run the imported module, so schemas and worker processes use the same ConfigChecker class
+    import configchecker
+    sys.exit(configchecker.main())
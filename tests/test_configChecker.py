@@ -1,5 +1,14 @@
 import unittest
-from configchecker import ConfigChecker
+import asyncio
+import concurrent.futures
+import configchecker
+from configchecker import ConfigChecker, ParseCache, Schema, register_type
+import json
+import locale
+import shutil
+import tempfile
+import threading
+import multiprocessing
 import os
 import logging
 import sys
@@ -154,6 +163,66 @@ class ExpectionTests(unittest.TestCase):
         sys.stdout = old_stdout
         self.assertEqual(printOutput.getvalue(),expectedOutput)
 
+class ExpectationIndexTests(unittest.TestCase):
+
+    def setUp(self):
+        self.checker = ConfigChecker()
+
+    def test_index_positions_shift_after_removal(self):
+        self.checker.set_expectation("SectionA","key_one",int,1)
+        self.checker.set_expectation("SectionA","key_two",int,2)
+        self.checker.set_expectation("SectionB","key_three",int,3)
+        self.checker.remove_expectation("SectionA","key_one")
+        self.assertEqual(self.checker.expectation_exists_at_index("SectionA","key_two"),(True,0))
+        self.assertEqual(self.checker.expectation_exists_at_index("SectionB","key_three"),(True,1))
+        self.assertEqual(self.checker.expectation_exists_at_index("SectionA","key_one"),(False,None))
+
+    def test_removed_expectation_can_be_added_again(self):
+        self.checker.set_expectation("SectionA","key_one",int,1)
+        self.checker.remove_expectation("SectionA","key_one")
+        added = self.checker.set_expectation("SectionA","key_one",int,5)
+        self.assertIs(added,True)
+        self.assertEqual(self.checker.expectation_exists_at_index("SectionA","key_one"),(True,0))
+        self.assertIs(self.checker.get_expectations()[0]['default'],5)
+
+    def test_duplicate_check_ignores_key_case(self):
+        self.checker.set_expectation("SectionA","key_one",int,1)
+        added = self.checker.set_expectation("SectionA","Key_One",int,1)
+        self.assertIs(added,False)
+        self.assertIs(len(self.checker.get_expectations()),1)
+
+class ExpectationRecordTests(unittest.TestCase):
+
+    def setUp(self):
+        self.checker = ConfigChecker()
+        self.checker.set_expectation("TestSection","testkey",int,34,"TestMessage")
+        self.expectation = self.checker.get_expectations()[0]
+
+    def test_record_has_no_instance_dictionary(self):
+        self.assertIs(hasattr(self.expectation,'__dict__'),False)
+
+    def test_record_converts_to_dictionary(self):
+        self.assertEqual(dict(self.expectation),{
+            'section': 'TestSection',
+            'key': 'testkey',
+            'value': None,
+            'data_type': int,
+            'default': 34,
+            'message': 'TestMessage'})
+
+    def test_record_item_and_attribute_access_match(self):
+        self.expectation['value'] = 12
+        self.assertIs(self.expectation.value,12)
+        self.assertIs(self.checker.get_value("TestSection","testkey"),12)
+
+    def test_record_rejects_unknown_and_removed_fields(self):
+        with self.assertRaises(KeyError):
+            self.expectation['unknown'] = 1
+        with self.assertRaises(KeyError):
+            self.expectation['unknown']
+        with self.assertRaises(TypeError):
+            del self.expectation['value']
+
 class FileOperationTests(unittest.TestCase):
 
     def setUp(self):
@@ -415,6 +484,1776 @@ class FileOperationTests(unittest.TestCase):
         except:
             pass
 
+class Hostname(str):
+    pass
+
+register_type(Hostname, lambda value: isinstance(value, str) and ' ' not in value, lambda raw: Hostname(raw.strip().lower()))
+
+class DataTypeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.checker = ConfigChecker()
+        with open('test_types.ini','w') as f:
+            f.write("[Host]\nname = Example.COM\nbad_name = has spaces\nport = 22\n")
+
+    def tearDown(self):
+        os.remove('test_types.ini')
+
+    def test_registered_type_is_accepted_as_expectation(self):
+        added = self.checker.set_expectation("Host","name",Hostname,'localhost')
+        self.assertIs(added,True)
+
+    def test_registered_type_rejects_invalid_default(self):
+        added = self.checker.set_expectation("Host","name",Hostname,'local host')
+        self.assertIs(added,False)
+
+    def test_registered_type_is_converted_from_file(self):
+        self.checker.set_expectation("Host","name",Hostname,'localhost')
+        self.checker.set_configuration_file('test_types.ini')
+        self.assertEqual(self.checker.get_value("Host","name"),'example.com')
+        self.assertIsInstance(self.checker.get_value("Host","name"),Hostname)
+
+    def test_registered_type_validates_set_value(self):
+        self.checker.set_expectation("Host","name",Hostname,'localhost')
+        self.checker.set_configuration_file('test_types.ini')
+        self.assertIs(self.checker.set_value("Host","name",'bad name'),False)
+        self.assertIs(self.checker.set_value("Host","name",'good-name'),True)
+
+    def test_setting_none_on_integer_returns_false(self):
+        self.checker.set_expectation("Host","port",int,80)
+        self.checker.set_configuration_file('test_types.ini')
+        self.assertIs(self.checker.set_value("Host","port",None),False)
+        self.assertIs(self.checker.get_value("Host","port"),22)
+
+class LoggingTests(unittest.TestCase):
+
+    def setUp(self):
+        logging.disable(logging.NOTSET)
+        self.checker = ConfigChecker()
+        with open('test_logging.ini','w') as f:
+            f.write("[General]\nretries = 3\nfactor = abc\n")
+
+    def tearDown(self):
+        logging.disable(logging.CRITICAL)
+        os.remove('test_logging.ini')
+
+    def test_debug_messages_are_formatted_when_enabled(self):
+        self.checker.set_expectation("General","retries",int,5)
+        self.checker.set_expectation("General","missing",int,7)
+        with self.assertLogs('configchecker',level='DEBUG') as logs:
+            self.checker.set_configuration_file('test_logging.ini')
+        output = "\n".join(logs.output)
+        self.assertIn("Updating Section [General] with key [retries] to value [3]",output)
+        self.assertIn("Section [General] with key [missing] not found in configuration file, using default value 7",output)
+
+    def test_debug_messages_are_not_emitted_at_warning_level(self):
+        self.checker.set_expectation("General","retries",int,5)
+        self.checker.set_expectation("General","factor",float,1.5)
+        with self.assertLogs('configchecker',level='WARNING') as logs:
+            self.checker.set_configuration_file('test_logging.ini')
+        self.assertEqual(len(logs.output),1)
+        self.assertIn("key [factor] of configuration file cannot be parsed",logs.output[0])
+
+class ParseCacheTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory,'cached.ini')
+        self.writeConfig("[General]\nretries = 3\nfactor = 1.5\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def writeConfig(self, content):
+        with open(self.filename,'w') as f:
+            f.write(content)
+
+    def makeChecker(self, cache):
+        checker = ConfigChecker(parse_cache=cache)
+        checker.set_expectation("General","retries",int,5)
+        checker.set_expectation("General","factor",float,2.5)
+        checker.set_expectation("General","name",str,'default')
+        return checker
+
+    def test_second_load_of_unchanged_file_is_a_hit(self):
+        cache = ParseCache()
+        self.assertIs(self.makeChecker(cache).set_configuration_file(self.filename),True)
+        checker = self.makeChecker(cache)
+        self.assertIs(checker.set_configuration_file(self.filename),True)
+        self.assertEqual((cache.hits,cache.misses),(1,1))
+        self.assertIs(checker.get_value("General","retries"),3)
+        self.assertEqual(checker.get_value("General","factor"),1.5)
+        self.assertEqual(checker.get_value("General","name"),'default')
+        self.assertEqual(len(checker.get_config_parser_object().sections()),0)
+
+    def test_cached_values_only_hold_values_of_the_file(self):
+        store = os.path.join(self.directory,'store')
+        other = os.path.join(self.directory,'other.ini')
+        with open(other,'w') as f:
+            f.write("[General]\nfactor = 0.5\n")
+        self.writeConfig("[General]\nretries = 9\n")
+        checker = self.makeChecker(ParseCache(directory=store))
+        checker.set_configuration_file(self.filename)
+        checker.set_configuration_file(other)
+        self.assertEqual(checker.get_value("General","retries"),9)
+        self.assertEqual(sorted(checker.get_config_parser_object()["General"]),["factor"])
+        worker = self.makeChecker(ParseCache(directory=store))
+        self.assertIs(worker.set_configuration_file(other),True)
+        self.assertEqual(worker.get_value("General","retries"),5)
+        self.assertEqual(worker.get_value("General","factor"),0.5)
+
+    def test_hit_falls_back_to_default_like_a_miss(self):
+        store = os.path.join(self.directory,'store')
+        bad = os.path.join(self.directory,'bad.ini')
+        with open(bad,'w') as f:
+            f.write("[General]\nretries = bad\n")
+        self.writeConfig("[General]\nretries = 9\n")
+        self.makeChecker(ParseCache(directory=store)).set_configuration_file(bad)
+        results = []
+        for cache in (None,ParseCache(directory=store)):
+            checker = self.makeChecker(cache)
+            checker.set_configuration_file(self.filename)
+            checker.set_configuration_file(bad)
+            results.append((checker.get_value("General","retries"),checker.get_source("General","retries")))
+        self.assertEqual(results,[(5,None),(5,None)])
+
+    def test_changed_file_is_a_miss(self):
+        cache = ParseCache()
+        self.makeChecker(cache).set_configuration_file(self.filename)
+        self.writeConfig("[General]\nretries = 42\n")
+        checker = self.makeChecker(cache)
+        checker.set_configuration_file(self.filename)
+        self.assertEqual((cache.hits,cache.misses),(0,2))
+        self.assertIs(checker.get_value("General","retries"),42)
+
+    def test_different_expectations_are_a_miss(self):
+        cache = ParseCache()
+        self.makeChecker(cache).set_configuration_file(self.filename)
+        checker = ConfigChecker(parse_cache=cache)
+        checker.set_expectation("General","retries",str,'5')
+        checker.set_configuration_file(self.filename)
+        self.assertEqual(cache.misses,2)
+        self.assertEqual(checker.get_value("General","retries"),'3')
+
+    def test_directory_store_is_shared_between_caches(self):
+        store = os.path.join(self.directory,'store')
+        self.makeChecker(ParseCache(directory=store)).set_configuration_file(self.filename)
+        cache = ParseCache(directory=store)
+        checker = self.makeChecker(cache)
+        checker.set_configuration_file(self.filename)
+        self.assertEqual(cache.stats(),{'hits': 1, 'misses': 0, 'entries': 1})
+        self.assertIs(checker.get_value("General","retries"),3)
+
+    def test_entries_are_evicted_beyond_max_entries(self):
+        store = os.path.join(self.directory,'store')
+        cache = ParseCache(max_entries=1, directory=store)
+        self.makeChecker(cache).set_configuration_file(self.filename)
+        self.writeConfig("[General]\nretries = 42\n")
+        self.makeChecker(cache).set_configuration_file(self.filename)
+        self.assertEqual(cache.stats()['entries'],1)
+        self.assertEqual(len(os.listdir(store)),1)
+
+    def test_hash_keys_ignore_modification_time(self):
+        cache = ParseCache(use_hash=True)
+        self.makeChecker(cache).set_configuration_file(self.filename)
+        os.utime(self.filename,(0,0))
+        self.makeChecker(cache).set_configuration_file(self.filename)
+        self.assertEqual((cache.hits,cache.misses),(1,1))
+
+class ReloadTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory,'reload.ini')
+        self.writeConfig("[General]\nretries = 3\nfactor = 1.5\nname = first\n\n[Old]\nkey = value\n")
+        self.checker = ConfigChecker()
+        self.checker.set_expectation("General","retries",int,5)
+        self.checker.set_expectation("General","factor",float,2.5)
+        self.checker.set_expectation("General","name",str,'default')
+        self.checker.set_configuration_file(self.filename)
+        self.changes = []
+        self.checker.add_reload_callback(self.changes.append)
+
+    def tearDown(self):
+        self.checker.stop_watching()
+        shutil.rmtree(self.directory)
+
+    def writeConfig(self, content):
+        with open(self.filename,'w') as f:
+            f.write(content)
+
+    def test_reload_returns_only_changed_keys(self):
+        self.writeConfig("[General]\nretries = 4\nfactor = 1.50\nname = first\n")
+        changed = self.checker.reload()
+        self.assertEqual(changed,{("General","retries")})
+        self.assertIs(self.checker.get_value("General","retries"),4)
+        self.assertEqual(self.changes,[{("General","retries")}])
+
+    def test_removed_keys_are_set_to_default(self):
+        self.writeConfig("[General]\nretries = 3\nfactor = 1.5\n")
+        changed = self.checker.reload()
+        self.assertEqual(changed,{("General","name")})
+        self.assertEqual(self.checker.get_value("General","name"),'default')
+
+    def test_unchanged_file_does_not_call_callbacks(self):
+        self.assertEqual(self.checker.reload(),set())
+        self.assertEqual(self.changes,[])
+
+    def test_removed_sections_are_removed_from_parser(self):
+        self.writeConfig("[General]\nretries = 3\n")
+        self.checker.reload()
+        self.assertEqual(self.checker.get_config_parser_object().sections(),['General'])
+
+    def test_reload_of_missing_file_keeps_values(self):
+        os.remove(self.filename)
+        self.assertIs(self.checker.reload(),None)
+        self.assertIs(self.checker.get_value("General","retries"),3)
+
+    def test_reload_before_configuration_file_is_set_returns_none(self):
+        checker = ConfigChecker()
+        checker.set_expectation("General","retries",int,5)
+        self.assertIs(checker.reload(),None)
+        self.assertIs(checker.watch(),False)
+
+    def test_watch_reloads_changed_file(self):
+        reloaded = threading.Event()
+        self.checker.add_reload_callback(lambda changed: reloaded.set())
+        self.assertIs(self.checker.watch(interval=0.01),True)
+        self.assertIs(self.checker.watch(interval=0.01),False)
+        self.writeConfig("[General]\nretries = 10\nfactor = 1.5\nname = first\n")
+        self.assertIs(reloaded.wait(5),True)
+        self.assertIs(self.checker.get_value("General","retries"),10)
+        self.assertIs(self.checker.stop_watching(),True)
+        self.assertIs(self.checker.stop_watching(),False)
+
+class AtomicWriteTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory,'written.ini')
+        self.checker = ConfigChecker()
+        self.checker.set_expectation("General","retries",int,5)
+        self.checker.set_expectation("General","name",str,'multi\nline')
+        self.checker.set_expectation("Other","enabled",bool,True)
+        self.checker.set_configuration_file(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_output_matches_config_parser_layout(self):
+        self.checker.write_configuration_file()
+        with open(self.filename) as f:
+            self.assertEqual(f.read(),"[General]\nretries = 5\nname = multi\n\tline\n\n[Other]\nenabled = True\n\n")
+
+    def test_no_temporary_files_are_left(self):
+        self.checker.write_configuration_file()
+        self.checker.set_value("General","retries",6)
+        self.checker.write_configuration_file()
+        self.assertEqual(os.listdir(self.directory),['written.ini'])
+
+    def test_unchanged_content_is_not_rewritten(self):
+        self.checker.write_configuration_file()
+        os.utime(self.filename,ns=(1000,1000))
+        self.assertIs(self.checker.write_configuration_file(),True)
+        self.assertEqual(os.stat(self.filename).st_mtime_ns,1000)
+
+    def test_unchanged_content_written_by_another_writer_is_not_rewritten(self):
+        other = ConfigChecker()
+        other.set_expectation("General","retries",int,5)
+        other.set_expectation("General","name",str,'multi\nline')
+        other.set_expectation("Other","enabled",bool,True)
+        other.set_configuration_file(self.filename)
+        other.write_configuration_file()
+        os.utime(self.filename,ns=(1000,1000))
+        self.assertIs(self.checker.write_configuration_file(),True)
+        self.assertEqual(os.stat(self.filename).st_mtime_ns,1000)
+
+    def test_changed_content_is_written(self):
+        self.checker.write_configuration_file()
+        self.checker.set_value("General","retries",7)
+        self.assertIs(self.checker.write_configuration_file(),True)
+        with open(self.filename) as f:
+            self.assertIn("retries = 7\n",f.read())
+
+    def test_file_permissions_are_kept(self):
+        self.checker.write_configuration_file()
+        os.chmod(self.filename,0o640)
+        self.checker.set_value("General","retries",7)
+        self.checker.write_configuration_file()
+        self.assertEqual(os.stat(self.filename).st_mode & 0o777,0o640)
+
+    def test_new_file_permissions_follow_the_umask(self):
+        umask = os.umask(0o027)
+        try:
+            self.checker.write_configuration_file()
+        finally:
+            os.umask(umask)
+        self.assertEqual(os.stat(self.filename).st_mode & 0o777,0o640)
+
+    @unittest.skipUnless(hasattr(os,'symlink'),"Symbolic links aren't supported")
+    def test_symbolic_link_is_written_through(self):
+        link = os.path.join(self.directory,'link.ini')
+        os.symlink(self.filename,link)
+        self.checker.set_configuration_file(link)
+        self.checker.set_value("General","retries",8)
+        self.assertIs(self.checker.write_configuration_file(),True)
+        self.checker.set_value("General","retries",9)
+        self.assertIs(self.checker.write_changes(),True)
+        self.assertTrue(os.path.islink(link))
+        with open(self.filename) as f:
+            self.assertIn("retries = 9\n",f.read())
+
+    def test_writing_without_file_name_returns_false(self):
+        checker = ConfigChecker()
+        checker.set_expectation("General","retries",int,5)
+        self.assertIs(checker.write_configuration_file(),False)
+
+class WriteChangesTests(unittest.TestCase):
+
+    original = "# Service settings\n[General]\nretries = 3 \n; the name\nName: first\n  second\nunknown = kept\n\n[Other]\nvalue = 1\n"
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory,'changes.ini')
+        with open(self.filename,'w') as f:
+            f.write(self.original)
+        self.checker = ConfigChecker()
+        self.checker.set_expectation("General","retries",int,5)
+        self.checker.set_expectation("General","name",str,'default')
+        self.checker.set_expectation("General","timeout",float,1.5)
+        self.checker.set_expectation("Added","enabled",bool,False)
+        self.checker.set_configuration_file(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def readConfig(self):
+        with open(self.filename) as f:
+            return f.read()
+
+    def test_only_changed_lines_are_replaced(self):
+        self.checker.set_value("General","retries",4)
+        self.checker.set_value("General","name",'single')
+        self.assertIs(self.checker.write_changes(),True)
+        self.assertEqual(self.readConfig(),
+            "# Service settings\n[General]\nretries = 4\n; the name\nName: single\nunknown = kept\n\n[Other]\nvalue = 1\n")
+
+    def test_missing_keys_and_sections_are_added(self):
+        self.checker.set_value("General","timeout",2.5)
+        self.checker.set_value("Added","enabled",True)
+        self.checker.write_changes()
+        self.assertEqual(self.readConfig(),
+            "# Service settings\n[General]\nretries = 3 \n; the name\nName: first\n  second\nunknown = kept\ntimeout = 2.5\n\n"
+            "[Other]\nvalue = 1\n\n[Added]\nenabled = True\n")
+
+    def test_sections_without_changes_are_copied(self):
+        content = "[Other]\nvalue = 1\n  [continued]\nnot an option\n[General]\nretries = 3\n"
+        with open(self.filename,'w') as f:
+            f.write(content)
+        self.checker.set_value("General","retries",4)
+        self.assertIs(self.checker.write_changes(),True)
+        self.assertEqual(self.readConfig(),content.replace("retries = 3","retries = 4"))
+
+    def test_missing_final_line_break_is_kept(self):
+        with open(self.filename,'w') as f:
+            f.write("[General]\nretries = 3\nunknown = 1")
+        self.checker.set_value("General","retries",4)
+        self.checker.write_changes()
+        self.assertEqual(self.readConfig(),"[General]\nretries = 4\nunknown = 1")
+        self.checker.set_value("General","timeout",2.5)
+        self.checker.write_changes()
+        self.assertEqual(self.readConfig(),"[General]\nretries = 4\nunknown = 1\ntimeout = 2.5\n")
+
+    def test_no_changes_leaves_file_untouched(self):
+        os.utime(self.filename,ns=(1000,1000))
+        self.assertIs(self.checker.write_changes(),True)
+        self.assertEqual(os.stat(self.filename).st_mtime_ns,1000)
+
+    def test_changes_are_only_written_once(self):
+        self.checker.set_value("General","retries",4)
+        self.checker.write_changes()
+        with open(self.filename,'w') as f:
+            f.write(self.original)
+        self.checker.write_changes()
+        self.assertEqual(self.readConfig(),self.original)
+
+    def test_written_changes_are_read_back(self):
+        self.checker.set_value("General","name",'two\nlines')
+        self.checker.write_changes()
+        checker = ConfigChecker()
+        checker.set_expectation("General","name",str,'default')
+        checker.set_expectation("General","unknown",str,'default')
+        checker.set_configuration_file(self.filename)
+        self.assertEqual(checker.get_value("General","name"),'two\nlines')
+        self.assertEqual(checker.get_value("General","unknown"),'kept')
+
+    def test_missing_file_is_written_in_full(self):
+        os.remove(self.filename)
+        self.checker.set_value("General","retries",4)
+        self.assertIs(self.checker.write_changes(),True)
+        self.assertIn("[Added]\nenabled = False\n",self.readConfig())
+
+    def test_windows_line_endings_are_kept(self):
+        with open(self.filename,'wb') as f:
+            f.write(b"[General]\r\nretries = 3\r\n")
+        self.checker.set_value("General","retries",4)
+        self.checker.write_changes()
+        with open(self.filename,'rb') as f:
+            self.assertEqual(f.read(),b"[General]\r\nretries = 4\r\n")
+
+class StreamReaderTests(unittest.TestCase):
+
+    content = "[DEFAULT]\nshared = from default\n\n[General]\n# comment\nRetries: 3\nfactor = 1.5\nmessage = first line\n    second line\n\n    third line\n" \
+              "enabled = yes\nnot_expected = 1\n\n[Unknown]\nthis line is not an option\n\n[Other]\nname = other\n"
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory,'stream.ini')
+        with open(self.filename,'w') as f:
+            f.write(self.content)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def makeChecker(self):
+        checker = ConfigChecker()
+        checker.set_expectation("General","retries",int,5)
+        checker.set_expectation("General","factor",float,2.5)
+        checker.set_expectation("General","message",str,'default')
+        checker.set_expectation("General","enabled",bool,False)
+        checker.set_expectation("General","shared",str,'default')
+        checker.set_expectation("Other","name",str,'default')
+        checker.set_expectation("Other","missing",int,8)
+        checker.set_expectation("Absent","missing",int,9)
+        return checker
+
+    def values(self, checker):
+        return [(e.section,e.key,e.value) for e in checker.get_expectations()]
+
+    def test_stream_reader_matches_config_parser(self):
+        streamed = self.makeChecker()
+        self.assertIs(streamed.set_configuration_file(self.filename,reader='stream'),True)
+        self.assertEqual(streamed.get_value("General","message"),"first line\nsecond line\n\nthird line")
+        self.assertEqual(streamed.get_value("General","shared"),"from default")
+        # The line in [Unknown] makes ConfigParser fail, the stream reader never parses it
+        with open(self.filename,'w') as f:
+            f.write(self.content.replace("this line is not an option\n",""))
+        parsed = self.makeChecker()
+        self.assertIs(parsed.set_configuration_file(self.filename),True)
+        self.assertEqual(self.values(streamed),self.values(parsed))
+
+    def test_indented_section_headers_match_config_parser(self):
+        with open(self.filename,'w') as f:
+            f.write("[Unknown]\n  [General]\nretries = 2\n[Skipped]\nvalue = 1\n  [Other]\nname = continued\n[Other]\nname = other\n")
+        parsed = self.makeChecker()
+        self.assertIs(parsed.set_configuration_file(self.filename),True)
+        self.assertEqual(parsed.get_value("General","retries"),2)
+        for reader in ('stream','mmap'):
+            checker = self.makeChecker()
+            self.assertIs(checker.set_configuration_file(self.filename,reader=reader),True)
+            self.assertEqual(self.values(checker),self.values(parsed))
+
+    def test_stream_reader_does_not_fill_config_parser(self):
+        checker = self.makeChecker()
+        checker.set_configuration_file(self.filename,reader='stream')
+        self.assertEqual(checker.get_config_parser_object().sections(),[])
+
+    def test_bad_line_in_expected_section_fails(self):
+        with open(self.filename,'w') as f:
+            f.write("[General]\nretries = 3\nnot an option\n")
+        checker = self.makeChecker()
+        self.assertIs(checker.set_configuration_file(self.filename,reader='stream'),False)
+        self.assertIs(checker.get_value("General","retries"),5)
+
+    def test_missing_section_header_fails(self):
+        with open(self.filename,'w') as f:
+            f.write("retries = 3\n")
+        self.assertIs(self.makeChecker().set_configuration_file(self.filename,reader='stream'),False)
+
+    def test_missing_file_fails(self):
+        self.assertIs(self.makeChecker().set_configuration_file('missing.ini',reader='stream'),False)
+
+    def test_unknown_reader_fails(self):
+        self.assertIs(self.makeChecker().set_configuration_file(self.filename,reader='other'),False)
+
+    def test_reload_uses_stream_reader(self):
+        checker = self.makeChecker()
+        checker.set_configuration_file(self.filename,reader='stream')
+        with open(self.filename,'w') as f:
+            f.write(self.content.replace("Retries: 3","Retries: 4"))
+        self.assertEqual(checker.reload(),{("General","retries")})
+        self.assertEqual(checker.get_config_parser_object().sections(),[])
+
+    def test_mmap_reader_matches_stream_reader(self):
+        streamed = self.makeChecker()
+        self.assertIs(streamed.set_configuration_file(self.filename,reader='stream'),True)
+        mapped = self.makeChecker()
+        self.assertIs(mapped.set_configuration_file(self.filename,reader='mmap'),True)
+        self.assertEqual(self.values(mapped),self.values(streamed))
+        self.assertEqual(mapped.get_config_parser_object().sections(),[])
+        with open(self.filename,'w') as f:
+            f.write(self.content.replace("Retries: 3","Retries: 4"))
+        self.assertEqual(mapped.reload(),{("General","retries")})
+
+    def test_mmap_reader_errors(self):
+        with open(self.filename,'w') as f:
+            f.write("[General]\nretries = 3\nnot an option\n")
+        self.assertIs(self.makeChecker().set_configuration_file(self.filename,reader='mmap'),False)
+        with open(self.filename,'w') as f:
+            f.write("retries = 3\n")
+        self.assertIs(self.makeChecker().set_configuration_file(self.filename,reader='mmap'),False)
+        self.assertIs(self.makeChecker().set_configuration_file('missing.ini',reader='mmap'),False)
+        open(self.filename,'w').close()
+        checker = self.makeChecker()
+        self.assertIs(checker.set_configuration_file(self.filename,reader='mmap'),True)
+        self.assertEqual(checker.get_value("General","retries"),5)
+
+    def test_mmap_reader_handles_windows_line_endings(self):
+        with open(self.filename,'wb') as f:
+            f.write(b"[General]\r\nretries = 3\r\nmessage = first\r\n  second\r\n")
+        checker = self.makeChecker()
+        self.assertIs(checker.set_configuration_file(self.filename,reader='mmap'),True)
+        self.assertEqual(checker.get_value("General","retries"),3)
+        self.assertEqual(checker.get_value("General","message"),"first\nsecond")
+
+class BulkExpectationTests(unittest.TestCase):
+
+    def setUp(self):
+        self.checker = ConfigChecker()
+
+    def test_valid_entries_are_added(self):
+        report = self.checker.set_expectations_bulk([
+            ("General","retries",int,5),
+            ("General","Name",str,'default',"A message"),
+            {'section': "Other", 'key': "enabled", 'data_type': bool, 'default': True},
+            ])
+        self.assertEqual(report.added,3)
+        self.assertEqual(report.rejected,[])
+        self.assertEqual(self.checker.expectation_exists_at_index("General","name"),(True,1))
+        self.assertEqual(self.checker.get_expectations()[1]['message'],"A message")
+
+    def test_invalid_entries_are_reported(self):
+        entries = [
+            ("General","retries",int,5),
+            ("General","retries",int,6),
+            ("General","factor",float,'abc'),
+            ("General","other",list,[]),
+            (123,"key",int,1),
+            ("General","1.5",int,1),
+            ("General","short"),
+            ]
+        report = self.checker.set_expectations_bulk(entries)
+        self.assertEqual(report.added,1)
+        self.assertEqual([entry for entry, reason in report.rejected],entries[1:])
+        self.assertEqual(report.rejected[0][1],"Expectation already exists")
+        self.assertEqual(report.rejected[-1][1],"Malformed entry")
+
+    def test_numeric_looking_names_are_rejected(self):
+        for name in ("12","-3.5"," nan","inf","1e3"):
+            self.assertIs(self.checker.set_expectation(name,"key",int,1),False)
+            self.assertIs(self.checker.set_expectation("Section",name,int,1),False)
+        for name in ("network","Infrastructure","-name",""):
+            self.assertIs(self.checker.set_expectation(name,"key",int,1),True)
+
+    def test_from_schema_dictionary(self):
+        checker = ConfigChecker.from_schema({
+            "General": {"retries": (int, 5), "name": {"type": "str", "default": "x", "message": "A name"}},
+            "Other": {"enabled": ["bool", False]},
+            })
+        self.assertEqual([(e.section,e.key,e.data_type,e.default) for e in checker.get_expectations()],[
+            ("General","retries",int,5),("General","name",str,'x'),("Other","enabled",bool,False)])
+
+    def test_from_schema_with_malformed_section(self):
+        checker = ConfigChecker.from_schema({"A": {"retries": (int, 5)}, "B": ['oops']},thread_safe=True)
+        self.assertEqual(len(checker.get_expectations()),1)
+        self.assertEqual(dict(checker.get_snapshot()["A"]),{"retries": None})
+        schema = Schema(configchecker._schema_entries({"A": {"retries": (int, 5)}, "B": ['oops']}))
+        self.assertEqual(schema.rejected,[(("B",['oops']),"Malformed entry")])
+
+    def test_from_schema_file(self):
+        directory = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(directory,'schema.json')
+            with open(filename,'w') as f:
+                f.write('{"General": {"retries": {"type": "int", "default": 5}, "bad": {"type": "int", "default": "x"}}}')
+            checker = ConfigChecker.from_schema(filename,parse_cache=ParseCache())
+            self.assertEqual(len(checker.get_expectations()),1)
+            self.assertEqual(ConfigChecker.from_schema(os.path.join(directory,'missing.json')).get_expectations(),[])
+        finally:
+            shutil.rmtree(directory)
+
+class SchemaTests(unittest.TestCase):
+
+    def setUp(self):
+        self.schema = Schema([
+            ("General","retries",int,5),
+            ("General","name",str,'default',"A name"),
+            ("Other","enabled",bool,True),
+            ("General","retries",int,6),
+            ])
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory,'config.ini')
+        with open(self.filename,'w') as f:
+            f.write("[General]\nretries = 8\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_schema_is_compiled_once(self):
+        self.assertEqual(len(self.schema),3)
+        self.assertEqual(len(self.schema.rejected),1)
+        self.assertEqual(list(self.schema)[1],("General","name",str,'default',"A name"))
+
+    def test_checkers_have_their_own_values(self):
+        first = ConfigChecker.from_schema(self.schema)
+        second = ConfigChecker.from_schema(self.schema,thread_safe=True)
+        self.assertTrue(first.set_configuration_file(self.filename))
+        self.assertTrue(second.set_configuration_file(self.filename))
+        self.assertTrue(first.set_value("General","retries",10))
+        self.assertEqual(first.get_value("General","retries"),10)
+        self.assertEqual(second.get_value("General","retries"),8)
+        self.assertEqual(second.get_value("Other","enabled"),True)
+        self.assertEqual(second.get_expectations()[1]['message'],"A name")
+        self.assertEqual(second.expectation_exists_at_index("Other","enabled"),(True,2))
+
+    def test_changing_expectations_does_not_affect_the_schema(self):
+        first = ConfigChecker.from_schema(self.schema)
+        second = ConfigChecker.from_schema(self.schema)
+        self.assertTrue(first.set_expectation("General","extra",int,1))
+        self.assertTrue(second.remove_expectation("General","retries"))
+        self.assertEqual(first.expectation_exists_at_index("General","retries"),(True,0))
+        self.assertEqual(first.expectation_exists_at_index("General","extra"),(True,3))
+        self.assertFalse(second.expectation_exists_at_index("General","extra")[0])
+        self.assertEqual(second.expectation_exists_at_index("Other","enabled"),(True,1))
+        self.assertEqual(ConfigChecker.from_schema(self.schema).expectation_exists_at_index("General","retries"),(True,0))
+        self.assertEqual(len(self.schema),3)
+
+    def test_from_checker(self):
+        checker = ConfigChecker.from_schema(self.schema)
+        checker.set_expectation("Other","factor",float,1.5)
+        schema = Schema.from_checker(checker)
+        self.assertEqual(len(schema),4)
+        self.assertEqual(schema.rejected,[])
+        checker = ConfigChecker.from_schema(schema)
+        self.assertTrue(checker.set_configuration_file(self.filename))
+        self.assertEqual(checker.get_value("Other","factor"),1.5)
+
+    def test_parse_cache_is_shared_between_checkers(self):
+        cache = ParseCache()
+        for i in range(2):
+            checker = ConfigChecker.from_schema(self.schema,parse_cache=cache)
+            self.assertTrue(checker.set_configuration_file(self.filename))
+            self.assertEqual(checker.get_value("General","retries"),8)
+        self.assertEqual((cache.hits,cache.misses),(1,1))
+
+class ThreadSafeTests(unittest.TestCase):
+
+    def setUp(self):
+        self.checker = ConfigChecker(thread_safe=True)
+        self.checker.set_expectation("General","retries",int,5)
+        self.checker.set_expectation("General","name",str,'default')
+        self.checker.set_expectation("Other","factor",float,1.5)
+        self.checker.set_configuration_file('missing_thread_safe.ini')
+
+    def test_values_are_read_from_snapshot(self):
+        self.assertIs(self.checker.get_value("General","retries"),5)
+        self.assertIs(self.checker.set_value("General","retries",6),True)
+        self.assertIs(self.checker.get_value("General","retries"),6)
+        self.assertIs(self.checker.get_value("General","missing"),None)
+
+    def test_snapshot_is_immutable_and_isolated(self):
+        snapshot = self.checker.get_snapshot()
+        self.checker.set_value("General","retries",6)
+        self.assertIs(snapshot["General"]["retries"],5)
+        self.assertIs(self.checker.get_snapshot()["General"]["retries"],6)
+        self.assertIs(self.checker.get_snapshot()["Other"],snapshot["Other"])
+        with self.assertRaises(TypeError):
+            snapshot["General"]["retries"] = 7
+
+    def test_added_and_removed_expectations_are_published(self):
+        self.checker.set_expectation("New","key",int,1)
+        self.assertIn("New",self.checker.get_snapshot())
+        self.checker.remove_expectation("New","key")
+        self.assertNotIn("New",self.checker.get_snapshot())
+        self.assertIs(self.checker.get_value("New","key"),None)
+
+    def test_snapshot_without_thread_safety_is_built_on_request(self):
+        checker = ConfigChecker()
+        checker.set_expectation("General","retries",int,5)
+        self.assertEqual(dict(checker.get_snapshot()["General"]),{'retries': None})
+
+    def test_concurrent_readers_and_writer(self):
+        errors = []
+        stop = threading.Event()
+
+        def read():
+            try:
+                while not stop.is_set():
+                    value = self.checker.get_value("General","retries")
+                    if value is not None and type(value) is not int:
+                        errors.append(value)
+                    self.checker.get_value("Other","factor")
+            except Exception as error:
+                errors.append(error)
+
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        for reader in readers:
+            reader.start()
+        try:
+            for i in range(300):
+                self.checker.remove_expectation("General","retries")
+                self.checker.set_expectation("General","retries",int,i)
+                self.checker.set_value("General","retries",i + 1)
+        finally:
+            stop.set()
+            for reader in readers:
+                reader.join()
+        self.assertEqual(errors,[])
+        self.assertEqual(self.checker.get_value("General","retries"),300)
+
+def readSharedValue(name, connection):
+    worker = ConfigChecker()
+    worker.attach_shared(name)
+    connection.send(worker.get_value("General","retries"))
+    connection.recv()
+    connection.send(worker.get_value("General","retries"))
+    worker.close_shared()
+
+def readInheritedValue(checker, name, connection):
+    connection.send(checker.get_value("General","retries"))
+    connection.recv()
+    connection.send((checker.get_value("General","retries"),checker.attach_shared(name)))
+    checker.close_shared()
+
+def attachSpawned(name, connection):
+    from multiprocessing import resource_tracker
+    unregistered = []
+    unregister = resource_tracker.unregister
+    resource_tracker.unregister = lambda name, rtype: unregistered.append(name)
+    try:
+        worker = ConfigChecker()
+        worker.attach_shared(name)
+        connection.send((worker.get_value("General","retries"),unregistered))
+        worker.close_shared()
+    finally:
+        resource_tracker.unregister = unregister
+
+class SharedMemoryTests(unittest.TestCase):
+
+    def setUp(self):
+        self.parent = ConfigChecker()
+        self.parent.set_expectation("General","retries",int,5)
+        self.parent.set_expectation("General","name",str,'default')
+        self.parent.set_configuration_file('missing_shared.ini')
+        self.name = self.parent.publish_shared()
+        self.worker = ConfigChecker()
+
+    def tearDown(self):
+        self.worker.close_shared()
+        self.parent.close_shared()
+
+    def test_worker_reads_published_values(self):
+        self.assertIsNotNone(self.name)
+        self.assertIs(self.worker.attach_shared(self.name),True)
+        self.assertIs(self.worker.get_value("General","retries"),5)
+        self.assertEqual(self.worker.get_snapshot()["General"]["name"],'default')
+        self.assertIs(self.worker.get_value("General","missing"),None)
+
+    def test_updates_are_visible_to_worker(self):
+        self.worker.attach_shared(self.name)
+        self.parent.set_value("General","retries",8)
+        self.assertIs(self.worker.get_value("General","retries"),8)
+
+    def test_updates_which_do_not_fit_are_not_published(self):
+        self.parent.close_shared()
+        self.name = self.parent.publish_shared(size=200)
+        self.worker.attach_shared(self.name)
+        self.parent.set_value("General","name",'x' * 1000)
+        self.assertEqual(self.worker.get_value("General","name"),'default')
+
+    def test_attaching_to_missing_segment_fails(self):
+        self.assertIs(self.worker.attach_shared('configchecker_missing_segment'),False)
+
+    def test_sharing_twice_fails(self):
+        self.assertIs(self.parent.publish_shared(),None)
+        self.worker.attach_shared(self.name)
+        self.assertIs(self.worker.attach_shared(self.name),False)
+
+    def test_closed_segment_returns_last_values(self):
+        segment = configchecker._SharedSegment.attach(self.name)
+        values = segment.read()
+        self.assertEqual(values["General"]["retries"],5)
+        segment.close()
+        self.assertIs(segment.read(),values)
+
+    def test_closing_while_reading_is_safe(self):
+        worker = ConfigChecker(thread_safe=True)
+        worker.set_expectation("General","retries",int,5)
+        worker.set_configuration_file('missing_shared.ini')
+        errors = []
+        stop = threading.Event()
+        def read():
+            while not stop.is_set():
+                try:
+                    self.assertIs(worker.get_value("General","retries"),5)
+                    worker.get_snapshot()
+                except Exception as error:
+                    errors.append(error)
+                    return
+        readers = [threading.Thread(target=read) for _ in range(4)]
+        # Switch threads often so readers run between the steps of close_shared
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        for reader in readers:
+            reader.start()
+        try:
+            for _ in range(300):
+                worker.attach_shared(self.name)
+                worker.close_shared()
+        finally:
+            stop.set()
+            for reader in readers:
+                reader.join()
+            sys.setswitchinterval(interval)
+        self.assertEqual(errors,[])
+
+    @unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(),"Requires fork")
+    def test_forked_worker_sees_parent_updates(self):
+        context = multiprocessing.get_context('fork')
+        parentEnd, workerEnd = context.Pipe()
+        process = context.Process(target=readSharedValue,args=(self.name,workerEnd))
+        process.start()
+        self.assertIs(parentEnd.recv(),5)
+        self.parent.set_value("General","retries",9)
+        parentEnd.send(True)
+        self.assertIs(parentEnd.recv(),9)
+        process.join(10)
+        self.assertEqual(process.exitcode,0)
+
+    @unittest.skipUnless('fork' in multiprocessing.get_all_start_methods(),"Requires fork")
+    def test_forked_worker_uses_inherited_checker(self):
+        context = multiprocessing.get_context('fork')
+        parentEnd, workerEnd = context.Pipe()
+        process = context.Process(target=readInheritedValue,args=(self.parent,self.name,workerEnd))
+        process.start()
+        self.assertIs(parentEnd.recv(),5)
+        self.parent.set_value("General","retries",42)
+        parentEnd.send(True)
+        self.assertEqual(parentEnd.recv(),(42,True))
+        process.join(10)
+        self.assertEqual(process.exitcode,0)
+        # The worker closing its inherited checker doesn't remove the parent's segment
+        self.assertIs(self.worker.attach_shared(self.name),True)
+        self.assertIs(self.worker.get_value("General","retries"),42)
+        self.worker.close_shared()
+        self.assertIs(self.parent.close_shared(),True)
+
+    @unittest.skipUnless('spawn' in multiprocessing.get_all_start_methods(),"Requires spawn")
+    def test_spawned_worker_keeps_parent_registration(self):
+        context = multiprocessing.get_context('spawn')
+        parentEnd, workerEnd = context.Pipe()
+        process = context.Process(target=attachSpawned,args=(self.name,workerEnd))
+        process.start()
+        retries, unregistered = parentEnd.recv()
+        process.join(30)
+        self.assertEqual(process.exitcode,0)
+        self.assertIs(retries,5)
+        # The spawned worker shares the parent's resource tracker, unregistering would remove the parent's entry
+        self.assertEqual(unregistered,[])
+
+class CountingChecker(ConfigChecker):
+    """ConfigChecker counting its writes, the first write waits until release is set."""
+
+    def __init__(self):
+        super().__init__()
+        self.writes = 0
+        self.release = threading.Event()
+
+    def write_configuration_file(self, filename=None):
+        self.writes += 1
+        self.release.wait(5)
+        return super().write_configuration_file(filename)
+
+
+class AsyncTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory,'config.ini')
+        with open(self.filename,'w') as f:
+            f.write(good_config)
+        self.loop = asyncio.new_event_loop()
+        self.checker = ConfigChecker()
+        self.checker.set_expectation("FirstSection","key_integer",int,0)
+        self.checker.set_expectation("FirstSection","key_string",str,'')
+        self.checker.set_expectation("SecondSection","missing",float,1.5)
+
+    def tearDown(self):
+        self.loop.close()
+        shutil.rmtree(self.directory)
+
+    def test_aload_reads_values(self):
+        self.assertIs(self.loop.run_until_complete(self.checker.aload(self.filename)),True)
+        self.assertEqual(self.checker.get_value("FirstSection","key_integer"),45)
+        self.assertEqual(self.checker.get_value("FirstSection","key_string"),'I am a string')
+        self.assertEqual(self.checker.get_value("SecondSection","missing"),1.5)
+
+    def test_aload_with_stream_reader(self):
+        self.assertIs(self.loop.run_until_complete(self.checker.aload(self.filename,reader='stream')),True)
+        self.assertEqual(self.checker.get_value("FirstSection","key_integer"),45)
+
+    def test_aload_missing_file_uses_defaults(self):
+        missing = os.path.join(self.directory,'missing.ini')
+        self.assertIs(self.loop.run_until_complete(self.checker.aload(missing)),False)
+        self.assertEqual(self.checker.get_value("FirstSection","key_integer"),0)
+
+    def test_aload_yields_to_the_loop(self):
+        checker = ConfigChecker()
+        with open(self.filename,'w') as f:
+            f.write("[Big]\n")
+            for i in range(2000):
+                checker.set_expectation("Big","key_{}".format(i),int,0)
+                f.write("key_{} = {}\n".format(i,i))
+        ticks = []
+
+        async def ticker():
+            while True:
+                ticks.append(1)
+                await asyncio.sleep(0)
+
+        async def load():
+            task = self.loop.create_task(ticker())
+            result = await checker.aload(self.filename,budget=0)
+            task.cancel()
+            return result
+
+        self.assertIs(self.loop.run_until_complete(load()),True)
+        self.assertEqual(checker.get_value("Big","key_1999"),1999)
+        self.assertGreater(len(ticks),2)
+
+    def test_aload_uses_parse_cache(self):
+        cache = ParseCache()
+        checker = ConfigChecker(parse_cache=cache)
+        checker.set_expectation("FirstSection","key_integer",int,0)
+        self.loop.run_until_complete(checker.aload(self.filename))
+        other = ConfigChecker(parse_cache=cache)
+        other.set_expectation("FirstSection","key_integer",int,0)
+        self.assertIs(self.loop.run_until_complete(other.aload(self.filename)),True)
+        self.assertEqual(other.get_value("FirstSection","key_integer"),45)
+        self.assertEqual((cache.hits,cache.misses),(1,1))
+
+    def test_awrite_writes_file(self):
+        self.checker.set_configuration_file(self.filename)
+        self.checker.set_value("FirstSection","key_integer",7)
+        self.assertIs(self.loop.run_until_complete(self.checker.awrite()),True)
+        other = ConfigChecker()
+        other.set_expectation("FirstSection","key_integer",int,0)
+        other.set_configuration_file(self.filename)
+        self.assertEqual(other.get_value("FirstSection","key_integer"),7)
+
+    def test_awrite_without_file_name_returns_false(self):
+        self.assertIs(self.loop.run_until_complete(self.checker.awrite()),False)
+
+    def test_concurrent_writes_are_coalesced(self):
+        checker = CountingChecker()
+        checker.set_expectation("FirstSection","key_integer",int,0)
+        checker.set_configuration_file(self.filename)
+
+        async def writes():
+            first = self.loop.create_task(checker.awrite())
+            await asyncio.sleep(0.05)
+            checker.set_value("FirstSection","key_integer",3)
+            others = [self.loop.create_task(checker.awrite()) for _ in range(5)]
+            await asyncio.sleep(0.05)
+            checker.release.set()
+            return await asyncio.gather(first,*others)
+
+        self.assertEqual(self.loop.run_until_complete(writes()),[True]*6)
+        self.assertEqual(checker.writes,2)
+        with open(self.filename) as f:
+            self.assertIn("key_integer = 3",f.read())
+
+    def test_cancelled_queued_write_does_not_block_later_writes(self):
+        checker = CountingChecker()
+        checker.set_expectation("FirstSection","key_integer",int,0)
+        checker.set_configuration_file(self.filename)
+
+        async def writes():
+            first = self.loop.create_task(checker.awrite())
+            await asyncio.sleep(0.05)
+            queued = self.loop.create_task(checker.awrite())
+            await asyncio.sleep(0)
+            waiting = self.loop.create_task(checker.awrite())
+            await asyncio.sleep(0)
+            queued.cancel()
+            await asyncio.sleep(0)
+            checker.release.set()
+            results = await asyncio.wait_for(asyncio.gather(first,waiting),5)
+            later = await asyncio.wait_for(checker.awrite(),5)
+            return queued.cancelled(), results, later
+
+        self.assertEqual(self.loop.run_until_complete(writes()),(True,[True,True],True))
+        self.assertEqual(checker.writes,3)
+
+    def test_cancelled_running_write_still_completes_for_waiters(self):
+        checker = CountingChecker()
+        checker.set_expectation("FirstSection","key_integer",int,0)
+        checker.set_configuration_file(self.filename)
+
+        async def writes():
+            first = self.loop.create_task(checker.awrite())
+            await asyncio.sleep(0.05)
+            first.cancel()
+            await asyncio.sleep(0)
+            checker.release.set()
+            return await asyncio.wait_for(checker.awrite(),5)
+
+        self.assertIs(self.loop.run_until_complete(writes()),True)
+        self.assertEqual(checker.writes,2)
+
+class LayerTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.defaults = self.write('defaults.ini',"[General]\nretries = 1\nname = default\n[Other]\nratio = 0.5\n")
+        self.site = self.write('site.ini',"[General]\nretries = 2\n")
+        self.host = self.write('host.ini',"[General]\nname = host\n")
+        self.checker = ConfigChecker()
+        self.checker.set_expectation("General","retries",int,0)
+        self.checker.set_expectation("General","name",str,'')
+        self.checker.set_expectation("Other","ratio",float,1.0)
+        self.checker.set_expectation("Other","missing",bool,True)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content):
+        filename = os.path.join(self.directory,name)
+        with open(filename,'w') as f:
+            f.write(content)
+        return filename
+
+    def test_source_of_values_kept_from_an_earlier_file(self):
+        self.checker.set_configuration_file(self.site)
+        self.checker.set_configuration_file(self.host)
+        self.assertEqual(self.checker.get_value("General","retries"),2)
+        self.assertEqual(self.checker.get_source("General","retries"),self.site)
+        self.assertEqual(self.checker.get_source("General","name"),self.host)
+
+    def test_keys_in_no_layer_use_their_default(self):
+        self.assertIs(self.checker.load_layers([self.site]),True)
+        self.assertIs(self.checker.load_layers([self.host]),True)
+        self.assertEqual(self.checker.get_value("General","retries"),0)
+        self.assertIsNone(self.checker.get_source("General","retries"))
+        self.assertEqual(self.checker.get_value("General","name"),'host')
+
+    def test_later_layers_take_precedence(self):
+        self.assertIs(self.checker.load_layers([self.defaults,self.site,self.host]),True)
+        self.assertEqual(self.checker.get_value("General","retries"),2)
+        self.assertEqual(self.checker.get_value("General","name"),'host')
+        self.assertEqual(self.checker.get_value("Other","ratio"),0.5)
+        self.assertEqual(self.checker.get_value("Other","missing"),True)
+
+    def test_source_of_each_value_is_recorded(self):
+        self.checker.load_layers([self.defaults,self.site,self.host])
+        self.assertEqual(self.checker.get_source("General","retries"),self.site)
+        self.assertEqual(self.checker.get_source("General","name"),self.host)
+        self.assertEqual(self.checker.get_source("Other","ratio"),self.defaults)
+        self.assertIsNone(self.checker.get_source("Other","missing"))
+        self.assertIsNone(self.checker.get_source("Other","unknown"))
+
+    def test_set_value_clears_source(self):
+        self.checker.load_layers([self.defaults])
+        self.checker.set_value("General","retries",9)
+        self.assertIsNone(self.checker.get_source("General","retries"))
+
+    def test_set_configuration_file_records_source(self):
+        self.checker.set_configuration_file(self.site)
+        self.assertEqual(self.checker.get_source("General","retries"),self.site)
+        self.assertIsNone(self.checker.get_source("General","name"))
+
+    def test_unreadable_layers_are_skipped(self):
+        missing = os.path.join(self.directory,'missing.ini')
+        broken = self.write('broken.ini',bad_config)
+        self.assertIs(self.checker.load_layers([self.site,missing,broken]),True)
+        self.assertEqual(self.checker.get_value("General","retries"),2)
+        self.assertIs(self.checker.load_layers([missing]),False)
+
+    def test_invalid_value_uses_default(self):
+        bad = self.write('bad.ini',"[General]\nretries = many\n")
+        self.checker.load_layers([self.site,bad])
+        self.assertEqual(self.checker.get_value("General","retries"),0)
+        self.assertIsNone(self.checker.get_source("General","retries"))
+
+    def test_stream_reader(self):
+        self.checker.load_layers([self.defaults,self.site,self.host],reader='stream')
+        self.assertEqual(self.checker.get_value("General","retries"),2)
+        self.assertEqual(self.checker.get_value("General","name"),'host')
+
+    def test_process_pool(self):
+        with concurrent.futures.ProcessPoolExecutor(2) as pool:
+            self.checker.load_layers([self.defaults,self.site,self.host],executor=pool)
+        self.assertEqual(self.checker.get_value("General","retries"),2)
+        self.assertEqual(self.checker.get_source("General","name"),self.host)
+
+    def test_no_files_returns_false(self):
+        self.assertIs(self.checker.load_layers([]),False)
+
+
+class SnapshotTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory,'config.ini')
+        self.snapshot = os.path.join(self.directory,'config.snapshot')
+        with open(self.filename,'w') as f:
+            f.write(good_config)
+        self.checker = self.make_checker()
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def make_checker(self):
+        checker = ConfigChecker()
+        checker.set_expectation("FirstSection","key_integer",int,0)
+        checker.set_expectation("FirstSection","key_float",float,0.0)
+        checker.set_expectation("FirstSection","missing",str,'default')
+        checker.set_expectation("SecondSection","user",str,'')
+        return checker
+
+    def test_snapshot_only_holds_values_of_the_file(self):
+        first = os.path.join(self.directory,'first.ini')
+        with open(first,'w') as f:
+            f.write("[FirstSection]\nmissing = from first\n")
+        self.checker.set_configuration_file(first)
+        self.checker.set_configuration_file(self.filename)
+        self.assertEqual(self.checker.get_value("FirstSection","missing"),'from first')
+        self.assertIs(self.checker.save_snapshot(self.snapshot),True)
+        other = self.make_checker()
+        self.assertIs(other.load_snapshot(self.snapshot,self.filename),True)
+        self.assertEqual(other.get_value("FirstSection","missing"),'default')
+        self.assertEqual(other.get_value("FirstSection","key_integer"),45)
+
+    def test_values_are_loaded_from_snapshot(self):
+        self.checker.set_configuration_file(self.filename)
+        self.assertIs(self.checker.save_snapshot(self.snapshot),True)
+        other = self.make_checker()
+        self.assertIs(other.load_snapshot(self.snapshot,self.filename),True)
+        self.assertEqual(other.get_value("FirstSection","key_integer"),45)
+        self.assertEqual(other.get_value("FirstSection","key_float"),23.2)
+        self.assertEqual(other.get_value("FirstSection","missing"),'default')
+        self.assertEqual(other.get_value("SecondSection","user"),'hg')
+        self.assertEqual(other.get_source("SecondSection","user"),self.filename)
+
+    def test_snapshot_is_used_without_parsing(self):
+        self.checker.set_configuration_file(self.filename)
+        self.checker.save_snapshot(self.snapshot)
+        stat = os.stat(self.filename)
+        with open(self.filename,'w') as f:
+            f.write(good_config.replace('45','46'))
+        os.utime(self.filename,ns=(stat.st_atime_ns,stat.st_mtime_ns))
+        other = self.make_checker()
+        other.load_snapshot(self.snapshot,self.filename)
+        self.assertEqual(other.get_value("FirstSection","key_integer"),45)
+
+    def test_snapshot_of_another_file_is_not_used(self):
+        self.checker.set_configuration_file(self.filename)
+        self.checker.save_snapshot(self.snapshot)
+        copy = os.path.join(self.directory,'copy.ini')
+        with open(copy,'w') as f:
+            f.write(good_config.replace('45','46'))
+        shutil.copystat(self.filename,copy)
+        other = self.make_checker()
+        self.assertIs(other.load_snapshot(self.snapshot,copy),True)
+        self.assertEqual(other.get_value("FirstSection","key_integer"),46)
+        self.assertEqual(other.get_source("FirstSection","key_integer"),copy)
+
+    def test_stale_snapshot_falls_back_to_file(self):
+        self.checker.set_configuration_file(self.filename)
+        self.checker.save_snapshot(self.snapshot)
+        with open(self.filename,'w') as f:
+            f.write(good_config.replace('45','4567'))
+        other = self.make_checker()
+        self.assertIs(other.load_snapshot(self.snapshot,self.filename),True)
+        self.assertEqual(other.get_value("FirstSection","key_integer"),4567)
+        # The snapshot was refreshed
+        third = self.make_checker()
+        third.load_snapshot(self.snapshot,self.filename)
+        self.assertEqual(third.get_value("FirstSection","key_integer"),4567)
+
+    def test_changed_expectations_make_snapshot_stale(self):
+        self.checker.set_configuration_file(self.filename)
+        self.checker.save_snapshot(self.snapshot)
+        other = self.make_checker()
+        other.remove_expectation("FirstSection","key_float")
+        other.set_expectation("FirstSection","key_float",str,'')
+        other.load_snapshot(self.snapshot,self.filename)
+        self.assertEqual(other.get_value("FirstSection","key_float"),'23.2')
+
+    def test_different_reader_makes_snapshot_stale(self):
+        self.checker.set_configuration_file(self.filename)
+        self.checker.save_snapshot(self.snapshot)
+        other = self.make_checker()
+        other.load_snapshot(self.snapshot,self.filename,reader='stream')
+        self.assertEqual(other.get_value("FirstSection","key_integer"),45)
+
+    def test_corrupt_snapshot_falls_back_to_file(self):
+        self.checker.set_configuration_file(self.filename)
+        self.checker.save_snapshot(self.snapshot)
+        with open(self.snapshot,'r+b') as f:
+            f.truncate(os.path.getsize(self.snapshot) - 3)
+        other = self.make_checker()
+        self.assertIs(other.load_snapshot(self.snapshot,self.filename),True)
+        self.assertEqual(other.get_value("FirstSection","key_integer"),45)
+
+    def test_set_values_are_not_saved(self):
+        self.checker.set_configuration_file(self.filename)
+        self.checker.set_value("FirstSection","key_integer",7)
+        self.checker.save_snapshot(self.snapshot)
+        other = self.make_checker()
+        other.load_snapshot(self.snapshot,self.filename)
+        self.assertEqual(other.get_value("FirstSection","key_integer"),0)
+
+    def test_save_before_loading_returns_false(self):
+        self.assertIs(self.checker.save_snapshot(self.snapshot),False)
+        self.assertFalse(os.path.exists(self.snapshot))
+
+    def test_missing_file_returns_false(self):
+        missing = os.path.join(self.directory,'missing.ini')
+        self.assertIs(self.checker.load_snapshot(self.snapshot,missing),False)
+        self.assertFalse(os.path.exists(self.snapshot))
+
+
+class BatchedAccessTests(unittest.TestCase):
+
+    def make_checker(self, thread_safe):
+        checker = ConfigChecker(thread_safe=thread_safe)
+        checker.set_expectation("General","retries",int,5)
+        checker.set_expectation("General","name",str,'default')
+        checker.set_expectation("My Section","my-key",float,1.5)
+        checker.set_configuration_file('missing_batched.ini')
+        return checker
+
+    def test_get_values(self):
+        for thread_safe in (False, True):
+            checker = self.make_checker(thread_safe)
+            checker.set_value("General","retries",6)
+            self.assertEqual(checker.get_values([("General","name"),("General","retries"),("My Section","my-key")]),
+                             ('default',6,1.5))
+            self.assertEqual(checker.get_values([("General","missing"),("Missing","name")]),(None,None))
+            self.assertEqual(checker.get_values([]),())
+
+    def test_get_section(self):
+        for thread_safe in (False, True):
+            checker = self.make_checker(thread_safe)
+            section = checker.get_section("General")
+            self.assertEqual(dict(section),{'retries':5,'name':'default'})
+            with self.assertRaises(TypeError):
+                section['retries'] = 6
+            self.assertIsNone(checker.get_section("Missing"))
+
+    def test_accessor(self):
+        for thread_safe in (False, True):
+            checker = self.make_checker(thread_safe)
+            config = checker.get_accessor()
+            self.assertEqual(config.General.retries,5)
+            checker.set_value("General","retries",6)
+            self.assertEqual(config.General.retries,6)
+            self.assertEqual(config['My Section']['my-key'],1.5)
+            self.assertEqual(getattr(config['My Section'],'my-key'),1.5)
+
+    def test_accessor_objects_are_cached(self):
+        checker = self.make_checker(False)
+        self.assertIs(checker.get_accessor(),checker.get_accessor())
+        self.assertIs(checker.get_accessor().General,checker.get_accessor().General)
+
+    def test_accessor_missing_key_raises(self):
+        config = self.make_checker(False).get_accessor()
+        with self.assertRaises(AttributeError):
+            config.General.missing
+        with self.assertRaises(KeyError):
+            config.General['missing']
+        with self.assertRaises(AttributeError):
+            config.__deepcopy__
+        self.assertFalse(hasattr(config.Missing,'name'))
+
+    def test_accessor_sees_later_expectations(self):
+        checker = self.make_checker(False)
+        config = checker.get_accessor()
+        checker.set_expectation("Later","enabled",bool,True)
+        checker.set_value("Later","enabled",False)
+        self.assertIs(config.Later.enabled,False)
+
+    def test_accessor_removed_key_raises(self):
+        checker = self.make_checker(False)
+        config = checker.get_accessor()
+        self.assertEqual(config.General.name,'default')
+        checker.remove_expectation("General","name")
+        with self.assertRaises(AttributeError):
+            config.General.name
+
+
+class MetricsTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory,'config.ini')
+        with open(self.filename,'w') as f:
+            f.write(good_config)
+        self.checker = ConfigChecker()
+        self.checker.set_expectation("FirstSection","key_integer",int,0)
+        self.checker.set_expectation("FirstSection","key_float",int,0)
+        self.checker.set_expectation("SecondSection","user",str,'')
+        self.reports = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_disabled_by_default(self):
+        self.checker.set_configuration_file(self.filename)
+        self.assertEqual(self.checker.stats(),{})
+        self.assertNotIn('set_value',vars(self.checker))
+
+    def test_load_is_measured(self):
+        self.checker.enable_metrics(self.reports.append)
+        self.checker.set_configuration_file(self.filename)
+        report = self.reports[0]
+        self.assertEqual(report.operation,'set_configuration_file')
+        self.assertEqual((report.keys,report.failures,report.cache_hits),(3,1,0))
+        self.assertEqual(report.bytes_read,os.path.getsize(self.filename))
+        self.assertIs(report.success,True)
+        self.assertGreaterEqual(report.seconds,0)
+
+    def test_cache_hits_are_counted(self):
+        cache = ParseCache()
+        for _ in range(2):
+            checker = ConfigChecker(parse_cache=cache)
+            checker.set_expectation("FirstSection","key_integer",int,0)
+            checker.enable_metrics()
+            checker.set_configuration_file(self.filename)
+        self.assertEqual(checker.stats()['set_configuration_file']['cache_hits'],1)
+
+    def test_write_and_set_value_are_measured(self):
+        self.checker.enable_metrics(self.reports.append)
+        self.checker.set_configuration_file(self.filename)
+        self.checker.set_value("FirstSection","key_integer",3)
+        self.checker.set_value("FirstSection","key_integer",'three')
+        self.checker.write_configuration_file()
+        stats = self.checker.stats()
+        self.assertEqual(stats['set_value']['calls'],2)
+        self.assertEqual(stats['set_value']['errors'],1)
+        self.assertEqual(stats['set_value']['failures'],1)
+        self.assertEqual(stats['write_configuration_file']['bytes_written'],os.path.getsize(self.filename))
+        self.assertEqual(stats['write_configuration_file']['keys'],3)
+
+    @unittest.skipUnless(locale.getpreferredencoding(False).lower().replace('-','') == 'utf8',"Requires a UTF-8 locale")
+    def test_write_changes_counts_bytes_read(self):
+        with open(self.filename,'wb') as f:
+            f.write("# Größe\n[FirstSection]\nkey_integer = 1\n".encode('utf-8'))
+        size = os.path.getsize(self.filename)
+        self.checker.set_configuration_file(self.filename)
+        self.checker.enable_metrics(self.reports.append)
+        self.checker.set_value("FirstSection","key_integer",3)
+        self.assertIs(self.checker.write_changes(),True)
+        self.assertEqual(self.reports[-1].operation,'write_changes')
+        self.assertEqual(self.reports[-1].bytes_read,size)
+
+    def test_nested_calls_count_in_outer_operation(self):
+        snapshot = os.path.join(self.directory,'config.snapshot')
+        self.checker.enable_metrics(self.reports.append)
+        self.checker.load_snapshot(snapshot,self.filename)
+        self.assertEqual([report.operation for report in self.reports],['load_snapshot'])
+        # 3 keys read from the file and 2 saved to the snapshot (key_float uses its default)
+        self.assertEqual(self.reports[0].keys,5)
+        self.assertGreater(self.reports[0].bytes_written,0)
+        other = ConfigChecker()
+        other.set_expectation("FirstSection","key_integer",int,0)
+        other.set_expectation("FirstSection","key_float",int,0)
+        other.set_expectation("SecondSection","user",str,'')
+        other.enable_metrics()
+        other.load_snapshot(snapshot,self.filename)
+        self.assertEqual(other.stats()['load_snapshot']['cache_hits'],1)
+
+    def test_disable_metrics(self):
+        self.checker.enable_metrics(self.reports.append)
+        self.assertIs(self.checker.disable_metrics(),True)
+        self.checker.set_configuration_file(self.filename)
+        self.assertEqual(self.reports,[])
+        self.assertEqual(self.checker.stats(),{})
+        self.assertIs(self.checker.disable_metrics(),False)
+
+    def test_thread_safe_metrics(self):
+        checker = ConfigChecker(thread_safe=True)
+        checker.set_expectation("FirstSection","key_integer",int,0)
+        checker.enable_metrics()
+        checker.set_configuration_file(self.filename)
+
+        def update():
+            for i in range(200):
+                checker.set_value("FirstSection","key_integer",i)
+        threads = [threading.Thread(target=update) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(checker.stats()['set_value']['calls'],800)
+
+
+class ValidationTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.schema = os.path.join(self.directory,'schema.json')
+        with open(self.schema,'w') as f:
+            json.dump({"General": {"retries": ["int", 3], "name": ["str", ""]}},f)
+        self.good = self.write('hosts/good.ini',"[General]\nretries = 5\nname = web\n")
+        self.bad = self.write('hosts/deep/bad.ini',"[General]\nretries = many\nextra = 1\n")
+        self.checker = ConfigChecker.from_schema(self.schema)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, name, content):
+        filename = os.path.join(self.directory,name)
+        os.makedirs(os.path.dirname(filename),exist_ok=True)
+        with open(filename,'w') as f:
+            f.write(content)
+        return filename
+
+    def run_main(self, *argv):
+        output = StringIO()
+        stdout, stderr = sys.stdout, sys.stderr
+        sys.stdout, sys.stderr = output, StringIO()
+        try:
+            code = configchecker.main(list(argv))
+        finally:
+            sys.stdout, sys.stderr = stdout, stderr
+        reports = [json.loads(line) for line in output.getvalue().splitlines()]
+        return code, {os.path.basename(report['file']): report for report in reports}
+
+    def test_valid_file(self):
+        for reader in ('stream','configparser'):
+            report = self.checker.validate_file(self.good,reader)
+            self.assertIs(report['valid'],True)
+            self.assertEqual((report['missing'],report['type_errors'],report['unknown']),([],[],[]))
+
+    def test_invalid_file(self):
+        for reader in ('stream','configparser'):
+            report = self.checker.validate_file(self.bad,reader)
+            self.assertIs(report['valid'],False)
+            self.assertEqual(report['missing'],[['General','name']])
+            self.assertEqual(report['type_errors'],[{'section':'General','key':'retries','type':'int','value':'many'}])
+            self.assertEqual(report['unknown'],[['General','extra']])
+            self.assertIsNone(report['error'])
+
+    def test_allow_unknown(self):
+        filename = self.write('extra.ini',"[General]\nretries = 5\nname = web\nextra = 1\n")
+        self.assertIs(self.checker.validate_file(filename)['valid'],False)
+        self.assertIs(self.checker.validate_file(filename,allow_unknown=True)['valid'],True)
+
+    def test_unreadable_file(self):
+        report = self.checker.validate_file(self.write('broken.ini',bad_config))
+        self.assertIs(report['valid'],False)
+        self.assertIsNotNone(report['error'])
+        report = self.checker.validate_file(os.path.join(self.directory,'missing.ini'))
+        self.assertIsNotNone(report['error'])
+
+    def test_validation_does_not_load_values(self):
+        self.checker.validate_file(self.good)
+        self.assertIsNone(self.checker.get_expectations()[0].value)
+
+    def test_main_in_process(self):
+        code, reports = self.run_main('validate',self.schema,os.path.join(self.directory,'hosts','**','*.ini'),'--jobs','1')
+        self.assertEqual(code,1)
+        self.assertEqual(sorted(reports),['bad.ini','good.ini'])
+        self.assertIs(reports['good.ini']['valid'],True)
+        self.assertIs(reports['bad.ini']['valid'],False)
+
+    def test_main_process_pool(self):
+        for i in range(20):
+            self.write('pool/host{}.ini'.format(i),"[General]\nretries = {}\nname = web\n".format(i))
+        code, reports = self.run_main('validate',self.schema,os.path.join(self.directory,'pool','*.ini'),'-j','2')
+        self.assertEqual(code,0)
+        self.assertEqual(len(reports),20)
+
+    def test_main_usage_errors(self):
+        self.assertEqual(self.run_main()[0],2)
+        self.assertEqual(self.run_main('validate',os.path.join(self.directory,'missing.json'),'*.ini')[0],2)
+
+
+converted = []
+
+class Counted(int):
+    pass
+
+register_type(Counted, lambda value: isinstance(value, int), lambda raw: converted.append(raw) or Counted(raw))
+
+class LazyTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory,'lazy.ini')
+        with open(self.filename,'w') as f:
+            f.write("[General]\nfirst = 1\nsecond = 2\nbad = x\nname = from file\n[Other]\nthird = 3\n")
+        del converted[:]
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def makeChecker(self, **kwargs):
+        checker = ConfigChecker(**kwargs)
+        checker.set_expectation("General","first",Counted,Counted(10))
+        checker.set_expectation("General","second",Counted,Counted(20))
+        checker.set_expectation("General","bad",Counted,Counted(30))
+        checker.set_expectation("General","name",str,'default')
+        checker.set_expectation("General","missing",Counted,Counted(40))
+        checker.set_expectation("Other","third",Counted,Counted(50))
+        return checker
+
+    def test_values_are_converted_when_first_read(self):
+        checker = self.makeChecker(lazy=True)
+        self.assertTrue(checker.set_configuration_file(self.filename,reader='stream'))
+        self.assertEqual(converted,[])
+        self.assertEqual(checker.get_value("General","first"),1)
+        self.assertEqual(checker.get_value("General","first"),1)
+        self.assertEqual(converted,['1'])
+        self.assertEqual(checker.get_value("General","bad"),30)
+        self.assertEqual(checker.get_value("General","missing"),40)
+        self.assertEqual(checker.get_values([("General","second"),("General","name")]),(2,'from file'))
+        self.assertEqual(checker.get_accessor().Other.third,3)
+        self.assertEqual(converted,['1','x','2','3'])
+
+    def test_lazy_values_match_converted_values(self):
+        lazy = self.makeChecker(lazy=True)
+        lazy.set_configuration_file(self.filename)
+        eager = self.makeChecker()
+        eager.set_configuration_file(self.filename)
+        self.assertEqual(dict(lazy.get_section("General")),dict(eager.get_section("General")))
+        self.assertEqual(lazy.get_source("Other","third"),self.filename)
+        self.assertEqual(lazy.get_source("General","bad"),None)
+        self.assertEqual([dict(e) for e in lazy.get_expectations()],[dict(e) for e in eager.get_expectations()])
+
+    def test_values_set_or_reloaded_before_being_read(self):
+        checker = self.makeChecker(lazy=True)
+        checker.set_configuration_file(self.filename,reader='mmap')
+        self.assertTrue(checker.set_value("General","first",Counted(5)))
+        with open(self.filename,'w') as f:
+            f.write("[General]\nfirst = 1\nsecond = 7\nbad = x\n[Other]\nthird = 3\n")
+        self.assertEqual(checker.reload(),{("General","second"),("General","name")})
+        self.assertEqual(checker.get_value("General","first"),5)
+        self.assertEqual(checker.get_value("General","second"),7)
+        self.assertNotIn('1',converted)
+        self.assertTrue(checker.write_configuration_file())
+        with open(self.filename) as f:
+            self.assertIn("third = 3\n",f.read())
+
+    def test_lazy_is_ignored_in_thread_safe_mode(self):
+        checker = self.makeChecker(lazy=True,thread_safe=True)
+        checker.set_configuration_file(self.filename)
+        self.assertEqual(len(converted),4)
+        self.assertEqual(checker.get_value("Other","third"),3)
+
+class OverrideTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory,'config.ini')
+        with open(self.filename,'w') as f:
+            f.write("[General]\nretries = 3\nfactor = 1.5\n[web.server]\nport = 80\n")
+        self.checker = ConfigChecker()
+        self.checker.set_expectation("General","retries",int,5)
+        self.checker.set_expectation("General","factor",float,2.5)
+        self.checker.set_expectation("General","enabled",bool,False)
+        self.checker.set_expectation("web.server","port",int,8080)
+        self.checker.set_configuration_file(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_environment_variables_override_values(self):
+        report = self.checker.apply_overrides({"GENERAL__RETRIES": "7", "WEB_SERVER__PORT": "8000", "PATH": "/bin"},argv=())
+        self.assertEqual(sorted(report.applied),[("General","retries"),("web.server","port")])
+        self.assertEqual(report.rejected,[])
+        self.assertEqual(self.checker.get_value("General","retries"),7)
+        self.assertEqual(self.checker.get_value("web.server","port"),8000)
+        self.assertEqual(self.checker.get_value("General","factor"),1.5)
+        self.assertEqual(self.checker.get_source("General","retries"),'<environment>')
+
+    def test_command_line_takes_precedence(self):
+        report = self.checker.apply_overrides({"GENERAL__RETRIES": "7", "GENERAL__ENABLED": "yes"},
+                                              ["run","--General.retries=9","--verbose","--web.server.port","8001"])
+        self.assertEqual(self.checker.get_values([("General","retries"),("General","enabled"),("web.server","port")]),(9,True,8001))
+        self.assertEqual(self.checker.get_source("General","retries"),'<command line>')
+        self.assertEqual(len(report.applied),3)
+
+    def test_prefix_and_rejected_overrides(self):
+        report = self.checker.apply_overrides({"APP_GENERAL__RETRIES": "many", "APP_GENERAL__FACTOR": "0.5",
+                                               "APP_OTHER__KEY": "1", "GENERAL__ENABLED": "yes"},
+                                              ["--General.factor"],prefix="APP_")
+        self.assertEqual(report.applied,[("General","factor")])
+        self.assertEqual(sorted(report.rejected),[("--General.factor","Missing value"),
+                                                  ("APP_GENERAL__RETRIES","Cannot be converted to int"),
+                                                  ("APP_OTHER__KEY","No matching expectation")])
+        self.assertEqual(self.checker.get_value("General","retries"),3)
+        self.assertEqual(self.checker.get_value("General","factor"),0.5)
+        self.assertEqual(self.checker.get_value("General","enabled"),False)
+
+    def test_names_follow_expectation_changes(self):
+        self.checker.apply_overrides({},argv=())
+        self.checker.set_expectation("General","name",str,'default')
+        self.checker.apply_overrides({"GENERAL__NAME": "from environment"},argv=())
+        self.assertEqual(self.checker.get_value("General","name"),"from environment")
+
+class SetValuesTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory,'config.ini')
+        with open(self.filename,'w') as f:
+            f.write("# Settings\n[General]\nretries = 3\nname = old\n")
+        self.checker = ConfigChecker()
+        self.checker.set_expectation("General","retries",int,5)
+        self.checker.set_expectation("General","name",str,'default')
+        self.checker.set_expectation("General","enabled",bool,False)
+        self.checker.set_configuration_file(self.filename)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_all_values_are_set(self):
+        self.assertTrue(self.checker.set_values({("General","retries"): 4, ("General","name"): "new"}))
+        self.assertEqual(self.checker.get_values([("General","retries"),("General","name")]),(4,"new"))
+        self.assertTrue(self.checker.set_values([(("General","enabled"),True)]))
+        self.assertEqual(self.checker.get_value("General","enabled"),True)
+
+    def test_invalid_value_changes_nothing(self):
+        for values in ({("General","retries"): 4, ("General","enabled"): "maybe"},
+                       {("General","retries"): 4, ("General","missing"): 5},
+                       [(("General","retries"),4),("General","name")]):
+            self.assertFalse(self.checker.set_values(values))
+            self.assertEqual(self.checker.get_value("General","retries"),3)
+
+    def test_values_are_written_once(self):
+        self.assertTrue(self.checker.set_values({("General","retries"): 4, ("General","enabled"): True},write=True))
+        with open(self.filename) as f:
+            self.assertEqual(f.read(),"# Settings\n[General]\nretries = 4\nname = old\nenabled = True\n")
+        self.assertEqual(self.checker.get_value("General","retries"),4)
+
+    def test_failed_write_restores_values(self):
+        os.remove(self.filename)
+        os.mkdir(self.filename)
+        self.assertFalse(self.checker.set_values({("General","retries"): 4},write=True))
+        self.assertEqual(self.checker.get_value("General","retries"),3)
+
+    def test_transaction(self):
+        with self.checker.transaction(write=True) as changes:
+            changes.set_value("General","retries",6)
+            self.assertEqual(changes.get_value("General","retries"),6)
+            self.assertEqual(self.checker.get_value("General","retries"),3)
+            changes.set_value("General","name","new")
+        self.assertTrue(changes.committed)
+        self.assertEqual(ConfigChecker.from_schema(Schema.from_checker(self.checker)).set_configuration_file(self.filename),True)
+        with open(self.filename) as f:
+            self.assertIn("retries = 6\nname = new\n",f.read())
+
+    def test_failed_transaction_changes_nothing(self):
+        with self.checker.transaction() as changes:
+            changes.set_value("General","retries",6)
+            changes.set_value("General","retries","six")
+        self.assertFalse(changes.committed)
+        with self.assertRaises(KeyError):
+            with self.checker.transaction() as changes:
+                changes.set_value("General","retries",7)
+                raise KeyError()
+        self.assertFalse(changes.committed)
+        self.assertEqual(self.checker.get_value("General","retries"),3)
+
+    def test_thread_safe_values_are_published_together(self):
+        checker = ConfigChecker(thread_safe=True)
+        checker.set_expectation("General","retries",int,5)
+        checker.set_expectation("General","name",str,'default')
+        checker.set_configuration_file(self.filename)
+        snapshot = checker.get_snapshot()
+        self.assertTrue(checker.set_values({("General","retries"): 4, ("General","name"): "new"}))
+        self.assertEqual(dict(checker.get_snapshot()["General"]),{"retries": 4, "name": "new"})
+        self.assertEqual(snapshot["General"]["retries"],3)
+
+class SubscriptionTests(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.filename = os.path.join(self.directory,'config.ini')
+        self.writeConfig("[General]\nretries = 3\nname = first\n")
+        self.checker = ConfigChecker()
+        self.checker.set_expectation("General","retries",int,5)
+        self.checker.set_expectation("General","name",str,'default')
+        self.checker.set_configuration_file(self.filename)
+        self.changes = []
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def writeConfig(self, content):
+        with open(self.filename,'w') as f:
+            f.write(content)
+
+    def record(self, section, key, value):
+        self.changes.append((section,key,value))
+
+    def test_only_changed_values_are_notified(self):
+        self.assertTrue(self.checker.subscribe("General","retries",self.record))
+        self.checker.set_value("General","retries",3)
+        self.checker.set_value("General","name","second")
+        self.assertEqual(self.changes,[])
+        self.checker.set_value("General","retries",4)
+        self.checker.set_values({("General","retries"): 6, ("General","name"): "third"})
+        self.assertEqual(self.changes,[("General","retries",4),("General","retries",6)])
+
+    def test_loading_files_notifies_changes(self):
+        self.checker.subscribe("General","retries",self.record)
+        self.checker.subscribe("General","name",self.record)
+        self.writeConfig("[General]\nretries = 7\nname = first\n")
+        self.checker.set_configuration_file(self.filename)
+        self.assertEqual(self.changes,[("General","retries",7)])
+        self.writeConfig("[General]\nretries = 7\n")
+        self.checker.reload()
+        self.assertEqual(self.changes[1:],[("General","name","default")])
+        self.checker.apply_overrides({"GENERAL__RETRIES": "8"},argv=())
+        self.assertEqual(self.changes[2:],[("General","retries",8)])
+
+    def test_lazy_values_are_compared(self):
+        checker = ConfigChecker(lazy=True)
+        checker.set_expectation("General","retries",int,5)
+        checker.set_configuration_file(self.filename)
+        checker.subscribe("General","retries",self.record)
+        self.writeConfig("[General]\nretries = 9\n")
+        checker.set_configuration_file(self.filename)
+        self.assertEqual(self.changes,[("General","retries",9)])
+
+    def test_unsubscribe(self):
+        self.assertFalse(self.checker.subscribe("General","missing",self.record))
+        self.checker.subscribe("General","retries",self.record)
+        self.assertTrue(self.checker.unsubscribe("General","retries",self.record))
+        self.assertFalse(self.checker.unsubscribe("General","retries",self.record))
+        self.checker.set_value("General","retries",4)
+        self.assertEqual(self.changes,[])
+
+    def test_failing_callback_is_logged(self):
+        def fail(section, key, value):
+            raise RuntimeError()
+        self.checker.subscribe("General","retries",fail)
+        self.checker.subscribe("General","retries",self.record)
+        self.assertTrue(self.checker.set_value("General","retries",4))
+        self.assertEqual(self.changes,[("General","retries",4)])
+
+    def test_callbacks_on_executor(self):
+        with concurrent.futures.ThreadPoolExecutor(1) as executor:
+            threads = []
+            self.checker.subscribe("General","retries",lambda *change: threads.append(threading.current_thread()),executor)
+            self.checker.set_value("General","retries",4)
+        self.assertEqual(len(threads),1)
+        self.assertIsNot(threads[0],threading.current_thread())
+
 class ReadingValuesTests(unittest.TestCase):
 
     def setUp(self):